@@ -1,7 +1,11 @@
 #!/bin/bash
 
-# Input JSON file
+# Input JSON file, the journal of job changes the watcher has not folded into it yet,
+# and the gzip JSON-lines archive of done jobs the watcher has moved out of it
 input_file="agent.state"
+journal_file="${input_file}.journal"
+[ -f "$journal_file" ] || journal_file=/dev/null
+archive_file="${input_file}.archive.gz"
 
 # Output TSV file
 output_file="summary.tsv"
@@ -9,10 +13,22 @@ output_file="summary.tsv"
 # Write header
 echo -e "workflow_id\twas_informed_by\tactivity_id\tlast_status\tdone\tjaws_jobid\tnmdc_jobid\tstart" > "$output_file"
 
-# Extract data with jq and append to the file
+# Stream the archive; the watcher may leave a torn record at its end, which is skipped
+read_archive() {
+  [ -f "$archive_file" ] || return 0
+  zcat "$archive_file" 2>/dev/null | jq -c -R 'fromjson? // empty'
+}
+
+# Extract data with jq and append to the file.
+# The latest record of a job wins: archive, then state file, then journal.
 # jq -r '.jobs[] | select(.workflow != null) | [.workflow.id, .config.was_informed_by, .config.activity_id, .last_status] | @tsv' "$input_file" >> "$output_file"
-jq -r '
-  .jobs[]
+read_archive | jq -r -n --slurpfile state "$input_file" --slurpfile journal "$journal_file" '
+  def key: (.opid // .nmdc_jobid) | tostring;
+  reduce inputs as $job ({}; .[$job | key] = $job)
+  | reduce $state[0].jobs[] as $job (.; .[$job | key] = $job)
+  | reduce $journal[] as $entry (.;
+      if $entry.put then .[$entry.put | key] = $entry.put else del(.[$entry.delete | tostring]) end)
+  | .[]
   | [
       .workflow.id,
       (.config.was_informed_by | join(",")),
@@ -24,7 +40,6 @@ jq -r '
       .start
     ]
   | @tsv
-' "$input_file" >> "$output_file"
+' >> "$output_file"
 
 echo "Saved extracted data to $output_file"
-
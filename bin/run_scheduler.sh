@@ -64,6 +64,13 @@ show_help() {
   echo "  -k, --mock             Use fake IDs for testing   (no real API minting)" 
   echo "  -n, --dryrun           Jobs not inserted into MongoDB" 
   echo "  -f, --force            Ignore version compatibility checks" 
+  echo "  -I, --incremental      Keep the workflow graph between cycles" 
+  echo "  -g, --snapshot PATH    Save/restore the workflow graph for restarts (implies -I)" 
+  echo "  -M, --metrics PATH     Append per-cycle phase timings to this JSON-lines file" 
+  echo "  -P, --prometheus PATH  Write per-cycle metrics to this Prometheus textfile" 
+  echo "  -S, --shards N         Schedule in N worker processes, or auto for one per core" 
+  echo "      --shard-by KEY     Partition data generations by id or study (default: id)" 
+  echo "  -T, --trigger PATH     Start a cycle at once when this file is created" 
   echo "  -m, --mute             Silence Slack notifications" 
   echo "  -t, --test             Run wrapper in test mode" 
   echo "  -ta, --actual          Run wrapper in test mode with sched code" 
@@ -87,6 +94,13 @@ while [[ $# -gt 0 ]]; do
         -n|--dryrun)    DRYRUN=1; shift ;;
         -k|--mock)      MOCK_MINT=1; shift ;;
         -f|--force)     FORCE=1; shift ;;
+        -I|--incremental) INCREMENTAL=1; shift ;;
+        -g|--snapshot)  GRAPH_SNAPSHOT_FILE="$2"; shift 2 ;;
+        -M|--metrics)   SCHEDULER_METRICS_FILE="$2"; shift 2 ;;
+        -P|--prometheus) SCHEDULER_PROMETHEUS_FILE="$2"; shift 2 ;;
+        -S|--shards)    SCHEDULER_SHARDS="$2"; shift 2 ;;
+        --shard-by)     SCHEDULER_SHARD_BY="$2"; shift 2 ;;
+        -T|--trigger)   SCHEDULER_TRIGGER_FILE="$2"; shift 2 ;;
         -m|--mute)      MUTE=1; shift ;;
         -t|--test)      TEST=1; shift ;;
         -ta|--actual)   TEST=1; ACTUAL=1; shift ;;
@@ -114,6 +128,13 @@ export NMDC_WORKFLOW_YAML_FILE="$YAML"
 export NMDC_SITE_CONF="$CONF"
 export NMDC_LOG_LEVEL=INFO # info by default every time. 
 export DRYRUN="$DRYRUN"
+export INCREMENTAL="${INCREMENTAL:-0}"
+export GRAPH_SNAPSHOT_FILE="${GRAPH_SNAPSHOT_FILE:-}"
+export SCHEDULER_METRICS_FILE="${SCHEDULER_METRICS_FILE:-}"
+export SCHEDULER_PROMETHEUS_FILE="${SCHEDULER_PROMETHEUS_FILE:-}"
+export SCHEDULER_SHARDS="${SCHEDULER_SHARDS:-1}"
+export SCHEDULER_SHARD_BY="${SCHEDULER_SHARD_BY:-id}"
+export SCHEDULER_TRIGGER_FILE="${SCHEDULER_TRIGGER_FILE:-}"
 export SKIPLISTFILE="$SKIP"
 export ALLOWLISTFILE="$LIST"
 
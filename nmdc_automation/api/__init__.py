@@ -1 +1,2 @@
 from .nmdcapi import NmdcRuntimeApi
+from .id_pool import IdPool
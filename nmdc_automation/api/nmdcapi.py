@@ -5,11 +5,12 @@ import sys
 import os
 from time import sleep as _sleep
 from os.path import join, dirname
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 from pydantic import BaseModel
 import requests
 import hashlib
 import mimetypes
+import threading
 from pathlib import Path
 from time import time
 from typing import Union, List
@@ -56,6 +57,46 @@ def expiry_dt_from_now(days=0, hours=0, minutes=0, seconds=0):
                                           minutes=minutes,
                               seconds=seconds)
 
+class ApiStats:
+    """
+    Thread-safe call counts and latencies per runtime API endpoint, recorded
+    from the session response hook. Endpoints are keyed by method and the
+    first path segment, e.g. "GET jobs" or "POST queries:run".
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def endpoint(self, method: str, url: str) -> str:
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else urlsplit(url).path.lstrip("/")
+        return f"{method} {path.split('?')[0].split('/')[0]}"
+
+    def record_response(self, response, *args, **kwargs):
+        key = self.endpoint(response.request.method, response.request.url)
+        seconds = response.elapsed.total_seconds()
+        with self._lock:
+            stats = self._endpoints.setdefault(key, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if not response.ok:
+                stats["errors"] += 1
+        return response
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(stats["calls"] for stats in self._endpoints.values())
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                key: dict(stats, mean_seconds=stats["total_seconds"] / stats["calls"])
+                for key, stats in self._endpoints.items()
+            }
+
+
 class NmdcRuntimeApi:
     token = None
     expires_at = 0
@@ -76,7 +117,11 @@ class NmdcRuntimeApi:
         }
         if self._base_url[-1] != "/":
             self._base_url += "/"
+        self.timeout = (self.config.api_connect_timeout, self.config.api_read_timeout)
+        self.stats = ApiStats(self._base_url)
+        # All API calls share one keep-alive session
         self.session = requests.Session()
+        self.session.hooks["response"].append(self.stats.record_response)
         retries = Retry(
             total=6,
             # Explicitly handle network-level issues
@@ -90,10 +135,36 @@ class NmdcRuntimeApi:
             # Ensure it doesn't think the request is "unsafe" to repeat
             allowed_methods=None
         )
-        adapter = HTTPAdapter(max_retries=retries)
+        pool_size = self.config.api_pool_size
+        # The list_from_collection crawl retries transient errors at the connection level;
+        # everything else is retried by the tenacity decorators on each method.
+        crawl_adapter = HTTPAdapter(max_retries=retries, pool_connections=1, pool_maxsize=pool_size)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount(f"{self._base_url}nmdcschema/", crawl_adapter)
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
 
+    def http_stats(self) -> dict:
+        """
+        Per-endpoint call counts and latencies, plus connection reuse across the session pools.
+        """
+        requests_sent = 0
+        connections_opened = 0
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+        return {
+            "endpoints": self.stats.summary(),
+            "connections": {
+                "requests": requests_sent,
+                "opened": connections_opened,
+                "reused": requests_sent - connections_opened,
+            },
+        }
+
     def refresh_token(func):
         def _get_token(self, *args, **kwargs):
             # If it expires in 60 seconds, refresh
@@ -120,7 +191,7 @@ class NmdcRuntimeApi:
         }
         url = self._base_url + "token"
         try:
-            resp = requests.post(url, headers=h, data=data)
+            resp = self.session.post(url, headers=h, data=data, timeout=self.timeout)
             # Check for API rejection (4xx or 5xx status codes)
             if not resp.ok:
                 logging.error(f"Failed to get token: {resp.text}")
@@ -167,13 +238,27 @@ class NmdcRuntimeApi:
     def minter(self, id_type, informed_by=None):
         url = f"{self._base_url}pids/mint"
         data = {"schema_class": {"id": id_type}, "how_many": 1}
-        resp = requests.post(url, data=json.dumps(data), headers=self.header)
+        resp = self.session.post(url, data=json.dumps(data), headers=self.header, timeout=self.timeout)
         if not resp.ok:
             logging.error(f"Response failed for: url: {url}, data: {data}, header: {self.header}")
             raise ValueError(f"Failed to mint ID of type {id_type} HTTP status: {resp.status_code} / ({resp.reason})")
         id = resp.json()[0]
         return id
 
+    @retry(wait=wait_exponential(multiplier=4, min=8, max=120), stop=stop_after_attempt(6), reraise=True)
+    @refresh_token
+    def mint_ids(self, id_type, how_many) -> List[str]:
+        """
+        Mint `how_many` IDs of the given schema class in a single request.
+        """
+        url = f"{self._base_url}pids/mint"
+        data = {"schema_class": {"id": id_type}, "how_many": how_many}
+        resp = self.session.post(url, data=json.dumps(data), headers=self.header, timeout=self.timeout)
+        if not resp.ok:
+            logging.error(f"Response failed for: url: {url}, data: {data}, header: {self.header}")
+            raise ValueError(f"Failed to mint {how_many} IDs of type {id_type} HTTP status: {resp.status_code} / ({resp.reason})")
+        return resp.json()
+
     @retry(wait=wait_exponential(multiplier=4, min=8, max=120), stop=stop_after_attempt(6), reraise=True)
     @refresh_token
     def mint(self, ns, typ, ct):
@@ -186,7 +271,7 @@ class NmdcRuntimeApi:
         """
         url = self._base_url + "ids/mint"
         d = {"populator": "", "naa": ns, "shoulder": typ, "number": ct}
-        resp = requests.post(url, headers=self.header, data=json.dumps(d))
+        resp = self.session.post(url, headers=self.header, data=json.dumps(d), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -198,7 +283,7 @@ class NmdcRuntimeApi:
         Helper function to get object info
         """
         url = "%sobjects/%s" % (self._base_url, obj)
-        resp = requests.get(url, headers=self.header)
+        resp = self.session.get(url, headers=self.header, timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         data = resp.json()
@@ -252,7 +337,7 @@ class NmdcRuntimeApi:
             "id": sha,
             "self_uri": "todo",
         }
-        resp = requests.post(url, headers=self.header, data=json.dumps(d))
+        resp = self.session.post(url, headers=self.header, data=json.dumps(d), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -275,7 +360,10 @@ class NmdcRuntimeApi:
                 params["filter"] = json.dumps(filt)
             if projection:
                 #url += "&projection=%s" % (projection)
-                params["projection"] = json.dumps(projection)
+                # the API takes a comma-separated list of field names
+                if not isinstance(projection, str):
+                    projection = ",".join(projection)
+                params["projection"] = projection.replace(" ", "")
 
             results = []
             try:
@@ -322,7 +410,7 @@ class NmdcRuntimeApi:
     def post_workflow_executions(self, obj_data):
         url = self._base_url + "workflows/workflow_executions"
 
-        resp = requests.post(url, headers=self.header, data=json.dumps(obj_data))
+        resp = self.session.post(url, headers=self.header, data=json.dumps(obj_data), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -332,7 +420,7 @@ class NmdcRuntimeApi:
     def set_type(self, obj, typ):
         url = "%sobjects/%s/types" % (self._base_url, obj)
         d = [typ]
-        resp = requests.put(url, headers=self.header, data=json.dumps(d))
+        resp = self.session.put(url, headers=self.header, data=json.dumps(d), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -343,7 +431,7 @@ class NmdcRuntimeApi:
         url = "%sobjects/%s" % (self._base_url, obj)
         now = datetime.today().isoformat()
         d = {"created_time": now}
-        resp = requests.patch(url, headers=self.header, data=json.dumps(d))
+        resp = self.session.patch(url, headers=self.header, data=json.dumps(d), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -352,7 +440,7 @@ class NmdcRuntimeApi:
     @refresh_token
     def create_job(self, job_obj):
         url = "%sjobs" % (self._base_url)
-        resp = requests.post(url, headers=self.header, data=json.dumps(job_obj))
+        resp = self.session.post(url, headers=self.header, data=json.dumps(job_obj), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -373,7 +461,7 @@ class NmdcRuntimeApi:
         
         results = []
         while True:
-            resp = requests.get(url, headers=self.header, params=params)
+            resp = self.session.get(url, headers=self.header, params=params, timeout=self.timeout)
             if resp.status_code != 200:
                 # todo make this exit with failure more cleanly -jlp 20251104
                 resp.raise_for_status()
@@ -401,7 +489,7 @@ class NmdcRuntimeApi:
     @refresh_token
     def get_job(self, job_id: str):
         url = "%sjobs/%s" % (self._base_url, job_id)
-        resp = requests.get(url, headers=self.header)
+        resp = self.session.get(url, headers=self.header, timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status
         return resp.json()
@@ -410,7 +498,7 @@ class NmdcRuntimeApi:
     @refresh_token
     def claim_job(self, job_id: str):
         url = "%sjobs/%s:claim" % (self._base_url, job_id)
-        resp = requests.post(url, headers=self.header)
+        resp = self.session.post(url, headers=self.header, timeout=self.timeout)
         if resp.status_code == 409:
             claimed = True
         else:
@@ -426,7 +514,7 @@ class NmdcRuntimeApi:
         Release a job that was previously claimed.
         """
         url = "%sjobs/%s:release" % (self._base_url, job_id)
-        resp = requests.post(url, headers=self.header)
+        resp = self.session.post(url, headers=self.header, timeout=self.timeout)
         if resp.status_code == 404:
             logging.warning(f"Job {job_id} not found or already released.")
             return None
@@ -436,7 +524,7 @@ class NmdcRuntimeApi:
         orig_url = url
         results = []
         while True:
-            resp = requests.get(url, headers=self.header).json()
+            resp = self.session.get(url, headers=self.header, timeout=self.timeout).json()
             if "resources" not in resp:
                 logging.warning(str(resp))
                 break
@@ -464,7 +552,7 @@ class NmdcRuntimeApi:
         orig_url = url
         results = []
         while True:
-            resp = requests.get(url, headers=self.header).json()
+            resp = self.session.get(url, headers=self.header, timeout=self.timeout).json()
             if "resources" not in resp:
                 logging.warning(str(resp))
                 break
@@ -493,7 +581,7 @@ class NmdcRuntimeApi:
     @refresh_token
     def get_op(self, opid):
         url = "%soperations/%s" % (self._base_url, opid)
-        resp = requests.get(url, headers=self.header)
+        resp = self.session.get(url, headers=self.header, timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -520,7 +608,7 @@ class NmdcRuntimeApi:
                 return None
             d["metadata"] = cur["metadata"]
             d["metadata"]["extra"] = meta
-        resp = requests.patch(url, headers=self.header, data=json.dumps(d))
+        resp = self.session.patch(url, headers=self.header, data=json.dumps(d), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -528,7 +616,7 @@ class NmdcRuntimeApi:
     def _run_query_single(self, query):
         url = "%squeries:run" % self._base_url
         try:
-            resp = requests.post(url, headers=self.header, data=json.dumps(query))
+            resp = self.session.post(url, headers=self.header, data=json.dumps(query), timeout=self.timeout)
             if not resp.ok:
                 resp.raise_for_status()
             return resp.json()
@@ -576,6 +664,22 @@ class NmdcRuntimeApi:
         return all_results
 
 
+    def count_documents(self, collection: str, timeout=(5, 10)) -> int:
+        """
+        Count the documents in a collection with one $count aggregation. Unlike run_query
+        this is tried once, with a short timeout, so a cheap probe can't block for long
+        while the API is down; errors are raised to the caller.
+        """
+        if not self.token or self.expires_at < time() + 60:
+            type(self).get_token.retry_with(stop=stop_after_attempt(1))(self)
+        url = "%squeries:run" % self._base_url
+        query = {"aggregate": collection, "pipeline": [{"$count": "n"}]}
+        resp = self.session.post(url, headers=self.header, data=json.dumps(query), timeout=timeout)
+        if not resp.ok:
+            resp.raise_for_status()
+        batch = resp.json().get("cursor", {}).get("batch", [])
+        return batch[0]["n"] if batch else 0
+
     @retry(wait=wait_exponential(multiplier=4, min=8, max=120), stop=stop_after_attempt(6), reraise=True)
     def find_planned_processes(self, filter: dict):
         # construct filter params
@@ -590,7 +694,7 @@ class NmdcRuntimeApi:
         encoded_params = urlencode(params)
         url = f"{self._base_url}planned_processes?{encoded_params}"
         logger.info(url)
-        resp = requests.get(url, headers=self.header)
+        resp = self.session.get(url, headers=self.header, timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()["results"]
@@ -598,7 +702,7 @@ class NmdcRuntimeApi:
     @retry(wait=wait_exponential(multiplier=4, min=8, max=120), stop=stop_after_attempt(6), reraise=True)
     def find_data_objects(self, data_object_id):
         url = "%sdata_objects/%s" % (self._base_url, data_object_id)
-        resp = requests.get(url, headers=self.header)
+        resp = self.session.get(url, headers=self.header, timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -606,7 +710,7 @@ class NmdcRuntimeApi:
     @refresh_token
     def validate_metadata(self, metadata):
         url = "%smetadata/json:validate" % self._base_url
-        resp = requests.post(url, headers=self.header, data=json.dumps(metadata))
+        resp = self.session.post(url, headers=self.header, data=json.dumps(metadata), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -614,7 +718,7 @@ class NmdcRuntimeApi:
     @refresh_token
     def submit_metadata(self, metadata):
         url = "%smetadata/json:submit" % self._base_url
-        resp = requests.post(url, headers=self.header, data=json.dumps(metadata))
+        resp = self.session.post(url, headers=self.header, data=json.dumps(metadata), timeout=self.timeout)
         if not resp.ok:
             resp.raise_for_status()
         return resp.json()
@@ -74,6 +74,22 @@ class SiteConfig:
     def api_url(self):
         return self.config_data["nmdc"]["api_url"]
     
+    @property
+    def api_pool_size(self):
+        return self.config_data["nmdc"].get("api_pool_size", 10)
+
+    @property
+    def api_connect_timeout(self):
+        return self.config_data["nmdc"].get("api_connect_timeout", 10)
+
+    @property
+    def api_read_timeout(self):
+        return self.config_data["nmdc"].get("api_read_timeout", 300)
+
+    @property
+    def job_batch_size(self):
+        return self.config_data["nmdc"].get("job_batch_size", 50)
+
     @property
     def results_path(self):
         return self.config_data.get("data_path_map", {}).get("results_path", None)
@@ -90,6 +106,14 @@ class SiteConfig:
     def agent_state(self):
         return self.config_data.get("state", {}).get("agent_state", None)
 
+    @property
+    def id_pool_file(self):
+        return self.config_data.get("state", {}).get("id_pool_file", None)
+
+    @property
+    def id_pool_size(self):
+        return self.config_data.get("state", {}).get("id_pool_size", 50)
+
     @property
     def activity_id_state(self):
         return self.config_data["state"]["activity_id_state"]
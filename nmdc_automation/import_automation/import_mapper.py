@@ -21,6 +21,8 @@ class ImportMapper:
     - nucleotide_sequencing_id: The NMDC ID for the Data Generation record that will serve as the root node in the DB.
     - import_project_dir: The import project directory path.
     - import_yaml: The file path of the yaml file containing import specifications.
+    Optional:
+    - id_pool: An IdPool to mint new IDs from instead of calling the runtime API per ID.
 
     Attributes:
     - data_object_mappings: A set of DataObjectMapping objects.
@@ -43,12 +45,14 @@ class ImportMapper:
 
     def __init__(
             self, nucleotide_sequencing_id: str,
-            import_project_dir: str, import_yaml: str, runtime_api
+            import_project_dir: str, import_yaml: str, runtime_api, id_pool=None
     ):
         self.data_generation_id = nucleotide_sequencing_id # sequencing is a type of data_generation
         self.import_project_dir = import_project_dir
         self.import_yaml = import_yaml
         self.runtime_api = runtime_api
+        # mint from a shared pre-minted pool if given, one API call per ID otherwise
+        self._minter = id_pool.mint if id_pool else runtime_api.minter
 
         self.data_object_mappings = set()
 
@@ -86,7 +90,7 @@ class ImportMapper:
             if data_object_type in ids:
                 return ids[data_object_type]
             else:
-                data_obj_id = self.runtime_api.minter(object_type)
+                data_obj_id = self._minter(object_type)
                 logger.info(f"Minted new ID:  {data_obj_id}")
                 self.minted_ids["data_object_ids"][data_object_type] = data_obj_id
                 return data_obj_id
@@ -95,7 +99,7 @@ class ImportMapper:
             if object_type in ids:
                 return ids[object_type]
             else:
-                workflow_obj_id = self.runtime_api.minter(object_type) + ".1"
+                workflow_obj_id = self._minter(object_type) + ".1"
                 logger.info(f"Minted new ID:  {workflow_obj_id}")
                 self.minted_ids["workflow_execution_ids"][object_type] = workflow_obj_id
                 return workflow_obj_id
@@ -1,11 +1,14 @@
 """ Factory methods for NMDC models. """
+import copy
 import importlib.resources
+from decimal import Decimal
 from typing import Any, Dict, Union
 import linkml_runtime
 import linkml.validator
 import importlib.resources
 from functools import lru_cache
-from linkml_runtime.dumpers import yaml_dumper
+from jsonasobj2 import JsonObj
+from linkml_runtime.utils.enumerations import EnumDefinitionImpl
 import yaml
 
 
@@ -98,6 +101,45 @@ def _normalize_mags_record(record: Dict[str, Any]) -> Dict[str, Any]:
     return record
 
 
+def schema_object_to_dict(element: Any) -> Dict[str, Any]:
+    """
+    Convert a nmdc-schema object (e.g. a DataObject or Database) to plain python types.
+    Gives the same result as yaml.safe_load(yaml_dumper.dumps(element)) without the
+    round trip through YAML text.
+    """
+    return _plain_value(element)
+
+
+def _plain_value(value: Any) -> Any:
+    """ Recursively convert a schema value, dropping empty values and protected keys """
+    if isinstance(value, EnumDefinitionImpl):
+        return str(value.code.text)
+    if isinstance(value, JsonObj):
+        value = vars(value)
+    if isinstance(value, dict):
+        plain = {}
+        for k, v in value.items():
+            if k.startswith("_"):
+                continue
+            v = _plain_value(v)
+            if not _is_empty(v):
+                plain[k] = v
+        return plain
+    if isinstance(value, list):
+        return [v for v in map(_plain_value, value) if not _is_empty(v)]
+    if isinstance(value, str):
+        # drop str subclasses like URIorCURIE and XSDDateTime
+        return str(value)
+    if isinstance(value, Decimal):
+        text = str(value)
+        return float(value) if "." in text and not text.endswith(".0") else int(value)
+    return value
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, (dict, list)) and not value)
+
+
 def _strip_empty_values(d: Dict[str, Any]) -> Dict[str, Any]:
     """ Strip empty values from a record """
     empty_values = [None, "", []]
@@ -121,6 +163,14 @@ class DataObject(nmdc.DataObject):
             record["type"] = "nmdc:DataObject"
         super().__init__(**record)
 
+    # holds the memoized as_dict result outside of the dataclass fields
+    __slots__ = ("_as_dict_cache",)
+
+    def __setattr__(self, key, value):
+        super().__setattr__(key, value)
+        if key != "_as_dict_cache":
+            object.__setattr__(self, "_as_dict_cache", None)
+
     # override the base class data_object_type (FileTypeEnum) to return a string
     @property
     def data_object_type_text(self) -> str:
@@ -129,7 +179,96 @@ class DataObject(nmdc.DataObject):
 
 
     def as_dict(self) -> Dict[str, Any]:
-        """ Convert the object to a dictionary """
-        return yaml.safe_load(yaml_dumper.dumps(self))
+        """
+        Convert the object to a dictionary. The result is memoized until a field is
+        reassigned; nested values are shared, so treat them as read-only.
+        """
+        cached = getattr(self, "_as_dict_cache", None)
+        if cached is None:
+            cached = schema_object_to_dict(self)
+            object.__setattr__(self, "_as_dict_cache", cached)
+        return dict(cached)
+
+
+class FileTypeText(str):
+    """
+    A data object type as a plain string that also supports the
+    `.code.text` access of the schema's FileTypeEnum.
+    """
+    @property
+    def code(self) -> "FileTypeText":
+        return self
+
+    @property
+    def text(self) -> str:
+        return str(self)
+
+
+class DataObjectRecord:
+    """
+    Compact stand-in for DataObject used while building the workflow process graph.
+    Holds the (flat) record as-is; to_schema() builds the full DataObject when needed.
+    """
+    __slots__ = ("id", "type", "data_object_type", "url", "_record")
+
+    def __init__(self, **record):
+        record.pop("_id", None)
+        record = {k: v for k, v in record.items() if v not in (None, "", [])}
+        record.setdefault("type", "nmdc:DataObject")
+        self._record = record
+        self.id = record["id"]
+        self.type = record["type"]
+        self.data_object_type = FileTypeText(record["data_object_type"]) if "data_object_type" in record else None
+        self.url = record.get("url")
+
+    def __repr__(self) -> str:
+        return f"DataObjectRecord(id={self.id!r}, data_object_type={self.data_object_type!r})"
+
+    def __getitem__(self, key: str) -> Any:
+        return self._record[key]
+
+    @property
+    def data_object_type_text(self) -> str:
+        """ Return the data object type text """
+        return str(self.data_object_type)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """ Return a copy of the record """
+        return dict(self._record)
+
+    def to_schema(self) -> DataObject:
+        """ Build the full, validated DataObject """
+        return DataObject(**self.as_dict())
+
+
+class ProcessRecord:
+    """
+    Compact stand-in for the DataGeneration / WorkflowExecution schema classes used while
+    building the workflow process graph. Only the fields the graph reads are unpacked;
+    to_schema() builds the full schema object from the record when a caller needs it.
+    """
+    __slots__ = (
+        "id", "type", "name", "version", "git_url", "has_input", "has_output", "was_informed_by",
+        "analyte_category", "insdc_experiment_identifiers", "_record"
+    )
+
+    def __init__(self, record: Dict[str, Any]):
+        self._record = record
+        self.id = record["id"]
+        # get rid of any legacy 'Activity' suffixes in the type
+        self.type = record["type"].replace("Activity", "")
+        self.name = record.get("name")
+        self.version = record.get("version")
+        self.git_url = record.get("git_url")
+        self.has_input = list(record.get("has_input") or [])
+        self.has_output = list(record.get("has_output") or [])
+        self.was_informed_by = list(record.get("was_informed_by") or [])
+        self.analyte_category = record.get("analyte_category")
+        self.insdc_experiment_identifiers = list(record.get("insdc_experiment_identifiers") or [])
 
+    def __repr__(self) -> str:
+        return f"ProcessRecord(id={self.id!r}, type={self.type!r})"
 
+    def to_schema(self, validate: bool = False) -> Union[DataGeneration, WorkflowExecution]:
+        """ Build the full schema object with workflow_process_factory """
+        return workflow_process_factory(copy.deepcopy(self._record), validate=validate)
@@ -5,7 +5,7 @@ from typing import Any, Dict, List, Optional, Set
 
 from dateutil import parser
 
-from nmdc_automation.models.nmdc import DataObject, workflow_process_factory
+from nmdc_automation.models.nmdc import DataObject, ProcessRecord
 
 
 class WorkflowProcessNode(object):
@@ -25,10 +25,17 @@ class WorkflowProcessNode(object):
         self.children = []
         self.data_objects_by_type = {}
         self.workflow = workflow
-        process = workflow_process_factory(record)
-        self.process = process
+        # A lightweight record; the full schema object is only built on demand
+        self.process = ProcessRecord(record)
         self._manifest: List[str] = []
 
+    @property
+    def schema_process(self):
+        """
+        Return the process as a full nmdc-schema DataGeneration or WorkflowExecution object.
+        """
+        return self.process.to_schema()
+
     def __hash__(self):
         return hash((self.id, self.type))
 
@@ -42,7 +49,7 @@ class WorkflowProcessNode(object):
         """
         Add a data object to this workflow processing node.
         """
-        self.data_objects_by_type[data_object.data_object_type.code.text] = data_object
+        self.data_objects_by_type[data_object.data_object_type_text] = data_object
     
     # Getter
     @property
@@ -118,9 +125,24 @@ class WorkflowProcessNode(object):
     @property
     def was_informed_by(self) -> list[str]:
         """ workflow executions have a was_informed_by field, data generations get set to their own id"""            
-        return getattr(self.process, "was_informed_by", [self.id])
+        return self.process.was_informed_by or [self.id]
         
 
+# Record fields needed to build and schedule from the workflow process graph. This covers
+# what the graph and job records read plus the slots nmdc-schema requires for each class.
+_PROCESS_RECORD_FIELDS = ["id", "type", "name", "has_input", "has_output"]
+DATA_GENERATION_RECORD_FIELDS = _PROCESS_RECORD_FIELDS + [
+    "analyte_category", "associated_studies", "insdc_experiment_identifiers"
+]
+WORKFLOW_EXECUTION_RECORD_FIELDS = _PROCESS_RECORD_FIELDS + [
+    "version", "git_url", "was_informed_by", "started_at_time", "processing_institution"
+]
+DATA_OBJECT_RECORD_FIELDS = [
+    "id", "type", "name", "description", "data_object_type", "data_category", "url",
+    "md5_checksum", "file_size_bytes", "in_manifest", "was_generated_by"
+]
+
+
 @dataclass
 class WorkflowConfig:
     """ Configuration for a workflow execution. Defined by .yaml files in nmdc_automation/config/workflows """
@@ -168,6 +190,13 @@ class WorkflowConfig:
     def __hash__(self):
         return hash(self.name)
 
+    @property
+    def record_fields(self) -> List[str]:
+        """ Fields to project when fetching the process records for this workflow """
+        if self.collection == "data_generation_set":
+            return DATA_GENERATION_RECORD_FIELDS
+        return WORKFLOW_EXECUTION_RECORD_FIELDS
+
     def __eq__(self, other) -> bool:
         """
         Compare two workflow configs by name.
@@ -8,7 +8,7 @@ import os
 from zipfile import ZipFile
 
 
-from nmdc_automation.api import NmdcRuntimeApi
+from nmdc_automation.api import IdPool, NmdcRuntimeApi
 from nmdc_automation.import_automation.import_mapper import ImportMapper
 from nmdc_automation.import_automation.utils import get_or_create_md5
 
@@ -75,6 +75,10 @@ def import_projects(ctx,  import_file, import_yaml, site_configuration, update_d
     logger.info(f"Site Configuration:  from {site_configuration}")
 
     runtime_api = NmdcRuntimeApi(site_configuration)
+    id_pool = None
+    if runtime_api.config.id_pool_file:
+        # keep a separate reservoir from the scheduler's so the two never share IDs
+        id_pool = IdPool(runtime_api, f"{runtime_api.config.id_pool_file}.import", runtime_api.config.id_pool_size)
 
 
     data_imports = _parse_tsv(import_file)
@@ -87,7 +91,7 @@ def import_projects(ctx,  import_file, import_yaml, site_configuration, update_d
         # 2. Add Workflow Executions and their data objects
         # 3. Scan files in the Import Directory and add or update mappings
         logger.info(f"Importing project {project_path} into {nucleotide_sequencing_id}")
-        import_mapper = ImportMapper(nucleotide_sequencing_id, project_path, import_yaml, runtime_api)
+        import_mapper = ImportMapper(nucleotide_sequencing_id, project_path, import_yaml, runtime_api, id_pool)
         import_mapper.add_do_mappings_from_data_generation()
         import_mapper.add_do_mappings_from_workflow_executions()
         import_mapper.update_do_mappings_from_import_files()
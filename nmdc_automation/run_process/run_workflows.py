@@ -85,7 +85,7 @@ def resubmit(ctx, operation_ids, all_failures, submit):
 
     if all_failures:
         logger.info("Resubmitting all failed jobs")
-        failed_jobs = watcher.job_manager.get_failed_jobs()
+        failed_jobs = watcher.job_manager.get_failed_jobs(archived=True)
         logger.info(f"Found {len(failed_jobs)} failed jobs")
 
         for job in failed_jobs:
@@ -94,18 +94,20 @@ def resubmit(ctx, operation_ids, all_failures, submit):
 
             if submit:
                 logger.info(f"Resubmitting {msg}")
+                watcher.job_manager.reactivate(job)
                 job.job.submit_job()
             else:
                 logger.info(f"Submit flag not set. Found {msg}")
 
     if operation_ids:
         for opid in operation_ids:
-            job = watcher.job_manager.find_job_by_opid(opid)
+            job = watcher.job_manager.find_job_by_opid(opid, archived=True)
             if job:
                 if len(job.was_informed_by) == 1:
                     msg = f"Job for {job.was_informed_by[0]} / {job.workflow_execution_id} Status: {job.job_status}"
                 if submit:
                     logger.info(f"Resubmitting {msg}")
+                    watcher.job_manager.reactivate(job)
                     job.job.submit_job()
                 else:
                     logger.info(f"Submit flag not set. Found {msg}")
@@ -130,11 +132,12 @@ def daemon(ctx):
 
 @watcher.command()
 @click.pass_context
-def report(ctx):
+@click.option("--active", is_flag=True, default=False, help="Only report active jobs, not archived ones")
+def report(ctx, active):
     watcher = ctx.obj
     watcher.restore_from_checkpoint()
 
-    reports = watcher.job_manager.report()
+    reports = watcher.job_manager.report(archived=not active)
 
     header = "wdl, release, last_status, was_informed_by, workflow_execution_id"
     print(header)
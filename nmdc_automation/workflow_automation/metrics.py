@@ -0,0 +1,160 @@
+""" Per-cycle timing and call-count instrumentation for the scheduler """
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from time import monotonic
+from typing import Any, Dict, Optional, Union
+
+from nmdc_automation.api.nmdcapi import ApiStats
+
+logger = logging.getLogger(__name__)
+
+
+class CycleMetrics:
+    """
+    Record the wall time, number of calls and runtime API HTTP calls of each phase of a
+    scheduler cycle. Phases with the same name are summed within a cycle; nested phases
+    are recorded separately, e.g. "load_workflow_process_nodes" and
+    "load_workflow_process_nodes.get_manifest_map".
+
+    At the end of each cycle a summary is logged, appended as a JSON line to
+    `metrics_file` (rotated at `max_bytes`, keeping `backup_count` old files) and, if
+    `prometheus_file` is set, written there in the Prometheus text exposition format
+    for a node-exporter textfile collector.
+    """
+
+    def __init__(self, metrics_file: Optional[Union[str, Path]] = None,
+                 prometheus_file: Optional[Union[str, Path]] = None, api=None,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.prometheus_file = Path(prometheus_file) if prometheus_file else None
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        stats = getattr(api, "stats", None)
+        self._api_stats = stats if isinstance(stats, ApiStats) else None
+        self._lock = threading.Lock()
+        self.cycles = 0
+        self.last_cycle: Optional[Dict[str, Any]] = None
+        self._phases: Dict[str, Dict[str, float]] = {}
+        self._started_at = None
+        self._start = None
+        self._start_http_calls = None
+
+    def _http_calls(self) -> Optional[int]:
+        return self._api_stats.total_calls() if self._api_stats else None
+
+    def start_cycle(self) -> None:
+        with self._lock:
+            self._phases = {}
+        self._started_at = datetime.now(timezone.utc).isoformat()
+        self._start = monotonic()
+        self._start_http_calls = self._http_calls()
+
+    @contextmanager
+    def phase(self, name: str):
+        """ Time a phase of the cycle """
+        start = monotonic()
+        http_calls = self._http_calls()
+        try:
+            yield
+        finally:
+            seconds = monotonic() - start
+            http_delta = self._http_calls() - http_calls if http_calls is not None else None
+            with self._lock:
+                stats = self._phases.setdefault(name, {"seconds": 0.0, "calls": 0, "http_calls": 0})
+                stats["seconds"] += seconds
+                stats["calls"] += 1
+                if http_delta is not None:
+                    stats["http_calls"] += http_delta
+
+    def phases(self) -> Dict[str, Dict[str, float]]:
+        """ The phases recorded so far this cycle """
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._phases.items()}
+
+    def add_phases(self, phases: Dict[str, Dict[str, float]], prefix: str = "") -> None:
+        """ Add phases recorded elsewhere, e.g. in a worker process, to this cycle """
+        with self._lock:
+            for name, other in phases.items():
+                stats = self._phases.setdefault(prefix + name, {"seconds": 0.0, "calls": 0, "http_calls": 0})
+                for key in stats:
+                    stats[key] += other.get(key, 0)
+
+    def end_cycle(self, **extra) -> Dict[str, Any]:
+        """ Finish the cycle, log its summary and write the metrics files """
+        self.cycles += 1
+        with self._lock:
+            phases = {name: dict(stats, seconds=round(stats["seconds"], 6)) for name, stats in self._phases.items()}
+        http_calls = self._http_calls()
+        record = {
+            "cycle": self.cycles,
+            "started_at": self._started_at,
+            "seconds": round(monotonic() - self._start, 6) if self._start is not None else None,
+            "http_calls": http_calls - self._start_http_calls if http_calls is not None else None,
+            "phases": phases,
+        }
+        record.update(extra)
+        self.last_cycle = record
+
+        summary = ", ".join(f"{name}={stats['seconds']:.2f}s/{stats['calls']}" for name, stats in phases.items())
+        logger.info(f"Cycle {self.cycles} took {record['seconds']:.2f}s, "
+                    f"{record['http_calls']} API calls: {summary}")
+        try:
+            if self.metrics_file:
+                self._append_jsonl(record)
+            if self.prometheus_file:
+                self._write_prometheus(record)
+        except OSError as e:
+            logger.warning(f"Failed to write cycle metrics: {e}")
+        return record
+
+    def _append_jsonl(self, record: Dict[str, Any]) -> None:
+        if self.metrics_file.exists() and self.metrics_file.stat().st_size >= self.max_bytes:
+            for i in range(self.backup_count - 1, 0, -1):
+                older = self.metrics_file.with_name(f"{self.metrics_file.name}.{i}")
+                if older.exists():
+                    os.replace(older, self.metrics_file.with_name(f"{self.metrics_file.name}.{i + 1}"))
+            if self.backup_count > 0:
+                os.replace(self.metrics_file, self.metrics_file.with_name(f"{self.metrics_file.name}.1"))
+            else:
+                self.metrics_file.unlink()
+        with open(self.metrics_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _write_prometheus(self, record: Dict[str, Any]) -> None:
+        lines = [
+            "# HELP nmdc_scheduler_cycles_total Scheduler cycles run since start",
+            "# TYPE nmdc_scheduler_cycles_total counter",
+            f"nmdc_scheduler_cycles_total {record['cycle']}",
+            "# HELP nmdc_scheduler_cycle_seconds Wall time of the last scheduler cycle",
+            "# TYPE nmdc_scheduler_cycle_seconds gauge",
+            f"nmdc_scheduler_cycle_seconds {record['seconds']}",
+        ]
+        if record["http_calls"] is not None:
+            lines += [
+                "# HELP nmdc_scheduler_cycle_http_calls Runtime API calls in the last scheduler cycle",
+                "# TYPE nmdc_scheduler_cycle_http_calls gauge",
+                f"nmdc_scheduler_cycle_http_calls {record['http_calls']}",
+            ]
+        for metric, key, help_text in (
+            ("nmdc_scheduler_phase_seconds", "seconds", "Wall time per phase of the last scheduler cycle"),
+            ("nmdc_scheduler_phase_calls", "calls", "Times each phase ran in the last scheduler cycle"),
+            ("nmdc_scheduler_phase_http_calls", "http_calls", "Runtime API calls per phase of the last scheduler cycle"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for name, stats in record["phases"].items():
+                lines.append(f'{metric}{{phase="{name}"}} {stats[key]}')
+
+        tmp_file = self.prometheus_file.with_name(self.prometheus_file.name + ".tmp")
+        with open(tmp_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.prometheus_file)
+
+
+def timed(metrics: Optional[CycleMetrics], name: str):
+    """ metrics.phase(name), or a no-op when there are no metrics to record """
+    return metrics.phase(name) if metrics is not None else nullcontext()
@@ -0,0 +1,113 @@
+""" Adaptive wait between scheduler cycles """
+import logging
+import os
+from pathlib import Path
+from time import monotonic, sleep as _sleep
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePollInterval:
+    """
+    Decide how long the scheduler waits between cycles.
+
+    The interval starts at `min_interval` and doubles (by `backoff`) after every cycle
+    that created no jobs, up to `max_interval`. While waiting, the record counts of the
+    `collections` are probed every `probe_interval` seconds with a $count aggregation;
+    if they changed since the last cycle started, the wait ends and the interval drops
+    back to `min_interval`. Probes are not retried and time out after `probe_timeout`;
+    a failed probe counts as no change. Creating `trigger_file` (e.g. `touch`) ends the wait at once;
+    the file is removed when it is seen.
+    """
+    PROBE_COLLECTIONS = ("data_generation_set", "workflow_execution_set")
+
+    def __init__(self, api=None, min_interval: float = 60, max_interval: float = 900,
+                 backoff: float = 2.0, probe_interval: float = 15,
+                 trigger_file: Optional[Union[str, Path]] = None,
+                 collections: Sequence[str] = PROBE_COLLECTIONS, tick: float = 1.0,
+                 probe_timeout: Union[float, Tuple[float, float]] = (5, 10)):
+        self.api = api
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.probe_interval = probe_interval
+        self.trigger_file = Path(trigger_file) if trigger_file else None
+        self.collections = tuple(collections)
+        self.tick = tick
+        self.probe_timeout = probe_timeout
+        self.interval = min_interval
+        # Why the last wait ended: "trigger", "change" or "timeout"
+        self.woken_by: Optional[str] = None
+        self._counts: Optional[Dict[str, int]] = None
+
+    def probe(self) -> Optional[Dict[str, int]]:
+        """ The record count of each probed collection, or None if the API can't be reached """
+        if self.api is None or not self.collections:
+            return None
+        counts = {}
+        try:
+            for collection in self.collections:
+                counts[collection] = self.api.count_documents(collection, timeout=self.probe_timeout)
+        except Exception as e:
+            logger.warning(f"Change probe failed: {e}")
+            return None
+        return counts
+
+    def start_cycle(self) -> None:
+        """ Take the record counts that the next wait compares against """
+        self._counts = self.probe()
+
+    def end_cycle(self, jobs_created: int = 0) -> float:
+        """
+        Tighten the interval after a cycle that found work or was started by a change,
+        back off after an idle one. Returns the new interval.
+        """
+        if jobs_created or self.woken_by in ("trigger", "change"):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    def triggered(self) -> bool:
+        """ Whether the trigger file exists, removing it if so """
+        if not self.trigger_file or not self.trigger_file.exists():
+            return False
+        try:
+            os.remove(self.trigger_file)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def changed(self) -> bool:
+        """ Whether the probed record counts differ from those at the start of the last cycle """
+        if self._counts is None:
+            return False
+        counts = self.probe()
+        if counts is None or counts == self._counts:
+            return False
+        logger.info(f"New records found: {counts} (was {self._counts})")
+        return True
+
+    def wait(self) -> str:
+        """ Wait for the current interval, a change or the trigger file, and return which it was """
+        start = monotonic()
+        deadline = start + self.interval
+        next_probe = start + self.probe_interval
+        logger.debug(f"Next cycle in up to {self.interval:.0f}s")
+        while True:
+            now = monotonic()
+            if self.triggered():
+                logger.info(f"Trigger file {self.trigger_file} found, starting a cycle")
+                self.woken_by = "trigger"
+                break
+            if now >= deadline:
+                self.woken_by = "timeout"
+                break
+            if now >= next_probe:
+                next_probe = now + self.probe_interval
+                if self.changed():
+                    self.woken_by = "change"
+                    break
+            _sleep(max(0.0, min(self.tick, deadline - now, next_probe - now)))
+        return self.woken_by
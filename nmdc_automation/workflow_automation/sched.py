@@ -1,19 +1,34 @@
+import hashlib
 import logging
 import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, List, Optional, Tuple
 import uuid
 import os
-from time import sleep as _sleep
+from time import monotonic
 from nmdc_automation.api.nmdcapi import NmdcRuntimeApi
+from nmdc_automation.api.id_pool import IdPool
+from nmdc_automation.workflow_automation.metrics import CycleMetrics
+from nmdc_automation.workflow_automation.polling import AdaptivePollInterval
 #from nmdc_automation.db.nmdc_mongo import get_db
 from nmdc_automation.workflow_automation.workflows import load_workflow_configs
 from functools import lru_cache
-from nmdc_automation.workflow_automation.workflow_process import load_workflow_process_nodes
+from nmdc_automation.workflow_automation.workflow_process import (
+    IncrementalWorkflowProcessLoader,
+    ManifestMap,
+    ScheduledJobs,
+    ShardFilter,
+    WorkflowProcessGraph,
+    load_workflow_process_nodes,
+)
 from nmdc_automation.models.workflow import WorkflowConfig, WorkflowProcessNode
 from semver.version import Version
 import sys
 from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
 import requests
 
 
@@ -71,12 +86,131 @@ def resolve_url(url):
         raise
 
 
+class UrlResolver:
+    """
+    Resolve data object URLs over a pooled session, caching the final destination
+    for `ttl` seconds so a URL shared by several jobs is only resolved once. Each
+    request gives up after `timeout` (connect, read) seconds.
+    """
+
+    def __init__(self, ttl: float = 3600, max_workers: int = 16, timeout: Tuple[float, float] = (10, 300)):
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, url: str) -> str:
+        """
+        Same as resolve_url, but served from the cache when the URL was resolved recently.
+        """
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached and cached[1] > monotonic():
+            return cached[0]
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            response.raise_for_status()
+        except HTTPError as e:
+            logger.error(f"Failed to resolve URL {url}: {e}")
+            raise
+        with self._lock:
+            self._cache[url] = (response.url, monotonic() + self.ttl)
+        return response.url
+
+    def prefetch(self, urls) -> None:
+        """
+        Resolve the given URLs concurrently to warm the cache. Failures are not
+        cached, so they are raised again when the URL is resolved for a job.
+        """
+        now = monotonic()
+        with self._lock:
+            pending = {url for url in urls if url not in self._cache or self._cache[url][1] <= now}
+        if not pending:
+            return
+        logger.info(f"Resolving {len(pending)} input URLs")
+
+        def _resolve_quietly(url):
+            try:
+                self.resolve(url)
+            except Exception as e:
+                logger.debug(f"Prefetch of {url} failed: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(_resolve_quietly, pending))
+
+
+class JobIndex:
+    """
+    Job records for a set of workflow git repos, fetched with one bulk list_jobs call
+    and indexed by (git_repo, trigger_activity, manifest). The jobs endpoint has no
+    projection parameter, so records are trimmed to the fields the scheduler reads.
+    """
+    CONFIG_FIELDS = ("git_repo", "release", "trigger_activity", "manifest")
+
+    def __init__(self):
+        self._jobs: Dict[tuple, List[dict]] = {}
+        self._keys_by_repo: Dict[str, List[tuple]] = {}
+        self.git_repos = set()
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self._jobs.values())
+
+    def load(self, api, git_repos) -> None:
+        """ Fetch the jobs of the git repos that are not loaded yet """
+        missing = sorted({git_repo for git_repo in git_repos if git_repo} - self.git_repos)
+        if not missing:
+            return
+        jobs = api.list_jobs({"config.git_repo": {"$in": missing}})
+        for job in jobs:
+            self.add(job)
+        self.git_repos.update(missing)
+        logger.debug(f"Loaded {len(jobs)} jobs for {len(missing)} workflow repos")
+
+    def add(self, job: dict) -> None:
+        """ Add a job record to the index """
+        config = job.get("config", {})
+        job = {
+            "id": job.get("id"),
+            "claims": job.get("claims") or [],
+            "config": {k: config[k] for k in self.CONFIG_FIELDS if k in config},
+        }
+        key = (config.get("git_repo"), config.get("trigger_activity"), config.get("manifest"))
+        if key not in self._jobs:
+            self._jobs[key] = []
+            self._keys_by_repo.setdefault(key[0], []).append(key)
+        self._jobs[key].append(job)
+
+    def get(self, git_repo: str, trigger_activity: str, manifest: str = None) -> List[dict]:
+        """ The jobs for a trigger activity, with or without a manifest """
+        return self._jobs.get((git_repo, trigger_activity, manifest), [])
+
+    def releases(self, git_repo: str, trigger_activity: str, manifest: str = None) -> set:
+        """ The workflow versions that have jobs for a trigger activity """
+        return {job["config"].get("release") for job in self.get(git_repo, trigger_activity, manifest)}
+
+    def jobs_for(self, git_repo: str, manifest: str = None) -> List[dict]:
+        """
+        The jobs for a git repo, limited to one manifest if given. This is the
+        same selection as list_jobs({"config.git_repo": ..., "config.manifest": ...}).
+        """
+        return [
+            job for key in self._keys_by_repo.get(git_repo, [])
+            if manifest is None or key[2] == manifest
+            for job in self._jobs[key]
+        ]
+
+
 class SchedulerJob:
     """
     Class to hold information for new jobs
     """
 
-    def __init__(self, workflow: WorkflowConfig, trigger_act: WorkflowProcessNode, manifest_map: Dict[str, List[str]]):
+    def __init__(self, workflow: WorkflowConfig, trigger_act: WorkflowProcessNode, manifest_map: ManifestMap):
         """
         Initializes a SchedulerJob with a trigger and conditionally sets its
         informed_by attribute based on the trigger's manifest.
@@ -107,16 +241,9 @@ class SchedulerJob:
             # Save it to the class
             self.manifest = manifest_key
 
-            # Use .get() to safely retrieve the mapped value.
-            # It will return None if the key doesn't exist.
-            mapped_value = manifest_map.get(manifest_key)
-            
-            # For dgns wfp nodes
-            # Check if a value was found, is a dict, and contains the required key.
-            # This will be the associated data_generation_set IDs with the manifest set
-            if isinstance(mapped_value, dict) and 'data_generation_set' in mapped_value:
-                if self.trigger_id in mapped_value['data_generation_set']:
-                    self.informed_by = mapped_value['data_generation_set']
+            # For dgns wfp nodes use the associated data_generation_set IDs of the manifest set
+            if manifest_map.has_data_generation(manifest_key, self.trigger_id):
+                self.informed_by = manifest_map.data_generation_ids(manifest_key)
 
         
                 
@@ -128,11 +255,15 @@ class MissingDataObjectException(Exception):
 
 
 class Scheduler:
+    OP_FETCH_CHUNK_SIZE = 100
+    INFORMED_BY_CHUNK_SIZE = 100
 
     #def __init__(self, db, workflow_yaml,
     #             site_conf="site_configuration.toml"):
     def __init__(self, workflow_yaml,
-                 site_conf="site_configuration.toml", api=None):
+                 site_conf="site_configuration.toml", api=None, incremental=False,
+                 snapshot_path=None, id_pool=None, job_batch_size=None,
+                 metrics_file=None, prometheus_file=None, poller=None):
 
         # Init
         # wf_file = os.environ.get(_WF_YAML_ENV, wfn)
@@ -145,20 +276,76 @@ class Scheduler:
         else:
             self.api = NmdcRuntimeApi(site_conf)
             
+        # Operations looked up for job claims this cycle, None for missing ones
+        self._ops_by_id: Dict[str, dict] = {}
+
+        # Job records of the workflows' git repos, loaded once per cycle
+        self.job_index = JobIndex()
+
+        # (was_informed_by, type) -> (ID root, last iteration) of workflow executions this cycle
+        self._activity_ids: Dict[tuple, Optional[Tuple[str, int]]] = {}
+
+        # Job records are submitted in batches, concurrently within a batch.
+        # Records that could not be created are reported here for the last cycle.
+        site_config = getattr(self.api, "config", None)
+        if job_batch_size is None:
+            job_batch_size = site_config.job_batch_size if site_config is not None else 50
+        self.job_batch_size = job_batch_size
+        self.job_workers = site_config.api_pool_size if site_config is not None else 10
+        self.job_failures: List[dict] = []
+
+        # Input URLs are resolved once per TTL and shared across jobs,
+        # with the same timeouts as the runtime API
+        if site_config is not None:
+            self.url_resolver = UrlResolver(timeout=(site_config.api_connect_timeout, site_config.api_read_timeout))
+        else:
+            self.url_resolver = UrlResolver()
+
+        # IDs are handed out from a local pre-minted pool when one is configured,
+        # otherwise each ID is minted with its own API call
+        self.id_pool = id_pool
+        if self.id_pool is None and site_config is not None and site_config.id_pool_file:
+            self.id_pool = IdPool(self.api, site_config.id_pool_file, site_config.id_pool_size)
+
+        # Each cycle's phase timings and API call counts are logged, and written to the
+        # rolling JSON-lines metrics file and Prometheus textfile when those are set
+        self.metrics = CycleMetrics(metrics_file, prometheus_file, api=self.api)
+
+        # The wait between cycles backs off while nothing changes and ends early when
+        # new records show up or the trigger file is created
+        self.poller = poller or AdaptivePollInterval(self.api, min_interval=_POLL_INTERVAL)
+
         # TODO: Make force a optional parameter
         self.force = False
         if os.environ.get("FORCE") == "1":
             logger.info("Setting force on")
             self.force = True
-        self._messages = []
+        # Messages already logged, so each is only logged once
+        self._messages = set()
+
+        # In incremental mode the workflow process graph is kept between cycles
+        # and only patched with records that changed since the last cycle.
+        # A snapshot file lets a restarted scheduler pick up where it left off.
+        self.graph_loader = None
+        if incremental or snapshot_path:
+            logger.info("Using incremental workflow process graph loading")
+            with open(workflow_yaml, "rb") as f:
+                workflow_hash = hashlib.sha256(f.read()).hexdigest()
+            self.graph_loader = IncrementalWorkflowProcessLoader(
+                self.api, self.workflows, snapshot_path=snapshot_path, snapshot_key=workflow_hash
+            )
+            self.graph_loader.metrics = self.metrics
 
     async def run(self):
         logger.info("Starting Scheduler")
         while True:
-            self.cycle()
-            await asyncio.sleep(_POLL_INTERVAL)
+            self.poller.start_cycle()
+            job_recs = self.cycle()
+            self.poller.end_cycle(len(job_recs))
+            # wait in a worker thread, like the asyncio.sleep it replaces, so the event loop isn't blocked
+            await asyncio.to_thread(self.poller.wait)
 
-    def create_job_rec(self, job: SchedulerJob, manifest_map: Dict[str, List[str]]):
+    def create_job_rec(self, job: SchedulerJob, manifest_map: ManifestMap):
         """
         This takes a job and using the workflow definition,
         resolves all the information needed to create a
@@ -181,9 +368,9 @@ class Scheduler:
             # If manifest is not empty, then this is a data generation stored in the WorkflowProcessNode
             # Note: Currently only support one manifest per workflowprocessnode/datagen
             #
-            if len(next_act.manifest) == 1 and job.trigger_id in manifest_map[next_act.manifest[0]]['data_generation_set']:
+            if len(next_act.manifest) == 1 and manifest_map.has_data_generation(next_act.manifest[0], job.trigger_id):
                 # Find the data objects associated with the manifest using manifest_map
-                for data_object in manifest_map[next_act.manifest[0]]['data_object_set']:
+                for data_object in manifest_map.data_objects(next_act.manifest[0]):
                     do_type = data_object.data_object_type_text
                     if do_type not in do_by_type:    
                         do_by_type[do_type] = []
@@ -221,6 +408,8 @@ class Scheduler:
         wf = job.workflow
         base_id, iteration = self.get_activity_id(wf, job.informed_by)
         workflow_execution_id = f"{base_id}.{iteration}"
+        # Input data objects are recorded as the projected data_object_set records
+        # (DATA_OBJECT_RECORD_FIELDS); the watcher only reads their ids
         input_data_objects = []
         inputs = dict()
         optional_inputs = wf.optional_inputs
@@ -246,9 +435,9 @@ class Scheduler:
                     input_data_objects.append(dobj_list[0].as_dict())
                 
                     if k in fq_inputs:
-                        v = [resolve_url(dobj_list[0]["url"])]
+                        v = [self.url_resolver.resolve(dobj_list[0]["url"])]
                     else:
-                        v = resolve_url(dobj_list[0]["url"])
+                        v = self.url_resolver.resolve(dobj_list[0]["url"])
                 
                 # For multi-input, it goes here to produce []
                 else:
@@ -256,7 +445,7 @@ class Scheduler:
                     for dobj in dobj_list:
                         input_data_objects.append(dobj.as_dict())
     
-                        v.append(resolve_url(dobj["url"]))
+                        v.append(self.url_resolver.resolve(dobj["url"]))
                         
                     
             # TODO: Make this smarter
@@ -292,12 +481,21 @@ class Scheduler:
             job_config["activity"] = wf.workflow_execution
         if wf.outputs:
             outputs = []
-            for output in wf.outputs:
-                # Mint an ID
-                # Note - the minter uses the informed_by to generate a metadata record so no need
-                # to check for the length of the array.
-                output["id"] = self.api.minter("nmdc:DataObject", job.informed_by)
-                outputs.append(output)
+            with self.metrics.phase("create_job_rec.mint"):
+                if self.id_pool:
+                    output_ids = self.id_pool.reserve("nmdc:DataObject", len(wf.outputs))
+                for i, output in enumerate(wf.outputs):
+                    # Copy the output spec: records are built for the whole cycle before they are
+                    # submitted, so they must not share (and overwrite) the workflow's output dicts
+                    output = dict(output)
+                    # Mint an ID
+                    # Note - the minter uses the informed_by to generate a metadata record so no need
+                    # to check for the length of the array.
+                    if self.id_pool:
+                        output["id"] = output_ids[i]
+                    else:
+                        output["id"] = self.api.minter("nmdc:DataObject", job.informed_by)
+                    outputs.append(output)
             job_config["outputs"] = outputs
         
         # Save the associated manifest to the job config
@@ -340,40 +538,126 @@ class Scheduler:
         }
         return f"nmdc:wf{mapping[id_type]}-11-xxxxxx"
 
-    def get_activity_id(self, wf: WorkflowConfig, informed_by: list[str]):
+    @staticmethod
+    def _input_urls(job: SchedulerJob, manifest_map: ManifestMap) -> List[str]:
         """
-        See if anything exist for this and if not
-        mint a new id.
+        URLs of the upstream data objects that may be used as inputs for a job.
+        This is a superset of what create_job_rec ends up resolving.
+        """
+        input_types = {v[3:] for v in job.workflow.inputs.values() if isinstance(v, str) and v.startswith("do:")}
+        urls = []
+        next_act = job.trigger_act
+        while next_act:
+            data_objects = list(next_act.data_objects_by_type.values())
+            if len(next_act.manifest) == 1:
+                data_objects.extend(manifest_map.data_objects(next_act.manifest[0]))
+            for data_object in data_objects:
+                if data_object.url and data_object.data_object_type and data_object.data_object_type_text in input_types:
+                    urls.append(data_object.url)
+            next_act = next_act.parent
+        return urls
+
+    @staticmethod
+    def _last_activity_id(docs) -> Optional[Tuple[str, int]]:
+        """
+        The ID root and iteration of the latest of the given workflow execution records,
+        or None if there are none.
         """
         last_time = None
         last_iteration = None
         last_root = None
-
-
-        q = {"was_informed_by": informed_by, "type": wf.type}
-        for doc in self.api.list_from_collection(wf.collection, q, "id, started_at_time"):
+        for doc in docs:
             curr_root = ".".join(doc["id"].split(".")[0:-1])
             if last_root is None or curr_root == last_root:
+                if last_root is None:
+                    last_time = doc.get("started_at_time")
                 last_root = curr_root
                 curr_iteration = int(doc["id"].split(".")[-1])
                 if last_iteration is None or curr_iteration > last_iteration:
                     last_iteration = curr_iteration
             else:
-                if doc["started_at_time"] > last_time:
+                if doc.get("started_at_time") and (last_time is None or doc["started_at_time"] > last_time):
                     last_time = doc["started_at_time"]
                     last_root = curr_root
                     last_iteration = int(doc["id"].split(".")[-1])
+        if last_root is None:
+            return None
+        return last_root, last_iteration
 
-        if last_root is None and last_iteration is None:
+    def prefetch_activity_ids(self, jobs: List[SchedulerJob]) -> None:
+        """
+        Look up the latest workflow execution ID of every (was_informed_by, type) the
+        given jobs need, with one projected query per collection (chunked by
+        INFORMED_BY_CHUNK_SIZE informed-by IDs), so get_activity_id makes no API calls.
+        """
+        wanted: Dict[str, set] = {}
+        for job in jobs:
+            key = (tuple(job.informed_by), job.workflow.type)
+            if key not in self._activity_ids:
+                wanted.setdefault(job.workflow.collection, set()).add(key)
+
+        for collection, keys in wanted.items():
+            informed_by_ids = sorted({wib for key in keys for wib in key[0]})
+            types = sorted({key[1] for key in keys})
+            docs_by_key: Dict[tuple, Dict[str, dict]] = {}
+            for i in range(0, len(informed_by_ids), self.INFORMED_BY_CHUNK_SIZE):
+                chunk = informed_by_ids[i:i + self.INFORMED_BY_CHUNK_SIZE]
+                q = {"was_informed_by": {"$in": chunk}, "type": {"$in": types}}
+                for doc in self.api.list_from_collection(collection, q, "id,started_at_time,was_informed_by,type"):
+                    key = (tuple(doc.get("was_informed_by", [])), doc.get("type"))
+                    docs_by_key.setdefault(key, {})[doc["id"]] = doc
+            for key in keys:
+                self._activity_ids[key] = self._last_activity_id(docs_by_key.get(key, {}).values())
+
+    def get_activity_id(self, wf: WorkflowConfig, informed_by: list[str]):
+        """
+        See if anything exist for this and if not
+        mint a new id. Lookups are cached for the cycle and updated with the
+        IDs handed out, so a second job for the same informed_by and type gets
+        the next iteration.
+        """
+        key = (tuple(informed_by), wf.type)
+        if key not in self._activity_ids:
+            q = {"was_informed_by": informed_by, "type": wf.type}
+            self._activity_ids[key] = self._last_activity_id(
+                self.api.list_from_collection(wf.collection, q, "id,started_at_time")
+            )
+
+        last = self._activity_ids[key]
+        if last is None:
             # Get an ID
-            if os.environ.get("MOCK_MINT"):
-                root_id = self.mock_mint(wf.type)
-            else:
-                root_id = self.api.minter(wf.type, informed_by)
-            return root_id, 1
+            with self.metrics.phase("create_job_rec.mint"):
+                if os.environ.get("MOCK_MINT"):
+                    root_id = self.mock_mint(wf.type)
+                elif self.id_pool:
+                    root_id = self.id_pool.mint(wf.type, informed_by)
+                else:
+                    root_id = self.api.minter(wf.type, informed_by)
+            root_id, iteration = root_id, 1
         else:
-            root_id = last_root
-            return root_id, last_iteration + 1
+            root_id, iteration = last[0], last[1] + 1
+        self._activity_ids[key] = (root_id, iteration)
+        return root_id, iteration
+
+    def get_ops(self, op_ids: List[str]) -> Dict[str, dict]:
+        """
+        Return the operations for the given IDs keyed by ID, fetching the ones not
+        seen yet this cycle with paged $in queries. Missing operations are left out.
+        """
+        missing = list(dict.fromkeys(op_id for op_id in op_ids if op_id not in self._ops_by_id))
+        for i in range(0, len(missing), self.OP_FETCH_CHUNK_SIZE):
+            chunk = missing[i:i + self.OP_FETCH_CHUNK_SIZE]
+            try:
+                ops = self.api.list_ops({"id": {"$in": chunk}})
+            except Exception as e:
+                logger.error(f"Failed to fetch {len(chunk)} operations. Aborting cycle for safety: {e}")
+                raise
+            for op in ops:
+                self._ops_by_id[op["id"]] = op
+            # remember missing operations too, so they are not re-queried
+            for op_id in chunk:
+                self._ops_by_id.setdefault(op_id, None)
+        return {op_id: self._ops_by_id[op_id] for op_id in op_ids if self._ops_by_id.get(op_id) is not None}
 
     @lru_cache(maxsize=128)
     def get_existing_jobs(self, wf: WorkflowConfig, manifest_id: str = None):
@@ -395,13 +679,20 @@ class Scheduler:
 
         current_v = get_v_obj(wf.version)
         
-        q = {"config.git_repo": wf.git_repo}
-
+        # All the jobs of the enabled workflows are fetched on first use in a cycle.
         # If we are evaluating a manifest pool, target jobs matching this manifest
-        if manifest_id:
-            q["config.manifest"] = manifest_id
-        
-        for j in self.api.list_jobs(q):
+        with self.metrics.phase("find_new_jobs.load_jobs"):
+            self.job_index.load(self.api, {w.git_repo for w in self.workflows if w.enabled} | {wf.git_repo})
+        jobs = self.job_index.jobs_for(wf.git_repo, manifest_id)
+
+        # Fetch the operations for the claims of all other-version jobs in bulk
+        op_ids = [
+            claim["op_id"] for j in jobs if j["config"].get("release") != wf.version
+            for claim in j.get("claims", []) if claim.get("op_id")
+        ]
+        ops_by_id = self.get_ops(op_ids)
+
+        for j in jobs:
             # the assumption is that a job in any state has been triggered by an activity
             # that was the result of an existing (completed) job
             act = j["config"]["trigger_activity"]
@@ -442,25 +733,13 @@ class Scheduler:
             for claim in claims:
                 op_id = claim.get("op_id")
                 if op_id:
-                    try:
-                        op_obj = self.api.get_op(op_id)
-                        if op_obj.get("done") is False:
-                            is_active = True
-                            break # Stop checking claims for this job
-                    except HTTPError as e:
-                        # check if it was specifically a data issue (404)
-                        # and only continue for this use case
-                        status_code = getattr(e.response, 'status_code', None)
-                        if status_code == 404:
-                            logger.warning(f"Data missing (404) for operation ID {op_id}.")
-                            continue
-                        
-                        logger.error(f"API Error {status_code} for {op_id}. Aborting cycle for safety.")
-                        raise 
-
-                    except Exception as e:
-                        logger.error(f"Critical system failure during op check: {e}")
-                        raise
+                    op_obj = ops_by_id.get(op_id)
+                    if op_obj is None:
+                        logger.warning(f"Data missing (404) for operation ID {op_id}.")
+                        continue
+                    if op_obj.get("done") is False:
+                        is_active = True
+                        break # Stop checking claims for this job
 
             if is_active:
                 existing_jobs.add(act)
@@ -477,7 +756,17 @@ class Scheduler:
         # If no blockers found, it gets here and is empty set
         return existing_jobs
 
-    def find_new_jobs(self, wfp_node: WorkflowProcessNode, manifest_map: Dict[str, List[str]], all_jobs: List[SchedulerJob]) -> List[SchedulerJob]:
+    @staticmethod
+    def _find_manifest_job(all_jobs: List[SchedulerJob], manifest_id: str, workflow_name: str):
+        """ A job already scheduled this cycle for the manifest and workflow """
+        if isinstance(all_jobs, ScheduledJobs):
+            return all_jobs.find_manifest_job(manifest_id, workflow_name)
+        for new_job in all_jobs:
+            if new_job.manifest == manifest_id and new_job.workflow.name == workflow_name:
+                return new_job
+        return None
+
+    def find_new_jobs(self, wfp_node: WorkflowProcessNode, manifest_map: ManifestMap, all_jobs: List[SchedulerJob]) -> List[SchedulerJob]:
         """
         Find new jobs for a workflow process node. A new job:
         - Is either not in the Jobs collection or is cancelled
@@ -495,16 +784,12 @@ class Scheduler:
             # Ignore disabled workflows
             if not wf.enabled:
                 msg = f"Skipping disabled workflow {wf.name}:{wf.version}"
-                if msg not in self._messages:
-                    logger.info(msg)
-                    self._messages.append(msg)
+                self._log_once(msg)
                 continue
             # See if we already have a job for this
             if wfp_node.id in self.get_existing_jobs(wf, manifest_id=current_manifest_id):
                 msg = f"Skipping existing job for {wfp_node.id} {wf.name}:{wf.version}"
-                if msg not in self._messages:
-                    logger.info(msg)
-                    self._messages.append(msg)
+                self._log_once(msg)
                 continue
             
             #
@@ -515,9 +800,9 @@ class Scheduler:
             found_existing_manifest_job = False
             associated_wfp_node_id = None
             if len(wfp_node.manifest) == 1:
-                if wfp_node.id in manifest_map[wfp_node.manifest[0]]['data_generation_set']:
+                if manifest_map.has_data_generation(wfp_node.manifest[0], wfp_node.id):
 
-                    for dgns_id in manifest_map[wfp_node.manifest[0]]['data_generation_set']:
+                    for dgns_id in manifest_map.data_generation_ids(wfp_node.manifest[0]):
                         # Only need to check for others dgns since already checked itself above
                         if dgns_id != wfp_node.id:
                             if dgns_id in self.get_existing_jobs(wf, manifest_id=current_manifest_id):
@@ -527,20 +812,15 @@ class Scheduler:
                     
                     # If not found, also check if it was just added to list of all jobs 
                     if not found_existing_manifest_job:
-                        for new_job in all_jobs:
-                            if new_job.manifest:
-                                if new_job.manifest == wfp_node.manifest[0]:
-                                    if new_job.workflow.name == wf.name:
-                                        found_existing_manifest_job = True
-                                        associated_wfp_node_id = new_job.trigger_id
-                                        break
+                        new_job = self._find_manifest_job(all_jobs, wfp_node.manifest[0], wf.name)
+                        if new_job:
+                            found_existing_manifest_job = True
+                            associated_wfp_node_id = new_job.trigger_id
 
 
                     if found_existing_manifest_job:
                         msg = f"Skipping existing job due to associated data generation record {associated_wfp_node_id} for {wfp_node.id} {wf.name}:{wf.version}"
-                        if msg not in self._messages:
-                            logger.info(msg)
-                            self._messages.append(msg)
+                        self._log_once(msg)
                         continue
 
 
@@ -556,18 +836,14 @@ class Scheduler:
             for child_act in wfp_node.children:
                 if within_range(child_act.workflow, wf, force=self.force):
                     msg = f"Skipping existing job for {child_act.id} {wf.name}:{child_act.version}"
-                    if msg not in self._messages:
-                        logger.info(msg)
-                        self._messages.append(msg)
+                    self._log_once(msg)
                     break
             else:
                 # These means no existing activities were
                 # found that matched this workflow, so we
                 # add a job
                 msg = f"Creating a job {wf.name}:{wf.version} for {wfp_node.process.id}"
-                if msg not in self._messages:
-                    logger.info(msg)
-                    self._messages.append(msg)
+                self._log_once(msg)
                 new_jobs.append(SchedulerJob(wf, wfp_node, manifest_map))
 
         return new_jobs
@@ -577,31 +853,72 @@ class Scheduler:
         """
         This function does a single cycle of looking for new jobs
         """
+        self.metrics.start_cycle()
+        job_recs = []
+        try:
+            job_recs = self._cycle(dryrun, skiplist, allowlist)
+            return job_recs
+        finally:
+            self.metrics.end_cycle(jobs_created=len(job_recs), job_failures=len(self.job_failures))
+
+    def _cycle(self, dryrun: bool, skiplist: Optional[list], allowlist) -> list:
         #wfp_nodes = load_workflow_process_nodes(self.db, self.workflows, allowlist) #orig
         #wfp_nodes = load_workflow_process_nodes(self.api, self.workflows, allowlist) #605
-        wfp_nodes, manifest_map = load_workflow_process_nodes(self.api, self.workflows, allowlist)
-        if wfp_nodes:
-            for wfp_node in wfp_nodes:
-                msg = f"Found workflow process node {wfp_node.id}"
-                if msg not in self._messages:
-                    logger.info(msg)
-                    self._messages.append(msg)
-        else:
+        with self.metrics.phase("load_workflow_process_nodes"):
+            if self.graph_loader:
+                wfp_nodes, manifest_map = self.graph_loader.load(allowlist)
+            else:
+                wfp_nodes, manifest_map = load_workflow_process_nodes(
+                    self.api, self.workflows, allowlist, metrics=self.metrics
+                )
+        if not wfp_nodes:
             msg = f"No workflow process nodes found for {allowlist}"
-            if msg not in self._messages:
-                logger.info(msg)
-                self._messages.append(msg)
+            self._log_once(msg)
+
+        self._reset_cycle_state()
+        new_job_recs = self.find_job_records(wfp_nodes, manifest_map, skiplist, dryrun)
+        if dryrun:
+            return []
+
+        with self.metrics.phase("create_job"):
+            job_recs = self.create_jobs(new_job_recs)
+        return job_recs
 
+    def _log_once(self, msg: str) -> None:
+        """ Log an info message the first time it comes up """
+        if msg not in self._messages:
+            logger.info(msg)
+            self._messages.add(msg)
+
+    def _reset_cycle_state(self) -> None:
+        """ Forget the jobs, operations and IDs looked up in the last cycle """
         self.get_existing_jobs.cache_clear()
-        job_recs = []
-        all_jobs = []
+        self._ops_by_id.clear()
+        self.job_index = JobIndex()
+        self._activity_ids.clear()
+        self.job_failures = []
+
+    def find_job_records(self, wfp_nodes, manifest_map: ManifestMap, skiplist: Optional[list] = None,
+                         dryrun: bool = False) -> List[dict]:
+        """
+        Find the new jobs for the workflow process nodes and build their job records,
+        without submitting them. With dryrun the jobs are only logged.
+        """
+        for wfp_node in wfp_nodes:
+            msg = f"Found workflow process node {wfp_node.id}"
+            self._log_once(msg)
+
+        # The jobs found this cycle, indexed by manifest and workflow on the graph
+        all_jobs = wfp_nodes.jobs if isinstance(wfp_nodes, WorkflowProcessGraph) else ScheduledJobs()
+        all_jobs.clear()
 
         for wfp_node in wfp_nodes:
             if skiplist and wfp_node.id in skiplist:
                 continue
             if not wfp_node.workflow.enabled:
                 continue
-            jobs = self.find_new_jobs(wfp_node, manifest_map, all_jobs)
+            with self.metrics.phase("find_new_jobs"):
+                jobs = self.find_new_jobs(wfp_node, manifest_map, all_jobs)
             all_jobs.extend(jobs)
 
             if jobs:
@@ -611,28 +928,253 @@ class Scheduler:
                 msg += f"wf: {job.workflow.name} ver: {job.workflow.version}"
                 logger.info(msg)
 
-                if dryrun:
-                    continue
-                try:
-                    # This jr does not have the ID until it is submitted to mongo
-                    jr = self.create_job_rec(job, manifest_map)
-                    
-                    #self.db.jobs.insert_one(jr) #TODO replace this with create_job endpoint below
-                    complete_jr = self.api.create_job(jr)
-
+        if dryrun:
+            return []
+
+        # Resolve the input URLs of every new job up front, concurrently
+        with self.metrics.phase("resolve_urls"):
+            self.url_resolver.prefetch(
+                url for job in all_jobs for url in self._input_urls(job, manifest_map)
+            )
+        with self.metrics.phase("prefetch_activity_ids"):
+            self.prefetch_activity_ids(all_jobs)
+        new_job_recs = []
+        for job in all_jobs:
+            try:
+                # This jr does not have the ID until it is submitted to mongo
+                with self.metrics.phase("create_job_rec"):
+                    new_job_recs.append(self.create_job_rec(job, manifest_map))
+            except MissingDataObjectException as e:
+                logger.warning(f"Caught missing Data Object(s) for {job.informed_by}: Skipping")
+                logger.warning(e)
+                continue
+            except Exception as e:
+                logger.exception(e)
+                raise
+        return new_job_recs
+
+    @staticmethod
+    def _job_key(job_rec: dict) -> tuple:
+        config = job_rec["config"]
+        return config["git_repo"], config["release"], config["trigger_activity"], config.get("manifest")
+
+    @staticmethod
+    def _pool_key(job_rec: dict) -> Optional[tuple]:
+        """
+        The pooled replicates of a manifest get one job per workflow release, whichever
+        of their data generations triggered it.
+        """
+        config = job_rec["config"]
+        if not config.get("manifest") or config["trigger_activity"] not in config.get("was_informed_by", []):
+            return None
+        return config["git_repo"], config["release"], config["manifest"]
+
+    def _job_exists(self, job_rec: dict) -> bool:
+        git_repo, release, trigger_activity, manifest = self._job_key(job_rec)
+        self.job_index.load(self.api, [git_repo])
+        if release in self.job_index.releases(git_repo, trigger_activity, manifest):
+            return True
+        if not self._pool_key(job_rec):
+            return False
+        replicates = set(job_rec["config"]["was_informed_by"])
+        return any(
+            job["config"].get("release") == release and job["config"].get("trigger_activity") in replicates
+            for job in self.job_index.jobs_for(git_repo, manifest)
+        )
+
+    def create_jobs(self, job_recs: List[dict]) -> List[dict]:
+        """
+        Submit job records in batches of job_batch_size, concurrently within a batch.
+        Submission is idempotent on (workflow release, trigger activity), or on (workflow
+        release, manifest) for pooled replicates: records that already have a job are
+        skipped, and a record whose POST failed is looked up again in case it was created
+        anyway. Records that could not be created are reported in self.job_failures and do
+        not stop the rest of the batch.
+        """
+        self.job_failures = []
+        created = []
+        pending = []
+        seen = set()
+        for jr in job_recs:
+            key = self._job_key(jr)
+            pool_key = self._pool_key(jr)
+            if key in seen or pool_key in seen or self._job_exists(jr):
+                logger.info(f"Skipping duplicate job for {key[2]} {key[0]}:{key[1]}")
+                continue
+            seen.add(key)
+            if pool_key:
+                seen.add(pool_key)
+            pending.append(jr)
+
+        def _create(jr):
+            try:
+                return self.api.create_job(jr), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.job_workers, self.job_batch_size))) as executor:
+            for i in range(0, len(pending), self.job_batch_size):
+                batch = pending[i:i + self.job_batch_size]
+                failed = []
+                for jr, (complete_jr, error) in zip(batch, executor.map(_create, batch)):
                     if complete_jr:
                         logger.info(f'JOB RECORD: {complete_jr["id"]}')
-                        job_recs.append(complete_jr)
-                        
-                except MissingDataObjectException as e:
-                    logger.warning(f"Caught missing Data Object(s) for {job.informed_by}: Skipping")
-                    logger.warning(e)
-                    continue
-                except Exception as e:
-                    logger.exception(e)
-                    raise
+                        self.job_index.add(complete_jr)
+                        created.append(complete_jr)
+                    else:
+                        failed.append((jr, error))
+                if failed:
+                    created.extend(self._recover_failed_jobs(failed))
+        return created
+
+    def _recover_failed_jobs(self, failed: List[tuple]) -> List[dict]:
+        """
+        Look up the jobs whose creation failed with one list_jobs call. A job found for the
+        same workflow release and trigger activity was created despite the error; the rest
+        are reported as failures.
+        """
+        recovered = []
+        try:
+            jobs = self.api.list_jobs({
+                "config.git_repo": {"$in": sorted({jr["config"]["git_repo"] for jr, _ in failed})},
+                "config.trigger_activity": {"$in": sorted({jr["config"]["trigger_activity"] for jr, _ in failed})},
+            })
+        except Exception as e:
+            logger.error(f"Failed to look up {len(failed)} failed job records: {e}")
+            jobs = []
+        jobs_by_key = {self._job_key(job): job for job in jobs}
+        for jr, error in failed:
+            key = self._job_key(jr)
+            if key in jobs_by_key:
+                logger.info(f'JOB RECORD: {jobs_by_key[key]["id"]} (created despite error: {error})')
+                self.job_index.add(jobs_by_key[key])
+                recovered.append(jobs_by_key[key])
+                continue
+            logger.error(f"Failed to create job for {key[2]} {key[0]}:{key[1]}: {error}")
+            self.job_failures.append({
+                "workflow": jr["workflow"]["id"], "trigger_activity": key[2], "error": str(error)
+            })
+        return recovered
+
+
+# The scheduler whose cycle the shard worker processes run, inherited through fork
+_shard_coordinator: Optional["ShardedScheduler"] = None
+
+
+def _run_shard_in_worker(index: int):
+    return _shard_coordinator._run_shard(index, in_worker=True)
+
+
+def _fresh_connection_pools(session: requests.Session) -> None:
+    """
+    Give a forked process its own connection pools, so it never writes to a keep-alive
+    socket that the parent process is also using. Other transport adapters are kept.
+    """
+    replaced = {}
+    for prefix, adapter in list(session.adapters.items()):
+        if not isinstance(adapter, HTTPAdapter):
+            continue
+        if id(adapter) not in replaced:
+            replaced[id(adapter)] = HTTPAdapter(
+                pool_connections=adapter._pool_connections, pool_maxsize=adapter._pool_maxsize,
+                max_retries=adapter.max_retries, pool_block=adapter._pool_block,
+            )
+        session.adapters[prefix] = replaced[id(adapter)]
+
+
+class ShardedScheduler(Scheduler):
+    """
+    A Scheduler that partitions the data generations into `shards` by a stable hash of
+    their ID, or of their study with shard_by="study", and builds and schedules the
+    subgraph of each shard in its own worker process.
+
+    The coordinating process fetches the records once, through the graph loader, and
+    loads the existing jobs; the forked workers share both. Workers return their job
+    records, and the coordinator submits them with create_jobs, which drops the
+    duplicates found by more than one shard, e.g. for a manifest whose pooled
+    replicates were hashed into different shards.
+    """
+
+    def __init__(self, workflow_yaml, site_conf="site_configuration.toml", api=None,
+                 shards: Optional[int] = None, shard_by: str = "id", processes: bool = True, **kwargs):
+        super().__init__(workflow_yaml, site_conf=site_conf, api=api, **kwargs)
+        if shard_by not in ShardFilter.BY:
+            raise ValueError(f"Unknown shard key {shard_by}, expected one of {ShardFilter.BY}")
+        self.shards = max(1, shards or os.cpu_count() or 1)
+        self.shard_by = shard_by
+        self.processes = processes
+        # Records are always fetched through a loader, which the workers read from;
+        # without incremental loading it is emptied at the start of every cycle
+        self._refetch_records = self.graph_loader is None
+        if self.graph_loader is None:
+            self.graph_loader = IncrementalWorkflowProcessLoader(self.api, self.workflows)
+            self.graph_loader.metrics = self.metrics
+        logger.info(f"Scheduling in {self.shards} shards by {self.shard_by}")
+
+    def _cycle(self, dryrun: bool, skiplist: Optional[list], allowlist) -> list:
+        self._cycle_args = (skiplist, allowlist, dryrun)
+        with self.metrics.phase("load_workflow_process_nodes"):
+            if self._refetch_records:
+                self.graph_loader.reset()
+            if self.graph_loader.sync(allowlist):
+                self.graph_loader.save_snapshot()
+
+        self._reset_cycle_state()
+        with self.metrics.phase("find_new_jobs.load_jobs"):
+            self.job_index.load(self.api, {wf.git_repo for wf in self.workflows if wf.enabled})
+
+        with self.metrics.phase("shards"):
+            results = self._run_shards()
+        new_job_recs = []
+        for job_recs, phases, messages in results:
+            new_job_recs.extend(job_recs)
+            self.metrics.add_phases(phases, prefix="shard.")
+            self._messages.update(messages)
+        if dryrun:
+            return []
+
+        with self.metrics.phase("create_job"):
+            job_recs = self.create_jobs(new_job_recs)
         return job_recs
 
+    def _run_shards(self) -> List[tuple]:
+        global _shard_coordinator
+        if not self.processes or self.shards == 1:
+            return [self._run_shard(index) for index in range(self.shards)]
+        _shard_coordinator = self
+        try:
+            with ProcessPoolExecutor(max_workers=self.shards,
+                                     mp_context=multiprocessing.get_context("fork")) as executor:
+                return list(executor.map(_run_shard_in_worker, range(self.shards)))
+        finally:
+            _shard_coordinator = None
+
+    def _run_shard(self, index: int, in_worker: bool = False) -> tuple:
+        """
+        Build the subgraph of one shard and find its job records. Returns the records,
+        the phases timed and the messages logged, for the coordinator to merge.
+        """
+        skiplist, allowlist, dryrun = self._cycle_args
+        if in_worker:
+            # Each worker mints its own IDs: copies of a local ID pool would hand out the same ones
+            _fresh_connection_pools(self.api.session)
+            _fresh_connection_pools(self.url_resolver.session)
+            self.id_pool = None
+        metrics, self.metrics = self.metrics, CycleMetrics(api=self.api)
+        messages = set(self._messages)
+        try:
+            self.metrics.start_cycle()
+            with self.metrics.phase("load_workflow_process_nodes"):
+                wfp_nodes, manifest_map = load_workflow_process_nodes(
+                    self.graph_loader, self.workflows, allowlist, metrics=self.metrics,
+                    shard=ShardFilter(index, self.shards, self.shard_by),
+                )
+            job_recs = self.find_job_records(wfp_nodes, manifest_map, skiplist, dryrun)
+            logger.info(f"Shard {index + 1}/{self.shards}: {len(wfp_nodes)} workflow process nodes, "
+                        f"{len(job_recs)} job records")
+            return job_recs, self.metrics.phases(), self._messages - messages
+        finally:
+            self.metrics = metrics
 
 
 def main(site_conf, wf_file):  # pragma: no cover
@@ -643,7 +1185,26 @@ def main(site_conf, wf_file):  # pragma: no cover
     #db = get_db()
     logger.info("Initializing Scheduler")
     #sched = Scheduler(db, wf_file, site_conf=site_conf)
-    sched = Scheduler(wf_file, site_conf=site_conf)
+    incremental = os.environ.get("INCREMENTAL") == "1"
+    snapshot_path = os.environ.get("GRAPH_SNAPSHOT_FILE") or None
+    scheduler_args = dict(
+        site_conf=site_conf, incremental=incremental, snapshot_path=snapshot_path,
+        metrics_file=os.environ.get("SCHEDULER_METRICS_FILE") or None,
+        prometheus_file=os.environ.get("SCHEDULER_PROMETHEUS_FILE") or None,
+    )
+    poll_args = dict(
+        min_interval=float(os.environ.get("SCHEDULER_POLL_MIN") or _POLL_INTERVAL),
+        max_interval=float(os.environ.get("SCHEDULER_POLL_MAX") or 900),
+        trigger_file=os.environ.get("SCHEDULER_TRIGGER_FILE") or None,
+    )
+    # SCHEDULER_SHARDS=auto uses a shard per core
+    shards = os.environ.get("SCHEDULER_SHARDS", "1")
+    if shards == "auto" or int(shards) > 1:
+        sched = ShardedScheduler(wf_file, shards=None if shards == "auto" else int(shards),
+                                 shard_by=os.environ.get("SCHEDULER_SHARD_BY", "id"), **scheduler_args)
+    else:
+        sched = Scheduler(wf_file, **scheduler_args)
+    sched.poller = AdaptivePollInterval(sched.api, **poll_args)
 
     dryrun = False
     if os.environ.get("DRYRUN") == "1":
@@ -671,13 +1232,16 @@ def main(site_conf, wf_file):  # pragma: no cover
     logger.info("Starting Scheduler")
     cycle_count = 0
     while True:
-        sched.cycle(dryrun=dryrun, skiplist=skiplist, allowlist=allowlist)
+        sched.poller.start_cycle()
+        job_recs = sched.cycle(dryrun=dryrun, skiplist=skiplist, allowlist=allowlist)
         cycle_count += 1
         if dryrun:
             break
-        _sleep(_POLL_INTERVAL)
+        sched.poller.end_cycle(len(job_recs))
+        sched.poller.wait()
         if cycle_count % 100 == 0:
             logger.info(f"Cycles: {cycle_count}")
+            logger.info(f"Runtime API stats: {sched.api.http_stats()}")
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -1,23 +1,25 @@
 #!/usr/bin/env python
 import sys
 from time import sleep
+import gzip
 import json
 import logging
 from json import loads
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Union, Tuple
-from linkml_runtime.dumpers import yaml_dumper
+from typing import List, Dict, Any, Iterator, Optional, Union, Tuple
 import yaml
 import linkml.validator
 import importlib.resources
 from functools import lru_cache
 import traceback
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from nmdc_schema.nmdc import Database
 from nmdc_automation.api import NmdcRuntimeApi
 from nmdc_automation.config import SiteConfig
-from nmdc_automation.workflow_automation.wfutils import WorkflowJob
+from nmdc_automation.models.nmdc import schema_object_to_dict
+from nmdc_automation.workflow_automation.wfutils import RateLimiter, WorkflowJob
 
 from jaws_client import api as jaws_api
 from jaws_client.config import Configuration as jaws_Configuration
@@ -25,6 +27,8 @@ from jaws_client.config import Configuration as jaws_Configuration
 DEFAULT_STATE_DIR = Path(__file__).parent / "_state"
 DEFAULT_STATE_FILE = DEFAULT_STATE_DIR / "state.json"
 INITIAL_STATE = {"jobs": []}
+# Status of a job whose runner could not be reached this cycle
+_STATUS_UNCHECKED = object()
 
 logging_level = os.getenv("NMDC_LOG_LEVEL", logging.INFO)
 logging.basicConfig(
@@ -33,12 +37,171 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class StateJournal:
+    """
+    The watcher state stored as a JSON snapshot, the state file, and an append-only
+    JSON-lines journal next to it (`<state file>.journal`) of the jobs that changed since.
+
+    A write appends one {"put": job} or {"delete": key} line per job that was added, changed
+    or removed since the last write, keyed by opid (or nmdc_jobid), and fsyncs the journal.
+    Once the journal holds `compact_entries` lines the snapshot is rewritten, through a temp
+    file and an atomic rename, and the journal is emptied. A torn last line left by a crash
+    is ignored on read; replaying a journal over a newer snapshot is harmless.
+    """
+    COMPACT_ENTRIES = 1000
+
+    def __init__(self, state_file: Union[str, Path], compact_entries: int = COMPACT_ENTRIES):
+        self.state_file = Path(state_file)
+        self.journal_file = self.state_file.with_name(self.state_file.name + ".journal")
+        self.compact_entries = compact_entries
+        # key -> serialized job, as of the last read or write; None until then
+        self._written: Optional[Dict[str, str]] = None
+        self._journal_entries = 0
+
+    @staticmethod
+    def job_key(job: Dict[str, Any]) -> Optional[str]:
+        return job.get("opid") or job.get("nmdc_jobid")
+
+    def read(self) -> Dict[str, Any]:
+        """ The snapshot with the journal replayed over it """
+        with open(self.state_file, "r") as f:
+            state = loads(f.read())
+        jobs = {}
+        for i, job in enumerate(state.get("jobs", [])):
+            jobs[self.job_key(job) or f"#{i}"] = job
+
+        entries = 0
+        if self.journal_file.exists():
+            with open(self.journal_file, "r") as f:
+                lines = f.read().splitlines()
+            for n, line in enumerate(lines):
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring unreadable entry {n + 1} of {len(lines)} in {self.journal_file}")
+                    break
+                if "put" in entry:
+                    jobs[self.job_key(entry["put"])] = entry["put"]
+                else:
+                    jobs.pop(entry["delete"], None)
+                entries += 1
+
+        state["jobs"] = list(jobs.values())
+        self._written = {key: json.dumps(job) for key, job in jobs.items()}
+        self._journal_entries = entries
+        return state
+
+    def signature(self) -> Tuple[Optional[Tuple[int, int, int]], ...]:
+        """ The inode, mtime and size of the state file and the journal; any write changes them """
+        signature = []
+        for path in (self.state_file, self.journal_file):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                signature.append(None)
+                continue
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def write(self, data: Dict[str, Any]) -> None:
+        """ Journal the jobs that changed since the last read or write """
+        serialized = {}
+        for job in data["jobs"]:
+            key = self.job_key(job)
+            if key is None or key in serialized:
+                # jobs that can't be keyed are only kept in the snapshot
+                self.compact(data)
+                return
+            serialized[key] = json.dumps(job)
+        if self._written is None:
+            self.compact(data)
+            return
+
+        entries = [f'{{"put": {job}}}' for key, job in serialized.items() if self._written.get(key) != job]
+        entries.extend(json.dumps({"delete": key}) for key in self._written if key not in serialized)
+        if not entries:
+            return
+        if self._journal_entries + len(entries) > self.compact_entries:
+            self.compact(data)
+            return
+
+        logger.debug(f"Journaling {len(entries)} changed jobs to {self.journal_file}")
+        with open(self.journal_file, "a") as f:
+            f.write("\n".join(entries) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._written = serialized
+        self._journal_entries += len(entries)
+
+    def compact(self, data: Dict[str, Any]) -> None:
+        """ Atomically rewrite the snapshot with `data` and empty the journal """
+        logger.debug(f"Writing state to {self.state_file} - updating {len(data['jobs'])} jobs")
+        tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+        if self.journal_file.exists():
+            os.remove(self.journal_file)
+        self._written = {}
+        for i, job in enumerate(data["jobs"]):
+            self._written[self.job_key(job) or f"#{i}"] = json.dumps(job)
+        self._journal_entries = 0
+
+
+class JobArchive:
+    """
+    Completed and permanently failed jobs, moved out of the watcher state into a
+    gzip-compressed JSON-lines file next to it (`<state file>.archive.gz`).
+
+    Each append adds a gzip member to the end of the file, so the archive is never
+    rewritten. A job archived more than once is read back as its latest record. A torn
+    last member left by a crash is ignored on read.
+    """
+
+    def __init__(self, state_file: Union[str, Path]):
+        self.state_file = Path(state_file)
+        self.archive_file = self.state_file.with_name(self.state_file.name + ".archive.gz")
+
+    def append(self, jobs: List[Dict[str, Any]]) -> None:
+        """ Append the jobs to the archive """
+        if not jobs:
+            return
+        lines = "".join(json.dumps(job) + "\n" for job in jobs)
+        with open(self.archive_file, "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="ab") as gz:
+                gz.write(lines.encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        """ Every archived job record, oldest first """
+        if not self.archive_file.exists():
+            return
+        with gzip.open(self.archive_file, "rt") as f:
+            try:
+                for line in f:
+                    yield loads(line)
+            except (EOFError, OSError, ValueError) as e:
+                logger.warning(f"Ignoring the unreadable end of {self.archive_file}: {e}")
+
+    def jobs(self) -> Dict[str, Dict[str, Any]]:
+        """ The latest archived record of each job, by opid (or nmdc_jobid) """
+        jobs = {}
+        for i, job in enumerate(self.read()):
+            jobs[StateJournal.job_key(job) or f"#{i}"] = job
+        return jobs
+
+
 class FileHandler:
     """ FileHandler class for managing state and metadata files """
     def __init__(self, config: SiteConfig, state_file: Union[str, Path] = None):
         """ Initialize the FileHandler, with a Config object and an optional state file path """
         self.config = config
         self._state_file = None
+        self._journal: Optional[StateJournal] = None
+        self._archive: Optional[JobArchive] = None
         # set state file
         if state_file:
             logger.info(f"Initializing FileHandler with state file: {state_file}")
@@ -68,24 +231,47 @@ class FileHandler:
         """ Set the state file path """
         self._state_file = value
 
+    @property
+    def journal(self) -> StateJournal:
+        """ The journaled store of the current state file """
+        if self._journal is None or self._journal.state_file != Path(self.state_file):
+            self._journal = StateJournal(self.state_file)
+        return self._journal
+
+    @property
+    def archive(self) -> JobArchive:
+        """ The archive of finished jobs for the current state file """
+        if self._archive is None or self._archive.state_file != Path(self.state_file):
+            self._archive = JobArchive(self.state_file)
+        return self._archive
+
     def read_state(self) -> Optional[Dict[str, Any]]:
-        """ Read the state file and return the data """
-        with open(self.state_file, "r") as f:
-            state = loads(f.read())
-        return state
+        """ Read the state file, with the changes journaled since it was written, and return the data """
+        return self.journal.read()
+
+    def state_signature(self) -> Tuple:
+        """ A value that changes whenever the state file or its journal is written """
+        return self.journal.signature()
 
     def write_state(self, data) -> None:
-        """ Write data to the state file """
+        """ Write the jobs that changed to the state journal """
         # normalize "id" used in database job records to "nmdc_jobid"
-        job_count = 0
         for job in data["jobs"]:
-            job_count += 1
             if "id" in job:
                 job["nmdc_jobid"] = job.pop("id")
+        self.journal.write(data)
 
-        logger.debug(f"Writing state to {self.state_file} - updating {job_count} jobs")
-        with open(self.state_file, "w") as f:
-            json.dump(data, f, indent=2)
+    def compact_state(self) -> None:
+        """ Fold the journal into the state file """
+        self.journal.compact(self.read_state())
+
+    def archive_jobs(self, jobs: List[Dict[str, Any]]) -> None:
+        """ Append the state of finished jobs to the job archive """
+        self.archive.append(jobs)
+
+    def read_archive(self) -> List[Dict[str, Any]]:
+        """ The latest archived state of each finished job """
+        return list(self.archive.jobs().values())
 
     def get_output_path(self, job: WorkflowJob) -> Path:
         """ Get the output path for a job """
@@ -121,6 +307,72 @@ class FileHandler:
         return metadata_filepath
 
 
+class JobCache(list):
+    """
+    A list of WorkflowJob objects with an index by operation ID. Jobs are
+    expected to have their opid set before they are added to the cache.
+    """
+
+    def __init__(self, jobs=()):
+        super().__init__(jobs)
+        self._rebuild_index()
+
+    def _rebuild_index(self) -> None:
+        self._jobs_by_opid = {}
+        for job in self:
+            self._index(job)
+
+    def _index(self, job) -> None:
+        if job.opid:
+            self._jobs_by_opid.setdefault(job.opid, job)
+
+    def append(self, job) -> None:
+        super().append(job)
+        self._index(job)
+
+    def extend(self, jobs) -> None:
+        for job in jobs:
+            self.append(job)
+
+    def __iadd__(self, jobs):
+        self.extend(jobs)
+        return self
+
+    def insert(self, index, job) -> None:
+        super().insert(index, job)
+        self._rebuild_index()
+
+    def remove(self, job) -> None:
+        super().remove(job)
+        self._rebuild_index()
+
+    def pop(self, index=-1):
+        job = super().pop(index)
+        self._rebuild_index()
+        return job
+
+    def clear(self) -> None:
+        super().clear()
+        self._jobs_by_opid.clear()
+
+    def __setitem__(self, index, value) -> None:
+        super().__setitem__(index, value)
+        self._rebuild_index()
+
+    def __delitem__(self, index) -> None:
+        super().__delitem__(index)
+        self._rebuild_index()
+
+    def find_by_opid(self, opid):
+        """ The first job with the operation ID, or None """
+        job = self._jobs_by_opid.get(opid)
+        if job is not None and job.opid != opid:
+            # the job's opid was changed after it was cached
+            self._rebuild_index()
+            job = self._jobs_by_opid.get(opid)
+        return job
+
+
 class JobManager:
     """ JobManager class for managing WorkflowJob objects """
     def __init__(self, config: SiteConfig, file_handler: FileHandler, init_cache: bool = True, jaws_api=None):
@@ -128,8 +380,13 @@ class JobManager:
         self.config = config
         self.file_handler = file_handler
         self.jaws_api = jaws_api
-        self._job_cache = []
+        self._job_cache = JobCache()
+        # state_signature() as of the last restore or checkpoint
+        self._state_signature = None
         self._MAX_FAILS = 2
+        # Job statuses are checked on this many threads, within each runner's rate limit
+        self._STATUS_WORKERS = 16
+        self._status_limiters: Dict[type, RateLimiter] = {}
         if init_cache:
             self.restore_from_state()
 
@@ -141,7 +398,7 @@ class JobManager:
     @job_cache.setter
     def job_cache(self, value) -> None:
         """ Set the job cache """
-        self._job_cache = value
+        self._job_cache = value if isinstance(value, JobCache) else JobCache(value)
 
     def job_checkpoint(self) -> Dict[str, Any]:
         """ Get the state data for all jobs """
@@ -150,13 +407,35 @@ class JobManager:
         return data
 
     def save_checkpoint(self) -> None:
-        """ Save jobs to state data """
+        """ Archive finished jobs and save the rest to state data """
+        self.archive_done_jobs()
         data = self.job_checkpoint()
         self.file_handler.write_state(data)
+        self._state_signature = self.file_handler.state_signature()
+
+    def archive_done_jobs(self) -> List[WorkflowJob]:
+        """
+        Move done jobs, successful or permanently failed, out of the job cache into the
+        job archive, so that each cycle only handles active jobs
+        """
+        done_jobs = [job for job in self.job_cache if job.done]
+        if done_jobs:
+            logger.info(f"Archiving {len(done_jobs)} done job(s)")
+            self.file_handler.archive_jobs([job.workflow.state for job in done_jobs])
+            self.job_cache = [job for job in self.job_cache if not job.done]
+        return done_jobs
 
     def restore_from_state(self) -> None:
-        """ Restore jobs from state data """
+        """
+        Restore jobs from state data, archiving any that are done. The state is not
+        re-read if it hasn't been written since the last restore or checkpoint.
+        """
+        signature = self.file_handler.state_signature()
+        if signature == self._state_signature:
+            logger.debug("State unchanged since the last checkpoint, skipping restore")
+            return
         new_jobs = self.get_new_workflow_jobs_from_state()
+        self._state_signature = signature
         # Summarize wf_job_list by last_status
         status_count = {}
         for job in new_jobs:
@@ -168,27 +447,48 @@ class JobManager:
         if new_jobs:
             logger.info(f"Adding {len(new_jobs)} new jobs from state file.")
             self.job_cache.extend(new_jobs)
+            if any(job.done for job in new_jobs):
+                self.save_checkpoint()
 
     def get_new_workflow_jobs_from_state(self) -> List[WorkflowJob]:
         """ Find new jobs from state data that are not already in the job cache """
         wf_job_list = []
-        job_cache_ids = [job.opid for job in self.job_cache]
+        # opids of the new jobs; cached jobs are looked up in the job cache's own index
+        new_job_ids = set()
         state = self.file_handler.read_state()
 
         for job in state["jobs"]:
-            if job.get("opid") and job.get("opid") in job_cache_ids:
+            opid = job.get("opid")
+            if opid and (opid in new_job_ids or self.job_cache.find_by_opid(opid)):
                 # already in cache
                 continue
             wf_job = WorkflowJob(self.config, workflow_state=job, jaws_api=self.jaws_api)
             logger.info(f"Job from State: {wf_job.opid} {wf_job.was_informed_by} / {wf_job.workflow_execution_id}, Last Status: {wf_job.workflow.last_status} /{wf_job.opid} / {wf_job.workflow.nmdc_jobid}")
-            job_cache_ids.append(wf_job.opid)
+            new_job_ids.add(wf_job.opid)
             wf_job_list.append(wf_job)
 
         return wf_job_list
 
-    def find_job_by_opid(self, opid) -> Optional[WorkflowJob]:
-        """ Find a job by operation id """
-        return next((job for job in self.job_cache if job.opid == opid), None)
+    def find_job_by_opid(self, opid, archived: bool = False) -> Optional[WorkflowJob]:
+        """ Find a job by operation id, in the job archive too if `archived` is set """
+        job = self.job_cache.find_by_opid(opid)
+        if job is None and archived:
+            job = next((job for job in self.get_archived_jobs() if job.opid == opid), None)
+        return job
+
+    def get_archived_jobs(self) -> List[WorkflowJob]:
+        """ Archived jobs that are not back in the job cache """
+        return [
+            WorkflowJob(self.config, workflow_state=job, jaws_api=self.jaws_api)
+            for job in self.file_handler.read_archive()
+            if not (job.get("opid") and self.job_cache.find_by_opid(job["opid"]))
+        ]
+
+    def reactivate(self, job: WorkflowJob) -> None:
+        """ Put an archived job back in the job cache, e.g. to resubmit it """
+        if self.job_cache.find_by_opid(job.opid) is None:
+            logger.info(f"Reactivating archived job {job.opid}")
+            self.job_cache.append(job)
 
     def prepare_and_cache_new_job(self, new_job: WorkflowJob, opid: str, force=False)-> Optional[WorkflowJob]:
         """
@@ -220,11 +520,12 @@ class JobManager:
         Jobs are considered finished if they have a last status of "Succeeded" or "Failed"
         or if they have reached the maximum number of failures
 
-        Unfinished jobs are checked for status and updated if needed.
-        A checkpoint is saved after checking for finished jobs.
+        Unfinished jobs are checked for status, concurrently with get_job_statuses, and
+        updated if needed. A checkpoint is saved after checking for finished jobs.
         """
         successful_jobs = []
         failed_jobs = []
+        unfinished_jobs = []
         for job in self.job_cache:
             if not job.done:
                 if job.workflow.last_status == "succeeded" and job.opid:
@@ -233,22 +534,23 @@ class JobManager:
                 if job.workflow.last_status in ("failed", "null") and job.workflow.failed_count >= self._MAX_FAILS:
                     failed_jobs.append(job)
                     continue
+                unfinished_jobs.append(job)
 
-                # check status
-                raw_status = job.job.get_job_status()
-                status = "null" if raw_status is None else str(raw_status).strip().lower()
-
-                if status == "succeeded":
-                    job.workflow.last_status = status
-                    successful_jobs.append(job)
-                    continue
-                elif status in ("failed", "null"):
-                    job.workflow.last_status = status
-                    failed_jobs.append(job)
-                    continue
-                else:
-                    job.workflow.last_status = status
-                    logger.debug(f"Job {job.opid} status: {status}")
+        # check status
+        for job, raw_status in zip(unfinished_jobs, self.get_job_statuses(unfinished_jobs)):
+            if raw_status is _STATUS_UNCHECKED:
+                continue
+            status = "null" if raw_status is None else str(raw_status).strip().lower()
+
+            if status == "succeeded":
+                job.workflow.last_status = status
+                successful_jobs.append(job)
+            elif status in ("failed", "null"):
+                job.workflow.last_status = status
+                failed_jobs.append(job)
+            else:
+                job.workflow.last_status = status
+                logger.debug(f"Job {job.opid} status: {status}")
         self.save_checkpoint()
 
         if successful_jobs:
@@ -257,6 +559,46 @@ class JobManager:
             logger.info(f"Found {len(failed_jobs)} failed jobs.")
         return successful_jobs, failed_jobs
 
+    def get_job_statuses(self, jobs: List[WorkflowJob]) -> List[Any]:
+        """
+        Get the job runner status of each job. Each runner's jobs are looked up with its bulk
+        status query first; the rest are checked one by one on a thread pool, within the
+        runner's STATUS_RATE_LIMIT. A job whose status check failed is left unchecked until
+        the next cycle.
+        """
+        statuses: Dict[int, Any] = {}
+        jobs_by_runner: Dict[type, List[WorkflowJob]] = {}
+        for job in jobs:
+            jobs_by_runner.setdefault(type(job.job), []).append(job)
+        for runner_class, runner_jobs in jobs_by_runner.items():
+            try:
+                bulk_statuses = runner_class.get_job_statuses([job.job for job in runner_jobs])
+            except Exception as e:
+                logger.warning(f"Bulk status query failed for {len(runner_jobs)} {runner_class.__name__} jobs: {e}")
+                bulk_statuses = [None] * len(runner_jobs)
+            for job, status in zip(runner_jobs, bulk_statuses):
+                if status is not None:
+                    statuses[id(job)] = status
+
+        def _get_status(job):
+            limiter = self._status_limiters.get(type(job.job))
+            if limiter is None:
+                limiter = self._status_limiters.setdefault(type(job.job), RateLimiter(job.job.STATUS_RATE_LIMIT))
+            limiter.wait()
+            try:
+                return job.job.get_job_status()
+            except Exception as e:
+                logger.error(f"Failed to get status for job {job.opid}: {e}")
+                return _STATUS_UNCHECKED
+
+        pending = [job for job in jobs if id(job) not in statuses]
+        if pending:
+            logger.debug(f"Checking the status of {len(pending)} jobs")
+            with ThreadPoolExecutor(max_workers=min(self._STATUS_WORKERS, len(pending))) as executor:
+                for job, status in zip(pending, executor.map(_get_status, pending)):
+                    statuses[id(job)] = status
+        return [statuses[id(job)] for job in jobs]
+
     def process_successful_job(self, job: WorkflowJob) -> Database:
         """ Process a successful job and return a Database object """
         output_path = self.file_handler.get_output_path(job)
@@ -313,10 +655,13 @@ class JobManager:
         jobid = job.job.submit_job()
         return jobid
 
-    def report(self) -> List[dict]:
-        """ Report the current state of the JobManager's job cache """
+    def report(self, archived: bool = False) -> List[dict]:
+        """ Report the current state of the JobManager's job cache, and of the job archive if `archived` is set """
+        jobs = list(self.job_cache)
+        if archived:
+            jobs.extend(self.get_archived_jobs())
         job_reports = []
-        for job in self.job_cache:
+        for job in jobs:
             rpt ={
                 "wdl": job.workflow.wdl, "release": job.workflow.release, "last_status": job.workflow.last_status, "was_informed_by": job.workflow.was_informed_by, "workflow_execution_id": job.workflow.workflow_execution_id
             }
@@ -328,9 +673,12 @@ class JobManager:
 
         return job_reports
 
-    def get_failed_jobs(self) -> List[WorkflowJob]:
-        """ Get failed jobs """
-        failed_jobs = [job for job in self.job_cache if
+    def get_failed_jobs(self, archived: bool = False) -> List[WorkflowJob]:
+        """ Get failed jobs, from the job archive too if `archived` is set """
+        jobs = list(self.job_cache)
+        if archived:
+            jobs.extend(self.get_archived_jobs())
+        failed_jobs = [job for job in jobs if
                        getattr(job.workflow, "last_status", "").lower() == "failed"]
         return failed_jobs
 
@@ -454,7 +802,7 @@ class Watcher:
                 logger.error(f"No data objects found for job {job.opid}.")
                 continue
 
-            job_dict = yaml.safe_load(yaml_dumper.dumps(job_database))
+            job_dict = schema_object_to_dict(job_database)
             # validate the database object against the schema
             validation_report = linkml.validator.validate(
                 job_dict, self.nmdc_materialized, "Database"
@@ -483,6 +831,7 @@ class Watcher:
 
     def watch(self):
         """ Maintain a polling loop to 'cycle' through job claims and processing """
+        self.file_handler.compact_state()
         logger.info("Entering polling loop")
         while True:
             try:
@@ -500,7 +849,7 @@ class Watcher:
             new_job = self.job_manager.prepare_and_cache_new_job(job, opid)
             if new_job:
                 new_job.job.submit_job()
-        self.file_handler.write_state(self.job_manager.job_checkpoint())
+        self.job_manager.save_checkpoint()
 
 
 @lru_cache(maxsize=None)
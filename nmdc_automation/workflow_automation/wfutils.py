@@ -7,7 +7,9 @@ import os
 import re
 import shutil
 import tempfile
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import time
@@ -33,6 +35,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class CopyVerificationError(IOError):
+    """ A copied file is not the size of the data read from its source """
+
+
+class RateLimiter:
+    """ Space calls at least 1 / `rate` seconds apart, across threads """
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
 class JobRunnerABC(ABC):
     """Abstract base class for job runners"""
 
@@ -45,6 +69,9 @@ class JobRunnerABC(ABC):
         "on hold",  # job is on hold and not running. It can be manually resumed later
     ]
 
+    # Most status calls per second the watcher makes to this runner's backend
+    STATUS_RATE_LIMIT = 10.0
+
     def __init__(self, site_config: SiteConfig, workflow: "WorkflowStateManager"):
         self.config = site_config
         self.workflow = workflow
@@ -64,6 +91,14 @@ class JobRunnerABC(ABC):
         """ Get metadata for a job """
         pass
 
+    @classmethod
+    def get_job_statuses(cls, runners: List["JobRunnerABC"]) -> List[Optional[str]]:
+        """
+        Get the status of several jobs with bulk backend queries. A status is None
+        if it is not known from the bulk query and the job has to be checked by itself.
+        """
+        return [None] * len(runners)
+
     @property
     @abstractmethod
     def job_id(self) -> Optional[str]:
@@ -267,6 +302,17 @@ class JawsRunner(JobRunnerABC):
         # If the status is 'done' then return the result key
         return resp['result']
 
+    @classmethod
+    def get_job_statuses(cls, runners: List["JawsRunner"]) -> List[Optional[str]]:
+        """
+        Runs in the JAWS queue, which lists the user's unfinished runs in one call,
+        are running. Runs that left the queue are finished and are checked by themselves.
+        """
+        if not runners:
+            return []
+        active = {str(run["id"]) for run in runners[0].jaws_api.queue()}
+        return ["running" if str(runner.job_id) in active else None for runner in runners]
+
 
 
     @property
@@ -323,6 +369,11 @@ class CromwellRunner(JobRunnerABC):
     """Job runner for Cromwell"""
     LABEL_SUBMITTER_VALUE = "nmdcda"
     LABEL_PARAMETERS = ["release", "wdl", "git_repo"]
+    STATUS_RATE_LIMIT = 20.0
+    # Workflow IDs per /query request
+    QUERY_CHUNK_SIZE = 100
+    # (connect, read) timeout of status requests, so a hung Cromwell can't block a watcher cycle
+    STATUS_TIMEOUT = (10, 60)
 
     def __init__(self, site_config: SiteConfig, workflow: "WorkflowStateManager", job_metadata: Dict[str, Any] = None,
                  max_retries: int = DEFAULT_MAX_RETRIES, dry_run: bool = False) -> None:
@@ -394,7 +445,7 @@ class CromwellRunner(JobRunnerABC):
         # being available in Cromwell so handle 404 errors
         logger.debug(f"Getting job status from {status_url}")
         try:
-            response = requests.get(status_url)
+            response = requests.get(status_url, timeout=self.STATUS_TIMEOUT)
             response.raise_for_status()
             return response.json().get("status", "Unknown")
         except requests.exceptions.HTTPError as e:
@@ -402,6 +453,29 @@ class CromwellRunner(JobRunnerABC):
                 return "Unknown"
             raise e
 
+    @classmethod
+    def get_job_statuses(cls, runners: List["CromwellRunner"]) -> List[Optional[str]]:
+        """
+        Get the status of many Cromwell workflows with /query requests by workflow ID.
+        If a request fails or times out its workflows are left to be checked by themselves.
+        """
+        if not runners:
+            return []
+        job_ids = [runner.workflow.job_runner_id for runner in runners]
+        pending = list(dict.fromkeys(job_id for job_id in job_ids if job_id))
+        statuses = {}
+        for i in range(0, len(pending), cls.QUERY_CHUNK_SIZE):
+            query = [{"id": job_id} for job_id in pending[i:i + cls.QUERY_CHUNK_SIZE]]
+            try:
+                response = requests.post(f"{runners[0].service_url}/query", json=query, timeout=cls.STATUS_TIMEOUT)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.warning(f"Cromwell status query for {len(query)} workflows failed: {e}")
+                continue
+            for result in response.json().get("results", []):
+                statuses[result["id"]] = result.get("status")
+        return [statuses.get(job_id) if job_id else "Unknown" for job_id in job_ids]
+
     def get_job_metadata(self) -> Dict[str, Any]:
         """ Get metadata for a job from Cromwell """
         metadata_url = f"{self.service_url}/{self.job_id}/metadata"
@@ -734,6 +808,9 @@ class WorkflowJob:
 
 
     """
+    # Outputs of a job are hashed and copied on this many threads
+    FINALIZE_WORKERS = 4
+
     def __init__(self, site_config: SiteConfig, workflow_state: Dict[str, Any] = None,
                  job_metadata: Dict['str', Any] = None, opid: str = None, jaws_api: jaws_api.JawsApi = None, dry_run: bool = False) -> None:
         self.site_config = site_config
@@ -875,10 +952,11 @@ class WorkflowJob:
 
     def make_data_objects(self, output_dir: Union[str, Path] = None) -> List[DataObject]:
         """
-        Create DataObject objects for each output of the job.
+        Create DataObject objects for each output of the job. Outputs are hashed, and
+        copied to `output_dir` if given, concurrently on FINALIZE_WORKERS threads.
         """
 
-        data_objects = []
+        outputs = []
         current_cwd = Path.cwd()
         logging.info(f"Current Working Directory (CWD) is: {current_cwd}")
         logger.info(f"Creating data objects for job {self.workflow_execution_id}")
@@ -902,11 +980,6 @@ class WorkflowJob:
             output_file = Path(self.job.outputs[output_key])
             logger.info(f"Create Data Object: {output_key} file path: {output_file}")
             
-
-            md5_sum = _md5(output_file)
-            file_size_bytes = output_file.stat().st_size
-            logger.info(f"File size: {file_size_bytes}")
-            
             if len(self.was_informed_by) == 1:
                 file_url = f"{self.url_root}/{self.was_informed_by[0]}/{self.workflow_execution_id}/{output_file.name}"
             elif self.manifest:
@@ -914,41 +987,49 @@ class WorkflowJob:
             else:
                 logger.error(f"Error: manifest not defined and was_informed_by list is != 1. File url creation failed.")
                 raise Exception(f"Error: manifest not defined and was_informed_by list is != 1. File url creation failed.")
-                
-
-            if output_dir:
-                new_output_file_path = Path(output_dir) / output_file.name
-                # copy the file to the output directory
-                shutil.copy(output_file, new_output_file_path)
 
-                # Check that the file was completely copied by md5 value. If not, try one more time.
-                # If it still fails, raise an exception.
-                if md5_sum != _md5(new_output_file_path):
-                    shutil.copy(output_file, new_output_file_path)
-                    if md5_sum != _md5(new_output_file_path):
-                        raise IOError(f"Failed to copy {output_file} to {new_output_file_path}")
+            outputs.append((output_spec, output_file, file_url))
 
-            else:
-                logger.warning(f"Output directory not provided, not copying {output_file} to output directory")
-
-            # create a DataObject object
-            data_object = DataObject (
-                id=output_spec["id"], 
-                name=output_file.name, 
-                type="nmdc:DataObject", 
-                url=file_url,
-                data_object_type=output_spec["data_object_type"], 
-                md5_checksum=md5_sum,
-                file_size_bytes=file_size_bytes,
-                description=output_spec["description"].replace('{id}', self.workflow_execution_id),
-                was_generated_by=self.workflow_execution_id, 
-                data_category=DataCategoryEnum.processed_data
-            )
-
-            data_objects.append(data_object)
-            
+        if not outputs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.FINALIZE_WORKERS, len(outputs))) as executor:
+            data_objects = list(executor.map(
+                lambda output: self._make_data_object(*output, output_dir=output_dir), outputs
+            ))
         return data_objects
 
+    def _make_data_object(self, output_spec: Dict[str, Any], output_file: Path, file_url: str,
+                          output_dir: Union[str, Path] = None) -> DataObject:
+        """ Hash an output file, copying it to the output directory in the same pass, and create its DataObject """
+        if output_dir:
+            new_output_file_path = Path(output_dir) / output_file.name
+            # The copy is checked by size and by the md5 of the file written.
+            # If it doesn't match, try one more time and let the exception through after that.
+            try:
+                md5_sum = _copy_md5(output_file, new_output_file_path)
+            except CopyVerificationError as e:
+                logger.warning(f"Retrying copy of {output_file}: {e}")
+                md5_sum = _copy_md5(output_file, new_output_file_path)
+        else:
+            logger.warning(f"Output directory not provided, not copying {output_file} to output directory")
+            md5_sum = _md5(output_file)
+        file_size_bytes = output_file.stat().st_size
+        logger.info(f"File size: {file_size_bytes}")
+
+        # create a DataObject object
+        return DataObject (
+            id=output_spec["id"], 
+            name=output_file.name, 
+            type="nmdc:DataObject", 
+            url=file_url,
+            data_object_type=output_spec["data_object_type"], 
+            md5_checksum=md5_sum,
+            file_size_bytes=file_size_bytes,
+            description=output_spec["description"].replace('{id}', self.workflow_execution_id),
+            was_generated_by=self.workflow_execution_id, 
+            data_category=DataCategoryEnum.processed_data
+        )
+
     def make_workflow_execution(self, data_objects: List[DataObject]) -> WorkflowExecution:
         """
         Create a workflow execution instance for the job. This record includes the basic workflow execution attributes
@@ -1035,6 +1116,37 @@ def _md5(file, chunk_size=4194304):
         raise Exception(f"Failed to get md5 checksum: {e}")
     
 
+def _copy_md5(src, dest, chunk_size=4194304, verify=True) -> str:
+    """
+    Copy src to dest and return the md5 checksum of the data, reading src only once:
+    each chunk is hashed and written as it is read. The copy is flushed to disk and its
+    size checked; with `verify` it is also re-read and its md5 compared to the checksum.
+    Raises CopyVerificationError if the copy is not the size of the data read or, when
+    verified, its content differs, or src changed size while it was copied.
+    """
+    hasher = hashlib.md5()
+    copied = 0
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+        while True:
+            chunk = fsrc.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            fdst.write(chunk)
+            copied += len(chunk)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    shutil.copymode(src, dest)
+
+    src_size, dest_size = os.stat(src).st_size, os.stat(dest).st_size
+    if not src_size == dest_size == copied:
+        raise CopyVerificationError(f"Failed to copy {src} to {dest}: read {copied} of {src_size} bytes, wrote {dest_size}")
+    md5_sum = hasher.hexdigest()
+    if verify and _md5(dest, chunk_size) != md5_sum:
+        raise CopyVerificationError(f"Failed to copy {src} to {dest}: md5 of the copy does not match")
+    return md5_sum
+
+
 def _cleanup_files(files: List[Union[tempfile.NamedTemporaryFile, tempfile.SpooledTemporaryFile]]):
     """Safely closes and removes files."""
     for file in files:
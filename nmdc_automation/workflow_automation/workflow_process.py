@@ -1,12 +1,18 @@
 """ This module contains functions to load workflow process nodes from the database. """
+import gzip
+import hashlib
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache, cache
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Optional, Set, Tuple
 
 from semver.version import Version
 
-from nmdc_automation.models.nmdc import DataObject
-from nmdc_automation.models.workflow import WorkflowConfig, WorkflowProcessNode
+from nmdc_automation.models.nmdc import DataObjectRecord
+from nmdc_automation.models.workflow import DATA_OBJECT_RECORD_FIELDS, WorkflowConfig, WorkflowProcessNode
+from nmdc_automation.workflow_automation.metrics import CycleMetrics, timed
 
 logging.basicConfig(level=logging.INFO,
     format="%(asctime)s %(levelname)s: %(message)s"
@@ -17,20 +23,61 @@ logger = logging.getLogger(__name__)
 warned_objects = set()
 
 
-#def get_required_data_objects_map(db, workflows: List[WorkflowConfig]) -> Dict[str, DataObject]:
-def get_required_data_objects_map(api, workflows: List[WorkflowConfig]) -> Dict[str, DataObject]:
-    """
-     Search for all the data objects that are required data object types for the workflows,
-        and return a dictionary of data objects by ID. Cache the result.
+def _projection(*field_lists: List[str]) -> str:
+    """ Comma-separated projection for list_from_collection from one or more field lists """
+    return ",".join(dict.fromkeys(field for fields in field_lists for field in fields))
 
-    """
+
+def _required_data_objects_query(workflows: List[WorkflowConfig]) -> Tuple[dict, str, int]:
+    """ The filter, projection and page size of the data_object_set query for the workflows' input types """
     # Build up a filter of what types are used
     required_types = {t for wf in workflows for t in wf.input_data_object_types}
     q = {"data_object_type": {"$in": list(required_types)}}
     max_page_size = 1000  # max number of documents to include in the page
-    records = api.list_from_collection("data_object_set", q, max=max_page_size)
+    return q, _projection(DATA_OBJECT_RECORD_FIELDS), max_page_size
+
+
+def _data_generation_query(workflows: List[WorkflowConfig], allowlist: List[str] = None) -> Tuple[dict, Optional[str]]:
+    """ The filter and projection of the data_generation_set query for the workflows """
+    analyte_category = _determine_analyte_category(workflows)
+    data_generation_workflows = [wf for wf in workflows if wf.collection == "data_generation_set"]
+    # default query for data_generation_set records filtered by analyte category
+    q = {"analyte_category": analyte_category}
+
+    # I think the cycling should start here, not from querying all data objects. 20260219 KL
+    # override query with allowlist
+    if allowlist:
+        q["id"] = {"$in": list(allowlist)}
+    dg_projection = _projection(*(wf.record_fields for wf in data_generation_workflows))
+    return q, dg_projection or None
+
+
+def fetch_workflow_process_records(api, workflows: List[WorkflowConfig], allowlist: List[str] = None) -> None:
+    """
+    Make the collection queries that load_workflow_process_nodes makes, without building
+    anything from the records. Used to fill the cache of a caching api such as
+    IncrementalWorkflowProcessLoader.
+    """
+    q, projection, max_page_size = _required_data_objects_query(workflows)
+    api.list_from_collection("data_object_set", q, projection, max=max_page_size)
+    q, projection = _data_generation_query(workflows, allowlist)
+    api.list_from_collection("data_generation_set", q, projection)
+    _get_workflow_execution_records(
+        api, [wf for wf in workflows if wf.collection == "workflow_execution_set"], allowlist
+    )
+
+
+#def get_required_data_objects_map(db, workflows: List[WorkflowConfig]) -> Dict[str, DataObjectRecord]:
+def get_required_data_objects_map(api, workflows: List[WorkflowConfig]) -> Dict[str, DataObjectRecord]:
+    """
+     Search for all the data objects that are required data object types for the workflows,
+        and return a dictionary of data objects by ID. Cache the result.
+
+    """
+    q, projection, max_page_size = _required_data_objects_query(workflows)
+    records = api.list_from_collection("data_object_set", q, projection, max=max_page_size)
     required_data_object_map = {
-        rec["id"]: DataObject(**rec)
+        rec["id"]: DataObjectRecord(**rec)
         for rec in records
     }
     #required_data_object_map = {
@@ -125,11 +172,11 @@ def _check(match_types, data_object_ids, data_objs):
     do_types = set()
     for doid in data_object_ids:
         if doid in data_objs:
-            do_types.add(data_objs[doid].data_object_type.code.text)
+            do_types.add(data_objs[doid].data_object_type_text)
     return match_set.issubset(do_types)
 
 
-def _is_missing_required_input_output(wf: WorkflowConfig, rec: dict, data_objects_by_id: Dict[str, DataObject]) -> bool:
+def _is_missing_required_input_output(wf: WorkflowConfig, rec: dict, data_objects_by_id: Dict[str, DataObjectRecord]) -> bool:
     """
     Some workflows require specific inputs or outputs.  This
     implements the filtering for those.
@@ -154,9 +201,79 @@ def _is_missing_required_input_output(wf: WorkflowConfig, rec: dict, data_object
     return not (match_in and match_out)
 
 
+def _get_workflow_execution_records(api, workflows: List[WorkflowConfig], allowlist: List[str] = None) -> List[List[dict]]:
+    """
+    Fetch the workflow execution records for each workflow, in the same order as `workflows`.
+    Workflows that read the same collection share one query: with an allowlist the query is
+    the same for all of them, otherwise their git repos are merged into one $in filter (or no
+    filter at all if any of them has no git repo). The records are then split per workflow
+    client-side, and queries for different collections run concurrently.
+    """
+    queries = {}
+    for wf in workflows:
+        queries.setdefault(wf.collection, []).append(wf)
+
+    def _query(collection_workflows):
+        if allowlist:
+            return {"was_informed_by": {"$in": list(allowlist)}}
+        git_repos = list(dict.fromkeys(wf.git_repo for wf in collection_workflows))
+        if not all(git_repos):
+            return {}
+        if len(git_repos) == 1:
+            return {"git_url": git_repos[0]}
+        return {"git_url": {"$in": git_repos}}
+
+    def _fetch(collection):
+        projection = _projection(*(wf.record_fields for wf in queries[collection]))
+        return api.list_from_collection(collection, _query(queries[collection]), projection)
+
+    if len(queries) > 1:
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            records_by_collection = dict(zip(queries, executor.map(_fetch, queries)))
+    else:
+        records_by_collection = {collection: _fetch(collection) for collection in queries}
+
+    records_by_workflow = []
+    for wf in workflows:
+        records = records_by_collection[wf.collection]
+        if not allowlist and wf.git_repo:
+            records = [rec for rec in records if rec.get("git_url") == wf.git_repo]
+        records_by_workflow.append(records)
+    return records_by_workflow
+
+
+class ShardFilter:
+    """
+    Select the data generation records of shard `index` out of `n_shards`, by a stable hash
+    of the record ID or, with by="study", of its first associated study so that a study (and
+    the manifest pools within it) stays in one shard.
+    """
+    BY = ("id", "study")
+
+    def __init__(self, index: int, n_shards: int, by: str = "id"):
+        if by not in self.BY:
+            raise ValueError(f"Unknown shard key {by}, expected one of {self.BY}")
+        self.index = index
+        self.n_shards = n_shards
+        self.by = by
+
+    def key(self, rec: Dict[str, Any]) -> str:
+        if self.by == "study" and rec.get("associated_studies"):
+            return rec["associated_studies"][0]
+        return rec["id"]
+
+    def shard_of(self, rec: Dict[str, Any]) -> int:
+        return int(hashlib.sha1(self.key(rec).encode()).hexdigest()[:8], 16) % self.n_shards
+
+    def __call__(self, rec: Dict[str, Any]) -> bool:
+        return self.shard_of(rec) == self.index
+
+
 def get_current_workflow_process_nodes(
         api, workflows: List[WorkflowConfig],
-        data_objects_by_id: Dict[str, DataObject], allowlist: List[str] = None) -> List[WorkflowProcessNode]:
+        data_objects_by_id: Dict[str, DataObjectRecord], allowlist: List[str] = None,
+        metrics: Optional[CycleMetrics] = None, shard: Optional[Callable[[dict], bool]] = None
+) -> Tuple[List[WorkflowProcessNode], "ManifestMap"]:
     """
     Fetch the relevant workflow process nodes for the given workflows.
         1. Get the Data Generation (formerly Omics Processing) records for the workflows by analyte category.
@@ -164,10 +281,11 @@ def get_current_workflow_process_nodes(
         3. Filter Workflow Execution records by:
             - version (within range) if specified in the workflow
             - input and output data objects required by the workflow
-    Returns a list of WorkflowProcessNode objects.
+    If `shard` is given only the data generations it selects, and the workflow executions
+    informed by them, are included.
+    Returns a list of WorkflowProcessNode objects and the ManifestMap of the manifests found.
     """
     workflow_process_nodes = set()
-    analyte_category = _determine_analyte_category(workflows)
 
     data_generation_ids = set()
     data_generation_workflows = [wf for wf in workflows if wf.collection == "data_generation_set"]
@@ -177,19 +295,17 @@ def get_current_workflow_process_nodes(
     # Dict to keep track of found workflows (currently unique set for each dgs to be processed)
     found_wfs = {}
 
-    # Dict to keep track of do to manifest set to input DOs and dgns
-    manifest_map = {}
+    # Manifest ID -> the first data generation record found with outputs in it
+    manifest_first_dg = {}
+    # (node, manifest ID) pairs to resolve once the manifests are known
+    node_manifests = []
 
-    # default query for data_generation_set records filtered by analyte category
-    q = {"analyte_category": analyte_category}
-
-    # I think the cycling should start here, not from querying all data objects. 20260219 KL
-    # override query with allowlist
-    if allowlist:
-        q["id"] = {"$in": list(allowlist)}
+    q, dg_projection = _data_generation_query(workflows, allowlist)
     #dg_execution_records = db["data_generation_set"].find(q)
-    dg_execution_records = api.list_from_collection("data_generation_set", q)
+    dg_execution_records = api.list_from_collection("data_generation_set", q, dg_projection)
     dg_execution_records = list(dg_execution_records)
+    if shard is not None:
+        dg_execution_records = [rec for rec in dg_execution_records if shard(rec)]
 
     for wf in data_generation_workflows:
         # Sequencing workflows don't have a git repo
@@ -202,79 +318,30 @@ def get_current_workflow_process_nodes(
                     
             # Initialize the workflowprocess node
             wfp_node = WorkflowProcessNode(rec, wf)
-            
-            current_manifest = None  #reset
-            
+
             #If the dg record has outputs that are part of a manifest set, check that is the correct category to process,
             # and find the other data objects within the manifest set (in case it wasn't included in the allowlist)
-            # Try to see if the has_output has a manifest set
-            do_ids = rec.get("has_output", [])
-
-            # Loop through the data_object IDs in the data genereation record's "has_output"
-            for do_id in do_ids:
-                if do_id in data_objects_by_id:
-                    if 'in_manifest' in data_objects_by_id[do_id].as_dict(): 
-                        # Process new manifest sets
-                        current_manifest = data_objects_by_id[do_id].as_dict()['in_manifest'][0]
-
-                        # Let's process one manifest per data_object_id for now and skip any with len >1
-                        if len(data_objects_by_id[do_id].as_dict()['in_manifest']) > 1:
-                            continue
-                        # Else this has one manifest ID associated with the data object
-                        else:
-                            if current_manifest not in manifest_map:
-                                logging.debug(f"Manifest ID found: {current_manifest}. Processing associated data objects...")
-                                # Do we want to save manifest set IDs encountered from the DOs that do not match poolable_replicates?
-                                manifest_map[current_manifest] = {}
-                                
-                                # Find all the data objects with the current manifest ID
-                                manifest_map[current_manifest] = _map_manifest_to_data_objects(api, current_manifest, manifest_map[current_manifest], data_objects_by_id)
-
-                                #initialize if new
-                                if "data_generation_set" not in manifest_map[current_manifest]:
-                                    manifest_map[current_manifest]['data_generation_set'] = []
-                                
-                                # Add this data_generation record to the manifest map
-                                if rec["id"] not in manifest_map[current_manifest]['data_generation_set']:
-                                    manifest_map[current_manifest]['data_generation_set'].append(rec["id"])                             
-
-                                # Find all other data generation records associated with this manifest using the associated DOs
-                                # Note This has to query the data_generation_set collection since 'dg_execution_records' could be limited to the allow list
-                                manifest_map[current_manifest] = _map_manifest_to_data_generation_set(api, manifest_map[current_manifest])
-
-
-            # If this wfp_node has DOs with a valid manifest ID, add the manifest to the workflowprocess node
+            current_manifest, new_manifests = _find_manifests(rec, data_objects_by_id)
+            for manifest_id in new_manifests:
+                if manifest_id not in manifest_first_dg:
+                    logging.debug(f"Manifest ID found: {manifest_id}. Processing associated data objects...")
+                    manifest_first_dg[manifest_id] = rec["id"]
             if current_manifest is not None:
-                if 'data_generation_set' in manifest_map[current_manifest]:
-                    if wfp_node.id in manifest_map[current_manifest]['data_generation_set']:
-                        wfp_node.add_to_manifest(current_manifest)
+                node_manifests.append((wfp_node, current_manifest))
 
             workflow_process_nodes.add(wfp_node)
 
-    # Build the list of data_generation_id_sets to manifest id for non-dgns processing workflows
-    # so we can add the manifest property to wfp_nodes when was_informed_by > 1
-    dg_set_to_manifest_map = {} 
-    for manifest_id, manifest_data in manifest_map.items():
-        dg_ids_list = manifest_data.get('data_generation_set') 
-        
-        if dg_ids_list:
-            # 1. Sort the list and convert it to a hashable tuple
-            key_tuple = tuple(sorted(dg_ids_list)) #ex: ('id1', 'id2')
-            
-            if key_tuple not in dg_set_to_manifest_map:
-                dg_set_to_manifest_map[key_tuple] = manifest_id
+    # Resolve the data objects and data generations of all the manifests found at once
+    with timed(metrics, "load_workflow_process_nodes.get_manifest_map"):
+        manifest_map = get_manifest_map(api, manifest_first_dg, data_objects_by_id)
 
+    # If this wfp_node has DOs with a valid manifest ID, add the manifest to the workflowprocess node
+    for wfp_node, current_manifest in node_manifests:
+        if manifest_map.has_data_generation(current_manifest, wfp_node.id):
+            wfp_node.add_to_manifest(current_manifest)
 
-    for wf in workflow_execution_workflows:
-        q = {}
-        if wf.git_repo:
-            q = {"git_url": wf.git_repo}
-        # override query with allowlist
-        if allowlist: 
-            q = {"was_informed_by": {"$in": list(allowlist)}}
-
-        #records = db[wf.collection].find(q)
-        records = api.list_from_collection(wf.collection, q)
+    records_by_workflow = _get_workflow_execution_records(api, workflow_execution_workflows, allowlist)
+    for wf, records in zip(workflow_execution_workflows, records_by_workflow):
         for rec in records:
             if rec['type'] != wf.type:
                 continue
@@ -311,11 +378,7 @@ def get_current_workflow_process_nodes(
                     current_found_rec_key = "_".join(sorted_was_informed_by)
 
                     # Look for the manifest ID to add to the workflow process node
-                    # Normalize the list: sort and convert to tuple
-                    current_manifest = None
-                    key_tuple = tuple(sorted(rec["was_informed_by"])) # Result: ('id1', 'id2')
-                    if key_tuple in dg_set_to_manifest_map:
-                        current_manifest = dg_set_to_manifest_map[key_tuple]
+                    current_manifest = manifest_map.manifest_for_data_generation_set(rec["was_informed_by"])
                     if current_manifest:
                         wfp_node.add_to_manifest(current_manifest)
 
@@ -365,6 +428,7 @@ def _resolve_relationships(current_nodes: List[WorkflowProcessNode], node_data_o
     # a map of all of the data objects they generated.
     # Let's use this to find the parent activity
     # for each child activity
+    informed_by_keys = {id(node): informed_by_key(node) for node in current_nodes}
     for node in current_nodes:
         logging.debug(f"Processing {node.id} {node.name} {node.workflow.name}")
         node_predecessors = node.workflow.parents
@@ -392,8 +456,10 @@ def _resolve_relationships(current_nodes: List[WorkflowProcessNode], node_data_o
             # Update 20260114: manifest workflows would compare a wf containing a was_informed_by list with multiple dgns_ids
             # to its parent_node - a data_generation_set ID whose was_informed_by would be itself (array of 1) so
             # this warning is not as useful. Added len comparison and moved logging to debug mode 
-            if len(node.was_informed_by) == len(parent_node.was_informed_by):
-                if sorted(node.was_informed_by) != sorted(parent_node.was_informed_by):
+            node_key = informed_by_keys[id(node)]
+            parent_key = informed_by_keys.get(id(parent_node)) or informed_by_key(parent_node)
+            if len(node_key) == len(parent_key):
+                if node_key != parent_key:
                     logging.debug(
                         "Mismatched informed by for "
                         f"{data_object_id} in {node.id} "
@@ -442,16 +508,114 @@ def _map_nodes_to_data_objects(current_nodes: List[WorkflowProcessNode], require
     return node_data_object_map, current_nodes
 
 
-# Map the data objects to a manifest ID 
-def _map_manifest_to_data_objects(api, manifest_id, manifest_to_data_objects: Dict[str, List[DataObject]], data_objects_by_id: Dict[str, DataObject]) ->  Dict[str, List[DataObject]]: 
+class ManifestMap(dict):
+    """
+    Manifest ID -> {"data_object_set": [DataObjectRecord], "data_generation_set": [data generation IDs]}
+    for the poolable manifests found in a cycle, with inverted indexes so the scheduler can
+    look up the manifest of a data object, data generation or set of data generations in O(1).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._data_generation_ids: Dict[str, set] = {}
+        self._manifest_by_data_object: Dict[str, str] = {}
+        self._manifest_by_data_generation: Dict[str, str] = {}
+        self._manifest_by_data_generation_set: Dict[Tuple[str, ...], str] = {}
+
+    def add(self, manifest_id: str, data_objects: List[DataObjectRecord], data_generation_ids: List[str]) -> None:
+        """ Add a manifest with its data objects and data generation IDs """
+        self[manifest_id] = {"data_object_set": data_objects, "data_generation_set": data_generation_ids}
+        self._data_generation_ids[manifest_id] = set(data_generation_ids)
+        for data_object in data_objects:
+            self._manifest_by_data_object.setdefault(data_object.id, manifest_id)
+        for dg_id in data_generation_ids:
+            self._manifest_by_data_generation.setdefault(dg_id, manifest_id)
+        if data_generation_ids:
+            self._manifest_by_data_generation_set.setdefault(tuple(sorted(data_generation_ids)), manifest_id)
+
+    def data_objects(self, manifest_id: str) -> List[DataObjectRecord]:
+        return self.get(manifest_id, {}).get("data_object_set", [])
+
+    def data_generation_ids(self, manifest_id: str) -> List[str]:
+        return self.get(manifest_id, {}).get("data_generation_set", [])
 
+    def has_data_generation(self, manifest_id: str, dg_id: str) -> bool:
+        return dg_id in self._data_generation_ids.get(manifest_id, ())
 
+    def manifest_for_data_object(self, do_id: str) -> Optional[str]:
+        return self._manifest_by_data_object.get(do_id)
+
+    def manifest_for_data_generation(self, dg_id: str) -> Optional[str]:
+        return self._manifest_by_data_generation.get(dg_id)
+
+    def manifest_for_data_generation_set(self, dg_ids: List[str]) -> Optional[str]:
+        """ The manifest whose data generations are exactly dg_ids, in any order """
+        return self._manifest_by_data_generation_set.get(tuple(sorted(dg_ids)))
+
+
+def _find_manifests(rec: dict, data_objects_by_id: Dict[str, DataObjectRecord]) -> Tuple[Optional[str], List[str]]:
+    """
+    Look for manifest IDs in the outputs of a data generation record. Returns the manifest
+    of the last output in a manifest, and the manifests of outputs that are in exactly one
+    manifest; outputs in more than one manifest are not processed for now.
+    """
+    current_manifest = None
+    manifest_ids = []
+    for do_id in rec.get("has_output", []):
+        if do_id not in data_objects_by_id:
+            continue
+        in_manifest = data_objects_by_id[do_id].as_dict().get("in_manifest")
+        if not in_manifest:
+            continue
+        current_manifest = in_manifest[0]
+        if len(in_manifest) == 1 and current_manifest not in manifest_ids:
+            manifest_ids.append(current_manifest)
+    return current_manifest, manifest_ids
+
+
+def get_manifest_map(api, manifest_first_dg: Dict[str, str],
+                     data_objects_by_id: Dict[str, DataObjectRecord]) -> ManifestMap:
+    """
+    Resolve the data objects and data generations of the given manifests with two batched
+    aggregations, however many manifests there are. manifest_first_dg maps each manifest ID to
+    the data generation it was found from, which is listed first in its data_generation_set.
+    """
+    manifest_map = ManifestMap()
+    if not manifest_first_dg:
+        return manifest_map
+
+    do_ids_by_manifest = _map_manifests_to_data_objects(api, list(manifest_first_dg))
+    data_object_ids = list(dict.fromkeys(do_id for do_ids in do_ids_by_manifest.values() for do_id in do_ids))
+    dg_ids_by_data_object = _map_data_objects_to_data_generations(api, data_object_ids)
+
+    for manifest_id, first_dg_id in manifest_first_dg.items():
+        data_objects = []
+        for do_id in do_ids_by_manifest.get(manifest_id, []):
+            if do_id not in data_objects_by_id:
+                logging.info(f"WARN: Couldn't add data object to manifest map. Data Object: {do_id}.")
+                raise ValueError("Could not add data object to manifest map")
+            data_objects.append(data_objects_by_id[do_id])
+        if not data_objects:
+            logging.info(f"WARN: No data objects returned for manifest {manifest_id}.")
+
+        data_generation_ids = [first_dg_id]
+        for data_object in data_objects:
+            for dg_id in dg_ids_by_data_object.get(data_object.id, []):
+                if dg_id not in data_generation_ids:
+                    data_generation_ids.append(dg_id)
+        manifest_map.add(manifest_id, data_objects, data_generation_ids)
+
+    return manifest_map
+
+
+def _map_manifests_to_data_objects(api, manifest_ids: List[str]) -> Dict[str, List[str]]:
+    """ Map poolable manifest IDs to the IDs of the data objects in them """
     manifest_agg = {
         "aggregate": "manifest_set",
         "pipeline": [
             {
                 "$match": {
-                    "id": manifest_id,
+                    "id": {"$in": manifest_ids},
                     "manifest_category": "poolable_replicates"
                 }
             },
@@ -467,61 +631,32 @@ def _map_manifest_to_data_objects(api, manifest_id, manifest_to_data_objects: Di
                 "$unwind": "$data_objects"
             },
             {
-                "$replaceWith": "$data_objects"
+                "$project": {"_id": 0, "manifest_id": "$id", "data_object_id": "$data_objects.id"}
             }
         ]
     }
-
-    # 3. Execute the aggregation pipeline and get the results
     logging.debug(f"AGG:{manifest_agg}")
     resp = api.run_query(manifest_agg)
     logging.debug(f"queries:run response: {resp}")
 
-    # If an empty result was return, aggregation did not work
-    if len(resp) == 0:
-        logging.info(f"response did not return OK")
-        logging.info(f"WARN: No data objects returned for manifest {manifest_id}.")
-        return manifest_to_data_objects 
-
-    else:
-        
-        # Initialize the data_object_set key to a before looping
-        if 'data_object_set' not in manifest_to_data_objects:
-                manifest_to_data_objects['data_object_set'] = []
-
-        for data_object in resp:
-            # Add any data object IDs to the manifest map if not already there.
-            logging.debug(data_object['id'])
-
-            if data_object['id'] not in manifest_to_data_objects['data_object_set']:
-                if data_object['id'] in data_objects_by_id:
-                    # Add logging 
-                    # Add the DO itself
-                    manifest_to_data_objects['data_object_set'].append(data_objects_by_id[data_object['id']])
-                    #print(data_object)
-                else:
-                    logging.info(f"WARN: Couldn't add data object to manifest map. Data Object: {data_object['id']}.")
-                    raise ValueError("Could not add data object to manifest map")
-    
-    return manifest_to_data_objects
+    do_ids_by_manifest = {}
+    for row in resp:
+        do_ids = do_ids_by_manifest.setdefault(row["manifest_id"], [])
+        if row["data_object_id"] not in do_ids:
+            do_ids.append(row["data_object_id"])
+    return do_ids_by_manifest
 
 
-def _map_manifest_to_data_generation_set(api, manifest_map):
-    
-    if 'data_object_set' not in manifest_map:
-        logging.debug("No data objects found in the map. Something is awry. Returning without dgns to manifest mapping.")
-        return manifest_map
-    
-    data_object_ids = [data_obj.id for data_obj in manifest_map['data_object_set']]
-
+def _map_data_objects_to_data_generations(api, data_object_ids: List[str]) -> Dict[str, List[str]]:
+    """ Map data object IDs to the IDs of the data generations that have them as outputs """
+    if not data_object_ids:
+        return {}
     data_object_agg = {
         "aggregate": "data_object_set",
         "pipeline": [
             {
                 "$match": {
-                    "id": {
-                    "$in": data_object_ids
-                    }
+                    "id": {"$in": data_object_ids}
                 }
             },
             {
@@ -536,49 +671,98 @@ def _map_manifest_to_data_generation_set(api, manifest_map):
                 "$unwind": "$data_generation_set"
             },
             {
-                "$group": {
-                    "_id": "$data_generation_set._id",
-                    "data_generation_set": {
-                    "$first": "$data_generation_set"
-                    }
-                }
-            },
-            {
-                "$replaceWith": "$data_generation_set"
+                "$project": {"_id": 0, "data_object_id": "$id", "data_generation_id": "$data_generation_set.id"}
             }
         ]
     }
-
     resp = api.run_query(data_object_agg)
     logging.debug(f"queries:run response: {resp}")
-        
-    # Log any issues
-    if len(resp) == 0:
-        logging.info(f"response did not return OK")
-        logging.info(f"WARN: No data generation IDs returned for current manifest.")
-        return manifest_map 
+    if not resp:
+        logging.info(f"WARN: No data generation IDs returned for manifest data objects.")
+
+    dg_ids_by_data_object = {}
+    for row in resp:
+        dg_ids = dg_ids_by_data_object.setdefault(row["data_object_id"], [])
+        if row["data_generation_id"] not in dg_ids:
+            dg_ids.append(row["data_generation_id"])
+    return dg_ids_by_data_object
 
-    else:
-    
-        # Initialize the 'data_generation_set' key to a list if results found
-        if 'data_generation_set' not in manifest_map:
-            manifest_map['data_generation_set'] = []
 
-        for data_gen in resp:
-            # Add any data object IDs to the manifest map if not already there.
-            logging.debug(data_gen['id'])
+class ScheduledJobs(list):
+    """
+    The jobs scheduled in a cycle, indexed by (manifest, workflow name) so the
+    scheduler can tell in O(1) whether a manifest already has a job for a workflow.
+    """
 
-            if data_gen['id'] not in manifest_map['data_generation_set']:
-                # Add logging 
-                manifest_map['data_generation_set'].append(data_gen['id'])
-                #print(data_gen)
+    def __init__(self, jobs=()):
+        super().__init__()
+        self._by_manifest_workflow: Dict[Tuple[str, str], Any] = {}
+        self.extend(jobs)
 
-    return manifest_map
+    def append(self, job) -> None:
+        super().append(job)
+        if job.manifest:
+            self._by_manifest_workflow.setdefault((job.manifest, job.workflow.name), job)
+
+    def extend(self, jobs) -> None:
+        for job in jobs:
+            self.append(job)
+
+    def clear(self) -> None:
+        super().clear()
+        self._by_manifest_workflow.clear()
+
+    def find_manifest_job(self, manifest_id: str, workflow_name: str):
+        """ The first job scheduled for the manifest and workflow, or None """
+        return self._by_manifest_workflow.get((manifest_id, workflow_name))
+
+
+class WorkflowProcessGraph(list):
+    """
+    The resolved workflow process nodes of a cycle, with hash indexes by node ID and
+    by output data object, the sorted was_informed_by key of each node, and the jobs
+    scheduled from the graph in the current cycle.
+    """
+
+    def __init__(self, nodes: List[WorkflowProcessNode] = (),
+                 node_data_object_map: Optional[Dict[str, Optional[WorkflowProcessNode]]] = None):
+        super().__init__(nodes)
+        self._nodes_by_id: Dict[str, WorkflowProcessNode] = {}
+        for node in self:
+            self._nodes_by_id.setdefault(node.id, node)
+        if node_data_object_map is None:
+            node_data_object_map, _ = _map_nodes_to_data_objects(self, {})
+        self._node_by_output = node_data_object_map
+        self._informed_by_keys: Dict[int, Tuple[str, ...]] = {
+            id(node): informed_by_key(node) for node in self
+        }
+        self.jobs = ScheduledJobs()
+
+    def get_node(self, node_id: str) -> Optional[WorkflowProcessNode]:
+        """ The node with the given ID """
+        return self._nodes_by_id.get(node_id)
+
+    def producer(self, data_object_id: str) -> Optional[WorkflowProcessNode]:
+        """ The node that has the data object as an output, None if unknown or ambiguous """
+        return self._node_by_output.get(data_object_id)
+
+    def informed_by_key(self, node: WorkflowProcessNode) -> Tuple[str, ...]:
+        """ The node's sorted was_informed_by IDs """
+        key = self._informed_by_keys.get(id(node))
+        return key if key is not None else informed_by_key(node)
+
+
+def informed_by_key(node: WorkflowProcessNode) -> Tuple[str, ...]:
+    """ The sorted was_informed_by IDs of a node, as a hashable key """
+    return tuple(sorted(node.was_informed_by))
 
 
 #def load_workflow_process_nodes(db, nmdcapi, workflows: list[WorkflowConfig], allowlist: list[str] = None) -> List[WorkflowProcessNode]: #299
 #def load_workflow_process_nodes(db, workflows: list[WorkflowConfig], allowlist: list[str] = None) -> List[WorkflowProcessNode]: #orig
-def load_workflow_process_nodes(nmdcapi, workflows: list[WorkflowConfig], allowlist: list[str] = None) -> List[WorkflowProcessNode]:    
+def load_workflow_process_nodes(nmdcapi, workflows: list[WorkflowConfig], allowlist: list[str] = None,
+                                metrics: Optional[CycleMetrics] = None,
+                                shard: Optional[Callable[[dict], bool]] = None
+                                ) -> Tuple["WorkflowProcessGraph", "ManifestMap"]:
     """
     This reads the activities from Mongo.  It also
     finds the parent and child relationships between
@@ -591,22 +775,301 @@ def load_workflow_process_nodes(nmdcapi, workflows: list[WorkflowConfig], allowl
     Inputs:
     nmdcapi: NmdcRuntimeApi class
     workflow: workflow
+    metrics: optional CycleMetrics to time each step in
+    shard: optional ShardFilter to build the subgraph of one shard of the data generations
     """
 
     # This is map from the data object ID to the activity
     # that created it.
     #data_object_map = get_required_data_objects_map(db, workflows)
-    data_object_map = get_required_data_objects_map(nmdcapi, workflows)
+    with timed(metrics, "load_workflow_process_nodes.get_required_data_objects_map"):
+        data_object_map = get_required_data_objects_map(nmdcapi, workflows)
 
     # Build up a set of relevant activities and a map from
     # the output objects to the activity that generated them.
     #current_nodes = get_current_workflow_process_nodes(db, workflows, data_object_map, allowlist) #orig
     #current_nodes, manifest_map = get_current_workflow_process_nodes(db, nmdcapi, workflows, data_object_map, allowlist) #299
-    current_nodes, manifest_map = get_current_workflow_process_nodes(nmdcapi, workflows, data_object_map, allowlist)
+    with timed(metrics, "load_workflow_process_nodes.get_current_workflow_process_nodes"):
+        current_nodes, manifest_map = get_current_workflow_process_nodes(
+            nmdcapi, workflows, data_object_map, allowlist, metrics=metrics, shard=shard
+        )
 
-    node_data_object_map, current_nodes = _map_nodes_to_data_objects(current_nodes, data_object_map)
+    with timed(metrics, "load_workflow_process_nodes.map_nodes_to_data_objects"):
+        node_data_object_map, current_nodes = _map_nodes_to_data_objects(current_nodes, data_object_map)
 
     # Now populate the parent and children values for the
-    resolved_nodes = _resolve_relationships(current_nodes, node_data_object_map)
-    return resolved_nodes, manifest_map
+    with timed(metrics, "load_workflow_process_nodes.resolve_relationships"):
+        resolved_nodes = _resolve_relationships(current_nodes, node_data_object_map)
+    return WorkflowProcessGraph(resolved_nodes, node_data_object_map), manifest_map
 
+
+
+class IncrementalWorkflowProcessLoader:
+    """
+    Keep the workflow process graph in memory across scheduler cycles.
+
+    The loader stands in for the NmdcRuntimeApi while the graph is being built: every
+    list_from_collection query and aggregation is remembered along with what it returned.
+
+    Each cycle starts with one small aggregation per collection read, giving its record
+    count and largest _id. ObjectIds grow with insertion time, so a collection whose
+    count and largest _id didn't change had no records added or removed, and the
+    queries and aggregations on it are served from memory. For a collection that did
+    change, each remembered query is re-run with an id-only projection, records for IDs
+    we have not seen are fetched with an $in filter, records that disappeared are
+    dropped, and the aggregations reading it are re-run. If nothing changed the previous
+    graph is returned as-is, so an idle cycle costs one small query per collection.
+    The first cycle after a full fetch has no cursors to compare with yet and reconciles
+    every query with id listings.
+
+    NMDC IDs are not issued in sortable order and records carry no reliable update
+    timestamp, so updates to existing records are picked up by a full refresh every
+    `full_refresh_cycles` cycles.
+
+    If `snapshot_path` is set the cached records are written there (gzipped JSON) whenever
+    they change, and read back on startup when the snapshot was taken with the same
+    `snapshot_key` (the workflow YAML hash) and allowlist. A restarted scheduler then only
+    reconciles what changed since the snapshot instead of re-paging every collection.
+    """
+    SNAPSHOT_VERSION = 2
+    ID_PAGE_SIZE = 1000
+    FETCH_CHUNK_SIZE = 100
+
+    def __init__(self, api, workflows: List[WorkflowConfig], full_refresh_cycles: int = 60,
+                 snapshot_path: Optional[str] = None, snapshot_key: Optional[str] = None):
+        self.api = api
+        self.workflows = workflows
+        self.full_refresh_cycles = full_refresh_cycles
+        self.snapshot_path = snapshot_path
+        self.snapshot_key = snapshot_key
+        # query key -> {record id: record}
+        self._records: Dict[Tuple[str, str, Optional[str]], Dict[str, Dict[str, Any]]] = {}
+        self._query_args: Dict[Tuple[str, str, Optional[str]], Tuple[str, Optional[dict], Optional[str], int]] = {}
+        # json-encoded aggregation -> result, as of this cycle
+        self._query_results: Dict[str, List[Dict[str, Any]]] = {}
+        # collection -> change cursor it had before it was last read, None until one is taken
+        self._cursors: Dict[str, Optional[str]] = {}
+        self._cycles = 0
+        self._allowlist = None
+        self._graph = None
+        self._snapshot_checked = False
+        # Set by the scheduler to time the sync and rebuild steps
+        self.metrics: Optional[CycleMetrics] = None
+
+    @staticmethod
+    def _query_key(collection: str, filt: Optional[dict], projection: Optional[str]) -> Tuple[str, str, Optional[str]]:
+        return collection, json.dumps(filt or {}, sort_keys=True), projection
+
+    @staticmethod
+    def _query_collections(query: dict) -> List[str]:
+        """ The collections an aggregation reads: its own and those of its $lookup stages """
+        lookups = [stage["$lookup"]["from"] for stage in query.get("pipeline", []) if "$lookup" in stage]
+        return [query["aggregate"], *lookups]
+
+    def _collections(self) -> List[str]:
+        """ The collections read by the remembered queries and aggregations """
+        collections = [collection for collection, _, _ in self._records]
+        for key in self._query_results:
+            collections.extend(self._query_collections(json.loads(key)))
+        return list(dict.fromkeys(collections))
+
+    def _cursor(self, collection: str) -> str:
+        """ The count and largest _id of a collection, which change when records are added or removed """
+        result = self.api.run_query({
+            "aggregate": collection,
+            "pipeline": [{"$group": {"_id": None, "count": {"$sum": 1}, "last": {"$max": "$_id"}}}],
+        })
+        return json.dumps(result, sort_keys=True, default=str)
+
+    def reset(self) -> None:
+        """
+        Forget all cached records so the next load does a full crawl. The change
+        cursors are kept, so the crawl can be checked against them on the next cycle.
+        """
+        self._records.clear()
+        self._query_args.clear()
+        self._query_results.clear()
+        self._graph = None
+
+    def list_from_collection(self, collection, filt=None, projection=None, max=100) -> List[Dict[str, Any]]:
+        """
+        Serve a collection query from the in-memory records, doing a full fetch
+        the first time a query is seen.
+        """
+        key = self._query_key(collection, filt, projection)
+        if key not in self._records:
+            records = self.api.list_from_collection(collection, filt, projection, max=max)
+            self._records[key] = {rec["id"]: rec for rec in records}
+            self._query_args[key] = (collection, filt, projection, max)
+        return list(self._records[key].values())
+
+    def run_query(self, query):
+        """ Serve an aggregation from the results fetched this cycle """
+        key = json.dumps(query, sort_keys=True)
+        if key not in self._query_results:
+            self._query_results[key] = self.api.run_query(query)
+        return self._query_results[key]
+
+    def save_snapshot(self) -> None:
+        """ Write the cached records to `snapshot_path`, replacing any previous snapshot """
+        if not self.snapshot_path:
+            return
+        snapshot = {
+            "version": self.SNAPSHOT_VERSION,
+            "key": self.snapshot_key,
+            "allowlist": sorted(self._allowlist) if self._allowlist is not None else None,
+            "queries": [
+                {
+                    "collection": collection,
+                    "filter": filt,
+                    "projection": projection,
+                    "max": max_page,
+                    "records": list(self._records[key].values()),
+                }
+                for key, (collection, filt, projection, max_page) in self._query_args.items()
+            ],
+            "query_results": self._query_results,
+            "cursors": self._cursors,
+        }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with gzip.open(tmp_path, "wt") as f:
+            json.dump(snapshot, f, default=str)
+        os.replace(tmp_path, self.snapshot_path)
+        logger.debug(f"Saved workflow process snapshot to {self.snapshot_path}")
+
+    def load_snapshot(self, allowlist: List[str] = None) -> bool:
+        """
+        Restore the cached records from `snapshot_path`. Returns False, leaving the
+        loader empty, if there is no usable snapshot for this workflow config and allowlist.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with gzip.open(self.snapshot_path, "rt") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.snapshot_path}: {e}")
+            return False
+        allowlist_key = sorted(allowlist) if allowlist else None
+        if (snapshot.get("version") != self.SNAPSHOT_VERSION or snapshot.get("key") != self.snapshot_key
+                or snapshot.get("allowlist") != allowlist_key):
+            logger.info(f"Snapshot {self.snapshot_path} does not match the current workflows or allowlist")
+            return False
+
+        self.reset()
+        for query in snapshot["queries"]:
+            key = self._query_key(query["collection"], query["filter"], query["projection"])
+            self._query_args[key] = (query["collection"], query["filter"], query["projection"], query["max"])
+            self._records[key] = {rec["id"]: rec for rec in query["records"]}
+        self._query_results = snapshot["query_results"]
+        self._cursors = snapshot["cursors"]
+        self._allowlist = frozenset(allowlist) if allowlist else None
+        # count the snapshot as a loaded cycle so the next load reconciles instead of refreshing
+        self._cycles = 1
+        logger.info(f"Loaded {sum(len(r) for r in self._records.values())} records from snapshot {self.snapshot_path}")
+        return True
+
+    def _sync_query(self, key) -> bool:
+        """
+        Bring one remembered query up to date. Returns True if any record was added or removed.
+        """
+        collection, filt, projection, max_page = self._query_args[key]
+        cached = self._records[key]
+        current_ids = [
+            rec["id"] for rec in self.api.list_from_collection(collection, filt, "id", max=self.ID_PAGE_SIZE)
+        ]
+        current_id_set = set(current_ids)
+        removed_ids = [rid for rid in cached if rid not in current_id_set]
+        new_ids = [rid for rid in current_ids if rid not in cached]
+        for rid in removed_ids:
+            del cached[rid]
+        for i in range(0, len(new_ids), self.FETCH_CHUNK_SIZE):
+            id_filter = {"id": {"$in": new_ids[i:i + self.FETCH_CHUNK_SIZE]}}
+            q = {"$and": [filt, id_filter]} if filt else id_filter
+            for rec in self.api.list_from_collection(collection, q, projection, max=max_page):
+                cached[rec["id"]] = rec
+        if new_ids or removed_ids:
+            logger.info(f"{collection}: {len(new_ids)} new and {len(removed_ids)} removed records since last cycle")
+            return True
+        return False
+
+    def _sync_query_results(self, changed_collections: Set[str]) -> bool:
+        """
+        Re-run the aggregations of the last cycle that read a changed collection.
+        Returns True if any result changed.
+        """
+        changed = False
+        for key, result in self._query_results.items():
+            if changed_collections.isdisjoint(self._query_collections(json.loads(key))):
+                continue
+            self._query_results[key] = self.api.run_query(json.loads(key))
+            if self._query_results[key] != result:
+                logger.info(f"{json.loads(key).get('aggregate')}: aggregation result changed since last cycle")
+                changed = True
+        return changed
+
+    def sync(self, allowlist: List[str] = None) -> bool:
+        """
+        Bring the cached records up to date without building the graph, fetching them
+        in full when nothing is cached. Only the collections whose change cursor moved
+        since the last cycle are re-listed. Returns True if any record was added or
+        removed, or an aggregation result changed.
+        """
+        if not self._snapshot_checked:
+            self._snapshot_checked = True
+            self.load_snapshot(allowlist)
+
+        allowlist_key = frozenset(allowlist) if allowlist else None
+        if allowlist_key != self._allowlist or self._cycles % self.full_refresh_cycles == 0:
+            logger.info("Loading workflow process graph with a full refresh")
+            self.reset()
+            self._allowlist = allowlist_key
+        self._cycles += 1
+
+        # take the cursors before reading, so that changes made while we read move them
+        with timed(self.metrics, "load_workflow_process_nodes.cursors"):
+            cursors = {collection: self._cursor(collection) for collection in self._cursors}
+        changed_collections = {
+            collection for collection, cursor in cursors.items()
+            if self._cursors[collection] is None or cursor != self._cursors[collection]
+        }
+
+        if not self._records:
+            with timed(self.metrics, "load_workflow_process_nodes.fetch"):
+                fetch_workflow_process_records(self, self.workflows, allowlist)
+            changed = True
+        else:
+            changed = False
+            with timed(self.metrics, "load_workflow_process_nodes.sync"):
+                for key in list(self._records):
+                    if key[0] in changed_collections and self._sync_query(key):
+                        changed = True
+                if changed:
+                    # the aggregations depend on the records, so they are re-run as the graph is rebuilt
+                    self._query_results.clear()
+                elif self._sync_query_results(changed_collections):
+                    changed = True
+
+        # collections read for the first time get their cursor on the next cycle
+        self._cursors = {collection: cursors.get(collection) for collection in [*cursors, *self._collections()]}
+        if changed_collections:
+            logger.debug(f"Changed since last cycle: {', '.join(sorted(changed_collections))}")
+        return changed
+
+    def load(self, allowlist: List[str] = None) -> Tuple["WorkflowProcessGraph", "ManifestMap"]:
+        """
+        Return the resolved workflow process nodes and manifest map, only rebuilding
+        the graph when the underlying records changed since the last call.
+        """
+        cursors = dict(self._cursors)
+        changed = self.sync(allowlist) or self._graph is None
+        if changed:
+            self._graph = load_workflow_process_nodes(self, self.workflows, allowlist, metrics=self.metrics)
+            # collections first read while building the graph get their cursor on the next cycle
+            self._cursors.update((collection, None) for collection in self._collections()
+                                 if collection not in self._cursors)
+        else:
+            logger.debug("No changes found, reusing workflow process graph from the last cycle")
+        if changed or cursors != self._cursors:
+            self.save_snapshot()
+        return self._graph
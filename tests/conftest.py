@@ -4,6 +4,7 @@ import json
 import os
 from pymongo import MongoClient
 from pathlib import Path
+import pytest
 from pytest import fixture
 import requests
 import requests_mock
@@ -31,6 +32,21 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmark", action="store_true", default=False,
+                     help="Run the scheduler benchmarks marked benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    """ Benchmarks on large synthetic studies take minutes and GBs of memory: only run them when asked """
+    if config.getoption("--run-benchmark"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="scheduler benchmark: use --run-benchmark to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @fixture(scope="session")
 def mock_job_state():
     state = db_utils.read_json(
@@ -284,6 +300,15 @@ def configured_api_mock(session_monkeypatch, test_db, test_data_dir):
 
     mock_api.get_op.side_effect = mock_get_op_side_effect
 
+    def mock_list_ops_side_effect(filt=None, max_page_size=40):
+        """
+        Lists operations from the operations collection matching the filter.
+        """
+        return list(test_db.operations.find(filt or {}))
+
+    mock_api.list_ops = MagicMock()
+    mock_api.list_ops.side_effect = mock_list_ops_side_effect
+
     def mock_update_operation_side_effect(op_id, done=None, meta=None):
         """
         Updates the operation in the test_db to reflect the new state.
@@ -307,6 +332,9 @@ def configured_api_mock(session_monkeypatch, test_db, test_data_dir):
     mock_api.update_operation.side_effect = mock_update_operation_side_effect
 
     mock_api._base_url = "http://localhost:8000/" 
+    # real methods bound to the mock send their requests through these
+    mock_api.session = requests.Session()
+    mock_api.timeout = (10, 300)
     mock_api.header = {
         'Authorization': 'Bearer abcd', 
         'Content-Type': 'application/json' 
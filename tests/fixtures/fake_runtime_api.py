@@ -0,0 +1,350 @@
+"""
+An in-memory stand-in for the NMDC runtime API, served through a requests transport
+adapter so a real NmdcRuntimeApi (and its session, retries and ApiStats) can be used
+offline. Only the endpoints and query operators the scheduler uses are implemented;
+anything else fails loudly rather than returning wrong results.
+"""
+import json
+import threading
+from datetime import timedelta
+from itertools import count
+from time import monotonic, sleep
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+from nmdc_automation.api.nmdcapi import NmdcRuntimeApi
+
+_MISSING = object()
+
+
+def _get_path(doc: Dict[str, Any], path: str):
+    """ The value at a dotted path, or _MISSING """
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _values(value) -> list:
+    """ The values a field matches on: the elements of an array, else the value itself """
+    if value is _MISSING:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _match_condition(value, cond) -> bool:
+    if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+        for op, arg in cond.items():
+            if op == "$in":
+                if not any(v in arg for v in _values(value)):
+                    return False
+            elif op == "$nin":
+                if any(v in arg for v in _values(value)):
+                    return False
+            elif op == "$ne":
+                if arg in _values(value):
+                    return False
+            elif op == "$exists":
+                if (value is not _MISSING) != bool(arg):
+                    return False
+            else:
+                raise NotImplementedError(f"Query operator {op} is not supported")
+        return True
+    return value == cond or cond in _values(value)
+
+
+def matches(doc: Dict[str, Any], filt: Optional[Dict[str, Any]]) -> bool:
+    """ Whether a document matches a MongoDB-style filter """
+    for key, cond in (filt or {}).items():
+        if key == "$and":
+            if not all(matches(doc, f) for f in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, f) for f in cond):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"Query operator {key} is not supported")
+        elif not _match_condition(_get_path(doc, key), cond):
+            return False
+    return True
+
+
+class InMemoryCollection:
+    """
+    Documents in insertion order, with equality / $in lookups served from
+    per-field indexes that are built on first use and kept up to date on insert.
+    """
+
+    def __init__(self, docs: Iterable[Dict[str, Any]] = ()):
+        self.docs: List[Dict[str, Any]] = []
+        self._indexes: Dict[str, Dict[Any, List[int]]] = {}
+        self.insert_many(docs)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _index(self, field: str) -> Dict[Any, List[int]]:
+        if field not in self._indexes:
+            index = {}
+            for pos, doc in enumerate(self.docs):
+                for value in _values(_get_path(doc, field)):
+                    index.setdefault(_hashable(value), []).append(pos)
+            self._indexes[field] = index
+        return self._indexes[field]
+
+    def insert_many(self, docs: Iterable[Dict[str, Any]]) -> None:
+        for doc in docs:
+            pos = len(self.docs)
+            self.docs.append(doc)
+            for field, index in self._indexes.items():
+                for value in _values(_get_path(doc, field)):
+                    index.setdefault(_hashable(value), []).append(pos)
+
+    def _candidates(self, filt: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+        """ Narrow the scan with an index on the first equality or $in condition """
+        for key, cond in filt.items():
+            if key.startswith("$"):
+                continue
+            if isinstance(cond, dict) and set(cond) == {"$in"}:
+                targets = cond["$in"]
+            elif not isinstance(cond, (dict, list)):
+                targets = [cond]
+            else:
+                continue
+            index = self._index(key)
+            positions = sorted({pos for t in targets for pos in index.get(_hashable(t), [])})
+            return [self.docs[pos] for pos in positions]
+        return self.docs
+
+    def find(self, filt: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        filt = filt or {}
+        return [doc for doc in self._candidates(filt) if matches(doc, filt)]
+
+    def lookup(self, field: str, value) -> List[Dict[str, Any]]:
+        """ Documents whose `field` matches any of the given value(s), as $lookup does """
+        index = self._index(field)
+        positions = sorted({pos for v in _values(value) for pos in index.get(_hashable(v), [])})
+        return [self.docs[pos] for pos in positions]
+
+
+def _hashable(value):
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+
+
+def _project_fields(doc: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if not fields:
+        return dict(doc)
+    return {f: doc[f] for f in fields if f in doc}
+
+
+def _project_stage(doc: Dict[str, Any], spec: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for key, expr in spec.items():
+        if key == "_id":
+            continue
+        if isinstance(expr, str) and expr.startswith("$"):
+            value = _get_path(doc, expr[1:])
+        elif expr in (1, True):
+            value = _get_path(doc, key)
+        else:
+            raise NotImplementedError(f"$project expression {expr!r} is not supported")
+        if value is not _MISSING:
+            out[key] = value
+    return out
+
+
+def _group_stage(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> Dict[str, Any]:
+    """ A $group of all the documents (_id: None) with $sum and $max accumulators """
+    if spec["_id"] is not None:
+        raise NotImplementedError(f"$group _id {spec['_id']!r} is not supported")
+    out = {"_id": None}
+    for key, accumulator in spec.items():
+        if key == "_id":
+            continue
+        (op, expr), = accumulator.items()
+        if isinstance(expr, str) and expr.startswith("$"):
+            values = [v for v in (_get_path(d, expr[1:]) for d in docs) if v is not _MISSING]
+        else:
+            values = [expr] * len(docs)
+        if op == "$sum":
+            out[key] = sum(values)
+        elif op == "$max":
+            out[key] = max(values, default=None)
+        else:
+            raise NotImplementedError(f"$group accumulator {op} is not supported")
+    return out
+
+
+class InMemoryRuntimeStore:
+    """ The collections served by the fake runtime API """
+
+    def __init__(self, collections: Optional[Dict[str, Iterable[Dict[str, Any]]]] = None):
+        self.collections: Dict[str, InMemoryCollection] = {}
+        for name, docs in (collections or {}).items():
+            self.collections[name] = InMemoryCollection(docs)
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = InMemoryCollection()
+        return self.collections[name]
+
+    def aggregate(self, collection: str, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        docs = None
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = self[collection].find(spec) if docs is None else [d for d in docs if matches(d, spec)]
+                continue
+            if docs is None:
+                docs = list(self[collection].docs)
+            if op == "$lookup":
+                foreign = self[spec["from"]]
+                docs = [
+                    dict(d, **{spec["as"]: foreign.lookup(spec["foreignField"], _get_path(d, spec["localField"]))})
+                    for d in docs
+                ]
+            elif op == "$unwind":
+                path = spec if isinstance(spec, str) else spec["path"]
+                field = path.lstrip("$")
+                docs = [dict(d, **{field: v}) for d in docs for v in _values(_get_path(d, field))]
+            elif op == "$project":
+                docs = [_project_stage(d, spec) for d in docs]
+            elif op == "$limit":
+                docs = docs[:spec]
+            elif op == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            elif op == "$group":
+                docs = [_group_stage(docs, spec)] if docs else []
+            else:
+                raise NotImplementedError(f"Aggregation stage {op} is not supported")
+        return docs if docs is not None else list(self[collection].docs)
+
+
+class FakeRuntimeApiAdapter(BaseAdapter):
+    """
+    A requests transport adapter that answers runtime API requests from an
+    InMemoryRuntimeStore. Responses are JSON-encoded like the real API, list
+    endpoints are paged with server-side cursors and `latency` seconds are added
+    to every request to stand in for the network round trip. HEAD requests to
+    any other host succeed, so data object URLs resolve offline.
+    """
+
+    def __init__(self, store: InMemoryRuntimeStore, base_url: str, latency: float = 0.0,
+                 query_batch_size: int = 1000):
+        super().__init__()
+        self.store = store
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.latency = latency
+        self.query_batch_size = query_batch_size
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._cursors: Dict[str, List[Dict[str, Any]]] = {}
+        self._ids = count(1)
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+        start = monotonic()
+        if self.latency:
+            sleep(self.latency)
+        split = urlsplit(request.url)
+        params = {k: v[0] for k, v in parse_qs(split.query).items()}
+        try:
+            body = json.loads(request.body) if request.body else None
+        except ValueError:
+            # the token request is form-encoded
+            body = None
+        if request.url.startswith(self.base_url):
+            path = request.url[len(self.base_url):].split("?")[0]
+        else:
+            path = None
+        key = f"{request.method} {path.split('/')[0] if path is not None else split.netloc}"
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if path is None:
+                status, payload = (200, {}) if request.method == "HEAD" else (404, {"detail": "Not Found"})
+            else:
+                status, payload = self._route(request.method, path, params, body)
+        return self._response(request, status, payload, start)
+
+    @staticmethod
+    def _response(request, status: int, payload, start: float) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response.reason = "OK" if status < 400 else "Error"
+        response._content = json.dumps(payload).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=monotonic() - start)
+        return response
+
+    def _page(self, results: List[Dict[str, Any]], params: Dict[str, str]) -> Dict[str, Any]:
+        page_size = int(params.get("max_page_size", 20))
+        token = params.get("page_token")
+        if token:
+            results = self._cursors.pop(token)
+        page, rest = results[:page_size], results[page_size:]
+        next_token = None
+        if rest:
+            next_token = f"page-{next(self._ids)}"
+            self._cursors[next_token] = rest
+        return {"resources": page, "next_page_token": next_token}
+
+    def _route(self, method: str, path: str, params: Dict[str, str], body):
+        parts = path.split("/")
+        if method == "POST" and path == "token":
+            return 200, {"access_token": "fake-token", "token_type": "bearer", "expires": {"days": 1}}
+        if method == "GET" and parts[0] == "nmdcschema" and len(parts) == 2:
+            results = []
+            if "page_token" not in params:
+                fields = params["projection"].split(",") if params.get("projection") else None
+                docs = self.store[parts[1]].find(json.loads(params["filter"]) if "filter" in params else None)
+                results = [_project_fields(d, fields) for d in docs]
+            return 200, self._page(results, params)
+        if method == "POST" and path == "queries:run":
+            if "getMore" in body:
+                batch = self._cursors.pop(body["getMore"])
+            else:
+                batch = self.store.aggregate(body["aggregate"], body.get("pipeline", []))
+            batch, rest = batch[:self.query_batch_size], batch[self.query_batch_size:]
+            cursor_id = None
+            if rest:
+                cursor_id = f"cursor-{next(self._ids)}"
+                self._cursors[cursor_id] = rest
+            return 200, {"ok": 1, "cursor": {"id": cursor_id, "batch": batch}}
+        if parts[0] in ("jobs", "operations"):
+            collection = self.store[parts[0]]
+            if method == "GET" and len(parts) == 1:
+                results = []
+                if "page_token" not in params:
+                    results = collection.find(json.loads(params["filter"]) if "filter" in params else None)
+                return 200, self._page(results, params)
+            if method == "GET" and len(parts) == 2:
+                docs = collection.lookup("id", parts[1])
+                return (200, docs[0]) if docs else (404, {"detail": "Not Found"})
+            if method == "POST" and path == "jobs":
+                job = dict(body, id=f"nmdc:fake-job-{next(self._ids)}", claims=body.get("claims") or [])
+                collection.insert_many([job])
+                return 200, job
+        if method == "POST" and path == "pids/mint":
+            typecode = body["schema_class"]["id"].split(":")[-1].lower()
+            return 200, [f"nmdc:{typecode}-99-{next(self._ids):08d}" for _ in range(body.get("how_many", 1))]
+        raise NotImplementedError(f"{method} {path} is not supported by the fake runtime API")
+
+
+def fake_runtime_api(site_config, store: InMemoryRuntimeStore, latency: float = 0.0) -> NmdcRuntimeApi:
+    """ A NmdcRuntimeApi whose requests are answered from `store` """
+    api = NmdcRuntimeApi(site_config)
+    adapter = FakeRuntimeApiAdapter(store, api._base_url, latency=latency)
+    for prefix in list(api.session.adapters):
+        api.session.adapters[prefix] = adapter
+    api.fake_adapter = adapter
+    return api
@@ -0,0 +1,150 @@
+"""
+Offline benchmark of Scheduler.cycle against synthetic studies served by the fake
+runtime API. Each run reports the cold (first) and steady-state cycle times, the
+peak memory of a traced steady-state cycle, and the runtime API calls per endpoint.
+
+    python -m tests.fixtures.scheduler_benchmark --sizes 1000 10000 --output results.json
+    python -m tests.fixtures.scheduler_benchmark --sizes 1000 --baseline results.json
+
+With --baseline, the run fails if HTTP calls or jobs differ from the baseline, or a
+cycle is more than --tolerance slower. HTTP calls are deterministic for a given seed,
+so any change in them is a change in the scheduler's query pattern.
+"""
+import argparse
+import json
+import logging
+import resource
+import sys
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from nmdc_automation.workflow_automation.sched import Scheduler, ShardedScheduler
+from nmdc_automation.workflow_automation.workflows import load_workflow_configs
+from tests.fixtures.fake_runtime_api import InMemoryRuntimeStore, fake_runtime_api
+from tests.fixtures.synthetic_studies import generate_studies
+
+TESTS_DIR = Path(__file__).parent.parent
+WORKFLOWS_YAML = TESTS_DIR.parent / "nmdc_automation/config/workflows/workflows.yaml"
+SITE_CONFIG = TESTS_DIR / "site_configuration_test.toml"
+
+
+def run_benchmark(n_data_generations: int, workflow_yaml: Path = WORKFLOWS_YAML,
+                  site_config: Path = SITE_CONFIG, seed: int = 0, latency: float = 0.0,
+                  incremental: bool = False, trace_memory: bool = True, shards: Optional[int] = None,
+                  **study_kwargs) -> Dict[str, Any]:
+    """
+    Run a cold and a steady-state scheduler cycle over synthetic studies, with a
+    ShardedScheduler in `shards` worker processes if given
+    """
+    collections = generate_studies(load_workflow_configs(workflow_yaml), n_data_generations,
+                                   seed=seed, **study_kwargs)
+    store = InMemoryRuntimeStore(collections)
+    api = fake_runtime_api(site_config, store, latency=latency)
+    if shards:
+        sched = ShardedScheduler(workflow_yaml, api=api, incremental=incremental, shards=shards)
+    else:
+        sched = Scheduler(workflow_yaml, api=api, incremental=incremental)
+    # data object URLs are resolved against the fake API too
+    for prefix in list(sched.url_resolver.session.adapters):
+        sched.url_resolver.session.adapters[prefix] = api.fake_adapter
+
+    result: Dict[str, Any] = {
+        "n_data_generations": n_data_generations,
+        "seed": seed,
+        "latency": latency,
+        "incremental": incremental,
+        "shards": shards,
+        "records": {name: len(docs) for name, docs in collections.items()},
+    }
+    for name in ("cold", "steady"):
+        requests_before = dict(api.fake_adapter.requests)
+        start = perf_counter()
+        jobs = sched.cycle()
+        seconds = perf_counter() - start
+        result[name] = {
+            "seconds": round(seconds, 3),
+            "jobs": len(jobs),
+            "http_calls": {
+                key: calls - requests_before.get(key, 0)
+                for key, calls in sorted(api.fake_adapter.requests.items())
+                if calls - requests_before.get(key, 0)
+            },
+            "phases": sched.metrics.last_cycle["phases"],
+        }
+
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            sched.cycle()
+            result["steady"]["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        finally:
+            tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["max_rss_mb"] = round(max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+    return result
+
+
+def compare_to_baseline(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+                        tolerance: float = 0.25) -> List[str]:
+    """ Regressions of `results` against the baseline results for the same sizes """
+    baseline_by_size = {b["n_data_generations"]: b for b in baseline}
+    regressions = []
+    for result in results:
+        base = baseline_by_size.get(result["n_data_generations"])
+        if not base:
+            continue
+        size = result["n_data_generations"]
+        for name in ("cold", "steady"):
+            if result[name]["jobs"] != base[name]["jobs"]:
+                regressions.append(f"{size} {name}: {result[name]['jobs']} jobs, baseline {base[name]['jobs']}")
+            if result[name]["http_calls"] != base[name]["http_calls"]:
+                regressions.append(
+                    f"{size} {name}: HTTP calls {result[name]['http_calls']}, baseline {base[name]['http_calls']}"
+                )
+            if result[name]["seconds"] > base[name]["seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{size} {name}: {result[name]['seconds']}s, baseline {base[name]['seconds']}s"
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Number of data generations per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API request")
+    parser.add_argument("--incremental", action="store_true", help="Use the incremental graph loader")
+    parser.add_argument("--shards", type=int, help="Schedule in this many worker processes")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare against results from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed cycle time increase")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(args.log_level)
+
+    results = []
+    for size in args.sizes:
+        result = run_benchmark(size, seed=args.seed, latency=args.latency, incremental=args.incremental,
+                               trace_memory=args.trace_memory, shards=args.shards)
+        results.append(result)
+        print(f"{size:>7} data generations: cold {result['cold']['seconds']}s "
+              f"({result['cold']['jobs']} jobs, {sum(result['cold']['http_calls'].values())} calls), "
+              f"steady {result['steady']['seconds']}s ({sum(result['steady']['http_calls'].values())} calls), "
+              f"peak {result['steady'].get('peak_memory_mb')} MB, max RSS {result['max_rss_mb']} MB")
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        regressions = compare_to_baseline(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Generate synthetic NMDC studies for scheduler benchmarks: data generations with
+their raw data objects, workflow execution chains (ReadsQC -> Assembly /
+Readbased -> Annotation -> MAGs) and the matching job and operation records,
+plus pooled-replicate manifests. The chains follow the loaded workflow configs,
+so the records always line up with what the scheduler expects.
+"""
+import hashlib
+import random
+from itertools import count
+from typing import Any, Dict, List, Optional
+
+from nmdc_automation.models.workflow import WorkflowConfig
+
+DATA_URL_ROOT = "https://data.microbiomedata.org/data"
+
+# How far each unit's chain got: 0 = sequencing only, 1 = Reads QC, ... 4 = complete.
+# Most units are complete and only need to be checked, the rest need new jobs.
+DEFAULT_DEPTH_WEIGHTS = {0: 0.02, 1: 0.02, 2: 0.02, 3: 0.02, 4: 0.92}
+
+_TYPECODES = {
+    "nmdc:ReadQcAnalysis": "wfrqc",
+    "nmdc:MetagenomeAssembly": "wfmgas",
+    "nmdc:MetagenomeAnnotation": "wfmgan",
+    "nmdc:MagsAnalysis": "wfmag",
+    "nmdc:ReadBasedTaxonomyAnalysis": "wfrbt",
+    "nmdc:MetatranscriptomeAssembly": "wfmtas",
+    "nmdc:MetatranscriptomeAnnotation": "wfmtan",
+    "nmdc:MetatranscriptomeExpressionAnalysis": "wfmtex",
+}
+
+
+class SyntheticStudyGenerator:
+    """
+    Build the collections for `n_data_generations` data generations. Data generations
+    are grouped into studies of `study_size`; a `pooled_fraction` of them are pooled in
+    manifests of `pool_size` replicates that share one workflow chain.
+
+    With `store_unused_data_objects` off, only the data objects of types some workflow
+    takes as input are stored; the others are only referenced from has_output. The
+    scheduler never reads them, and leaving them out keeps 100k studies in memory.
+    """
+
+    def __init__(self, workflows: List[WorkflowConfig], study_size: int = 100, pool_size: int = 3,
+                 pooled_fraction: float = 0.1, depth_weights: Optional[Dict[int, float]] = None,
+                 seed: int = 0, store_unused_data_objects: bool = False):
+        self.workflows = [wf for wf in workflows if wf.enabled]
+        self.store_unused_data_objects = store_unused_data_objects
+        self.used_data_object_types = {t for wf in self.workflows for t in wf.input_data_object_types}
+        self.study_size = study_size
+        self.pool_size = pool_size
+        self.pooled_fraction = pooled_fraction
+        self.depth_weights = depth_weights or DEFAULT_DEPTH_WEIGHTS
+        self.random = random.Random(seed)
+        self._ids = count(1)
+        self.collections: Dict[str, List[Dict[str, Any]]] = {
+            "data_generation_set": [], "data_object_set": [], "workflow_execution_set": [],
+            "manifest_set": [], "jobs": [], "operations": [],
+        }
+
+    def _id(self, prefix: str) -> str:
+        return f"nmdc:{prefix}-11-{next(self._ids):08d}"
+
+    def _sequencing_workflow(self, interleaved: bool) -> WorkflowConfig:
+        for wf in self.workflows:
+            if wf.collection == "data_generation_set" and (len(wf.filter_output_objects) == 1) == interleaved:
+                return wf
+        raise ValueError("No sequencing workflow found")
+
+    def _data_objects(self, data_object_types: List[str], generated_by: Optional[str] = None,
+                      manifest: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        data_objects = {}
+        for data_object_type in data_object_types:
+            do_id = self._id("dobj")
+            if generated_by and not self.store_unused_data_objects \
+                    and data_object_type not in self.used_data_object_types:
+                data_objects[data_object_type] = {"id": do_id}
+                continue
+            name = f"{do_id.split(':')[1]}_{data_object_type.replace(' ', '_')}.gz"
+            rec = {
+                "id": do_id,
+                "type": "nmdc:DataObject",
+                "name": name,
+                "description": f"{data_object_type} for {generated_by or do_id}",
+                "data_object_type": data_object_type,
+                "data_category": "processed_data" if generated_by else "instrument_data",
+                "url": f"{DATA_URL_ROOT}/{do_id.split(':')[1]}/{name}",
+                "md5_checksum": hashlib.md5(do_id.encode()).hexdigest(),
+                "file_size_bytes": 1024 + len(self.collections["data_object_set"]),
+            }
+            if generated_by:
+                rec["was_generated_by"] = generated_by
+            if manifest:
+                rec["in_manifest"] = [manifest]
+            self.collections["data_object_set"].append(rec)
+            data_objects[data_object_type] = rec
+        return data_objects
+
+    def _data_generation(self, wf: WorkflowConfig, manifest: Optional[str]) -> Dict[str, Any]:
+        n = len(self.collections["data_generation_set"])
+        dg_id = self._id("dgns")
+        outputs = self._data_objects(wf.filter_output_objects, manifest=manifest)
+        rec = {
+            "id": dg_id,
+            "type": wf.type,
+            "name": f"Synthetic sequencing {dg_id}",
+            "analyte_category": wf.analyte_category.lower(),
+            "associated_studies": [f"nmdc:sty-11-{n // self.study_size:08d}"],
+            "has_input": [f"nmdc:bsm-11-{n:08d}"],
+            "has_output": [do["id"] for do in outputs.values()],
+            "processing_institution": "JGI",
+        }
+        self.collections["data_generation_set"].append(rec)
+        return {"record": rec, "data_objects": outputs, "workflow": wf}
+
+    def _workflow_execution(self, wf: WorkflowConfig, parents: List[Dict[str, Any]],
+                            available: Dict[str, List[Dict[str, Any]]], informed_by: List[str],
+                            manifest: Optional[str]) -> Dict[str, Any]:
+        root_id = self._id(_TYPECODES.get(wf.type, "wf"))
+        wfe_id = f"{root_id}.1"
+        has_input = [do["id"] for t in wf.input_data_object_types for do in available.get(t, [])]
+        outputs = self._data_objects([o["data_object_type"] for o in wf.outputs], generated_by=wfe_id)
+        rec = {
+            "id": wfe_id,
+            "type": wf.type,
+            "name": f"{wf.name} for {informed_by[0]}",
+            "git_url": wf.git_repo,
+            "version": wf.version,
+            "has_input": has_input,
+            "has_output": [do["id"] for do in outputs.values()],
+            "was_informed_by": informed_by,
+            "started_at_time": "2025-01-01T00:00:00+00:00",
+            "ended_at_time": "2025-01-01T01:00:00+00:00",
+            "execution_resource": "NERSC-Perlmutter",
+            "processing_institution": "NMDC",
+        }
+        self.collections["workflow_execution_set"].append(rec)
+
+        op_id = f"nmdc:sys0{next(self._ids):08d}"
+        job_id = f"nmdc:sys0{next(self._ids):08d}"
+        config = {
+            "git_repo": wf.git_repo,
+            "release": wf.version,
+            "wdl": wf.wdl,
+            "activity_id": wfe_id,
+            "activity_set": wf.collection,
+            "was_informed_by": informed_by,
+            "trigger_activity": parents[0]["record"]["id"],
+        }
+        if manifest and parents[0]["workflow"].collection == "data_generation_set":
+            config["manifest"] = manifest
+        self.collections["jobs"].append({
+            "id": job_id,
+            "workflow": {"id": f"{wf.name}: {wf.version}"},
+            "config": config,
+            "claims": [{"op_id": op_id, "site_id": "NERSC"}],
+            "created_at": "2025-01-01T00:00:00+00:00",
+        })
+        self.collections["operations"].append({
+            "id": op_id, "done": True, "metadata": {"job": {"id": job_id}, "site_id": "NERSC"},
+        })
+        return {"record": rec, "data_objects": outputs, "workflow": wf}
+
+    def _unit(self, n_data_generations: int, depth: int) -> None:
+        """ One or more (pooled) data generations and their workflow chain down to `depth` """
+        manifest = None
+        if n_data_generations > 1:
+            manifest = self._id("manif")
+            self.collections["manifest_set"].append(
+                {"id": manifest, "type": "nmdc:Manifest", "manifest_category": "poolable_replicates"}
+            )
+        interleaved = manifest is None and self.random.random() < 0.5
+        seq_wf = self._sequencing_workflow(interleaved)
+        dgs = [self._data_generation(seq_wf, manifest) for _ in range(n_data_generations)]
+        informed_by = [dg["record"]["id"] for dg in dgs]
+
+        # Walk down the workflow tree one level at a time
+        available: Dict[str, List[Dict[str, Any]]] = {}
+        for dg in dgs:
+            for data_object_type, do in dg["data_objects"].items():
+                available.setdefault(data_object_type, []).append(do)
+        level = [(seq_wf, dgs)]
+        for _ in range(depth):
+            next_level = []
+            for parent_wf, parents in level:
+                for wf in sorted(parent_wf.children, key=lambda w: w.name):
+                    if not wf.enabled or parent_wf.name not in wf.predecessors:
+                        continue
+                    node = self._workflow_execution(wf, parents, available, informed_by, manifest)
+                    # downstream workflows take the most recent data object of each type
+                    for data_object_type, do in node["data_objects"].items():
+                        available[data_object_type] = [do]
+                    next_level.append((wf, [node]))
+            level = next_level
+
+    def generate(self, n_data_generations: int) -> Dict[str, List[Dict[str, Any]]]:
+        depths, weights = zip(*sorted(self.depth_weights.items()))
+        remaining = n_data_generations
+        while remaining > 0:
+            size = 1
+            if remaining >= self.pool_size and self.random.random() < self.pooled_fraction / self.pool_size:
+                size = self.pool_size
+            self._unit(size, self.random.choices(depths, weights)[0])
+            remaining -= size
+        return self.collections
+
+
+def generate_studies(workflows: List[WorkflowConfig], n_data_generations: int, **kwargs) -> Dict[str, List[Dict[str, Any]]]:
+    """ The collections of a synthetic set of studies with `n_data_generations` data generations """
+    return SyntheticStudyGenerator(workflows, **kwargs).generate(n_data_generations)
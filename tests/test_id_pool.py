@@ -0,0 +1,41 @@
+from unittest.mock import MagicMock
+
+from nmdc_automation.api import IdPool
+
+
+def _mock_api():
+    api = MagicMock()
+    counter = iter(range(10000))
+    api.mint_ids.side_effect = lambda id_type, how_many: [f"{id_type}-{next(counter)}" for _ in range(how_many)]
+    return api
+
+
+def test_id_pool_mints_in_batches():
+    api = _mock_api()
+    pool = IdPool(api, batch_size=5)
+
+    ids = [pool.mint("nmdc:DataObject") for _ in range(7)]
+    assert len(set(ids)) == 7
+    assert api.mint_ids.call_count == 2
+    assert pool.available("nmdc:DataObject") == 3
+
+    # a reservation larger than the batch size is minted in one call
+    reserved = pool.reserve("nmdc:MetagenomeAssembly", 12)
+    assert len(reserved) == 12
+    api.mint_ids.assert_called_with("nmdc:MetagenomeAssembly", 12)
+
+
+def test_id_pool_persists_reservoir(tmp_path):
+    pool_file = tmp_path / "id_pool.json"
+    api = _mock_api()
+    pool = IdPool(api, pool_file, batch_size=5)
+    handed_out = pool.reserve("nmdc:DataObject", 2)
+    assert pool_file.exists()
+
+    # a restarted pool picks up the remaining IDs without minting or reusing any
+    restarted_api = _mock_api()
+    restarted = IdPool(restarted_api, pool_file, batch_size=5)
+    assert restarted.available() == 3
+    more = restarted.reserve("nmdc:DataObject", 3)
+    restarted_api.mint_ids.assert_not_called()
+    assert not set(more) & set(handed_out)
@@ -1,15 +1,18 @@
 """ Test cases for the models module. """
 import json
+import timeit
 import pytest
 from bson import ObjectId
 from pathlib import Path
 from pytest import mark, raises
-from nmdc_automation.models.nmdc import DataObject, workflow_process_factory
+from nmdc_automation.models.nmdc import DataObject, DataObjectRecord, ProcessRecord, schema_object_to_dict, \
+    workflow_process_factory
 from nmdc_automation.models.workflow import WorkflowProcessNode
 from nmdc_automation.workflow_automation.workflows import load_workflow_configs
 from tests.fixtures import db_utils
 
 from linkml_runtime.dumpers import yaml_dumper
+from nmdc_schema.nmdc import Database
 import yaml
 
 
@@ -109,6 +112,38 @@ def test_workflow_process_node(workflows_config_dir,record_file, record_type, fi
     assert wfn.process.type == record_type
 
 
+def test_workflow_process_node_lazy_schema_process(workflows_config_dir, fixtures_dir):
+    """ The node holds a lightweight record and only builds the schema object on demand """
+    wfs = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    wf = [wf for wf in wfs if wf.type == "nmdc:MetagenomeAssembly"][0]
+    record = json.load(open(fixtures_dir / "models/metagenome_assembly_record.json"))
+
+    wfn = WorkflowProcessNode(record, wf)
+    assert isinstance(wfn.process, ProcessRecord)
+    assert wfn.id == record["id"]
+    assert wfn.has_output == record["has_output"]
+    assert wfn.was_informed_by == record["was_informed_by"]
+
+    schema_process = wfn.schema_process
+    assert not isinstance(schema_process, ProcessRecord)
+    assert schema_process.id == record["id"]
+    assert schema_process.type == "nmdc:MetagenomeAssembly"
+
+
+def test_data_object_record_matches_data_object(fixtures_dir):
+    """ DataObjectRecord exposes the same fields as DataObject without building it """
+    records = json.load(open(fixtures_dir / Path('nmdc_db/data_object_set.json')))
+    for record in records:
+        do_record = DataObjectRecord(**record)
+        data_obj = do_record.to_schema()
+        assert do_record.id == data_obj.id
+        assert do_record.url == data_obj.url
+        assert do_record.as_dict() == data_obj.as_dict()
+        if "data_object_type" in record:
+            assert do_record.data_object_type_text == data_obj.data_object_type_text
+            assert do_record.data_object_type.code.text == data_obj.data_object_type.code.text
+
+
 def test_data_object_creation_from_records(fixtures_dir):
     """ Test the creation of DataObject objects from records. """
     records_path = fixtures_dir / Path('nmdc_db/data_object_set.json')
@@ -154,6 +189,39 @@ def test_data_object_creation_from_db_records(test_db, fixtures_dir):
         assert data_obj_dict == db_record
 
 
+def test_data_object_as_dict_matches_yaml_round_trip(fixtures_dir):
+    records = json.load(open(fixtures_dir / Path('nmdc_db/data_object_set.json')))
+    data_objs = [DataObject(**record) for record in records]
+    for data_obj in data_objs:
+        assert data_obj.as_dict() == yaml.safe_load(yaml_dumper.dumps(data_obj))
+
+    wfe = workflow_process_factory(json.load(open(fixtures_dir / "models/mags_analysis_record.json")))
+    database = Database(data_object_set=data_objs, workflow_execution_set=[wfe])
+    assert schema_object_to_dict(database) == yaml.safe_load(yaml_dumper.dumps(database))
+
+
+def test_data_object_as_dict_memoized(fixtures_dir):
+    record = json.load(open(fixtures_dir / Path('nmdc_db/data_object_set.json')))[0]
+    data_obj = DataObject(**record)
+    first = data_obj.as_dict()
+    first["name"] = "changed by caller"
+    assert data_obj.as_dict()["name"] == record["name"]
+    assert "_as_dict_cache" not in data_obj.as_dict()
+
+    # reassigning a field invalidates the memoized result
+    data_obj.name = "renamed.fastq.gz"
+    assert data_obj.as_dict()["name"] == "renamed.fastq.gz"
+
+
+def test_data_object_as_dict_speedup(fixtures_dir):
+    """ Micro-benchmark: the direct serializer should be much faster than the YAML round trip """
+    record = json.load(open(fixtures_dir / Path('nmdc_db/data_object_set.json')))[0]
+    data_obj = DataObject(**record)
+    yaml_time = min(timeit.repeat(lambda: yaml.safe_load(yaml_dumper.dumps(data_obj)), number=20, repeat=3))
+    direct_time = min(timeit.repeat(lambda: schema_object_to_dict(data_obj), number=20, repeat=3))
+    assert direct_time * 5 < yaml_time
+
+
 def test_data_object_creation_invalid_data_object_type():
     record = {
         "id": "nmdc:dobj-11-rawreads1",
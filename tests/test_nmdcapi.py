@@ -537,4 +537,50 @@ def test_get_op_tenacity_retry(mock_sleep, site_config_file):
 
         # 1 token call + 6 op attempts = 7
         assert mock_send.call_count == 7
-        
\ No newline at end of file
+        
+
+def test_mint_ids(monkeypatch, requests_mock, test_client):
+    n = test_client
+    monkeypatch.setattr(n, "mint_ids", nmdcapi.mint_ids.__get__(n, nmdcapi))
+
+    resp = ["nmdc:dobj-11-abc1", "nmdc:dobj-11-abc2", "nmdc:dobj-11-abc3"]
+    requests_mock.post("http://localhost:8000/pids/mint", json=resp)
+    ids = n.mint_ids("nmdc:DataObject", 3)
+    assert ids == resp
+    assert requests_mock.last_request.json() == {"schema_class": {"id": "nmdc:DataObject"}, "how_many": 3}
+
+
+def test_shared_session_stats(requests_mock, site_config_file):
+    api = nmdcapi(site_config_file)
+    api.token = "abcd"
+    api.expires_at = time.time() + 3600
+
+    # only the collection crawl retries at the connection level
+    assert api.session.get_adapter(f"{api._base_url}nmdcschema/data_object_set").max_retries.total == 6
+    assert api.session.get_adapter(f"{api._base_url}jobs").max_retries.total == 0
+
+    requests_mock.get(f"{api._base_url}jobs/abc", json={"id": "abc"})
+    requests_mock.get(f"{api._base_url}operations/abc", status_code=404)
+    api.get_job("abc")
+    api.get_job("abc")
+    with pytest.raises(HTTPError):
+        api.get_op("abc")
+
+    stats = api.http_stats()
+    assert stats["endpoints"]["GET jobs"]["calls"] == 2
+    assert stats["endpoints"]["GET operations"]["errors"] == 1
+    assert set(stats["connections"]) == {"requests", "opened", "reused"}
+
+
+def test_list_from_collection_projection(monkeypatch, requests_mock, test_client):
+    n = test_client
+    n.session = requests.Session()
+    monkeypatch.setattr(n, "list_from_collection", nmdcapi.list_from_collection.__get__(n, nmdcapi))
+
+    target_pattern = re.compile(f"{n._base_url}nmdcschema/data_object_set.*")
+    requests_mock.get(target_pattern, json={"resources": [{"id": "obj1"}], "next_page_token": None})
+
+    n.list_from_collection("data_object_set", projection="id, started_at_time")
+    assert requests_mock.last_request.qs["projection"] == ["id,started_at_time"]
+    n.list_from_collection("data_object_set", projection=["id", "url"])
+    assert requests_mock.last_request.qs["projection"] == ["id,url"]
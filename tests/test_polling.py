@@ -0,0 +1,66 @@
+from time import monotonic
+from unittest.mock import patch
+
+import requests
+
+from nmdc_automation.workflow_automation.polling import AdaptivePollInterval
+from tests.fixtures.fake_runtime_api import InMemoryRuntimeStore, fake_runtime_api
+
+
+def test_poll_interval_backoff():
+    """ The interval doubles after idle cycles up to the maximum, and resets when jobs are created """
+    poller = AdaptivePollInterval(min_interval=10, max_interval=60)
+    assert [poller.end_cycle(0) for _ in range(4)] == [20, 40, 60, 60]
+    assert poller.end_cycle(3) == 10
+    poller.interval = 0.01
+    assert poller.wait() == "timeout"
+    assert poller.end_cycle(0) == 0.02
+
+
+def test_poll_trigger_file(tmp_path):
+    """ Creating the trigger file ends the wait at once and the file is removed """
+    trigger_file = tmp_path / "trigger"
+    trigger_file.touch()
+    poller = AdaptivePollInterval(min_interval=30, trigger_file=trigger_file)
+    assert poller.wait() == "trigger"
+    assert not trigger_file.exists()
+    # the cycle it started tightens the interval even if it found nothing
+    poller.interval = 60
+    assert poller.end_cycle(0) == 30
+
+
+def test_poll_change_probe(site_config_file):
+    """ New records end the wait on the next probe; unchanged counts wait for the interval """
+    store = InMemoryRuntimeStore({"data_generation_set": [{"id": "nmdc:dgns-11-00000001"}]})
+    api = fake_runtime_api(site_config_file, store)
+    poller = AdaptivePollInterval(api, min_interval=0.05, probe_interval=0.01, tick=0.01)
+    poller.start_cycle()
+    assert poller.probe() == {"data_generation_set": 1, "workflow_execution_set": 0}
+    assert poller.wait() == "timeout"
+
+    store["workflow_execution_set"].insert_many([{"id": "nmdc:wfrqc-11-00000001.1"}])
+    poller.interval = 60
+    assert poller.wait() == "change"
+    assert poller.end_cycle(0) == 0.05
+
+
+def test_poll_probe_failure():
+    """ A failing probe does not end the wait """
+    poller = AdaptivePollInterval(object(), min_interval=0.03, probe_interval=0.01, tick=0.01)
+    poller.start_cycle()
+    assert poller.probe() is None
+    assert poller.wait() == "timeout"
+
+
+def test_poll_probe_is_not_retried(site_config_file):
+    """ While the API is down a probe fails after one request instead of retrying with backoff """
+    store = InMemoryRuntimeStore({"data_generation_set": [{"id": "nmdc:dgns-11-00000001"}]})
+    api = fake_runtime_api(site_config_file, store)
+    poller = AdaptivePollInterval(api, min_interval=0.03, probe_interval=0.01, tick=0.01, probe_timeout=1)
+    assert poller.probe() == {"data_generation_set": 1, "workflow_execution_set": 0}
+    with patch.object(api.session, "post", side_effect=requests.ConnectionError("down")) as post:
+        start = monotonic()
+        assert poller.probe() is None
+        assert monotonic() - start < 1
+        assert post.call_count == 1
+        assert post.call_args.kwargs["timeout"] == 1
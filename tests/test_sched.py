@@ -1,14 +1,19 @@
-from nmdc_automation.workflow_automation.sched import Scheduler, SchedulerJob, MissingDataObjectException
+from nmdc_automation.workflow_automation.sched import Scheduler, SchedulerJob, MissingDataObjectException, UrlResolver
+from nmdc_automation.workflow_automation.sched import ShardedScheduler
 from pytest import mark
 import pytest
 from unittest.mock import patch, MagicMock
 from requests.exceptions import HTTPError
 import copy
+import itertools
 import time
+import json
 
-from nmdc_automation.workflow_automation.workflow_process import load_workflow_process_nodes
+from nmdc_automation.workflow_automation.metrics import CycleMetrics
+from nmdc_automation.workflow_automation.workflow_process import ShardFilter, load_workflow_process_nodes
 from nmdc_automation.workflow_automation.workflows import load_workflow_configs
-from nmdc_automation.models.workflow import WorkflowProcessNode
+from nmdc_automation.models.nmdc import DataObject
+from nmdc_automation.models.workflow import DATA_OBJECT_RECORD_FIELDS, WorkflowProcessNode
 from tests.fixtures.db_utils import init_test, load_fixture, read_json, reset_db
 from unittest.mock import patch, PropertyMock, Mock
 from nmdc_automation.api.nmdcapi import NmdcRuntimeApi
@@ -143,6 +148,32 @@ def test_progress(test_db, test_client, workflow_file, workflows_config_dir, sit
     assert len(resp) == exp_num_post_annotation_jobs
 
 
+def test_scheduler_incremental_cycles(test_db, test_client, workflows_config_dir, site_config_file):
+    """
+    Test that an incremental scheduler picks up new workflow executions between cycles
+    the same way a full rebuild does.
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client, incremental=True)
+    assert jm.graph_loader
+
+    resp = jm.cycle()
+    assert len(resp) == 1
+    resp = jm.cycle()
+    assert len(resp) == 0
+
+    # simulate the RQC job finishing; assembly and rba should be scheduled
+    load_fixture(test_db, "read_qc_analysis.json", col="workflow_execution_set")
+    resp = jm.cycle()
+    assert len(resp) == 2
+    resp = jm.cycle()
+    assert len(resp) == 0
+
+
 #def test_multiple_versions(test_db, mock_api, workflows_config_dir, site_config_file):
 def test_multiple_versions(test_db, test_client, workflows_config_dir, site_config_file):
     init_test(test_db)
@@ -303,6 +334,13 @@ def test_scheduler_find_new_jobs(test_db, test_client, workflows_config_dir, sit
     assert job_req["config"]["was_informed_by"] == ["nmdc:omprc-11-cegmwy02"]
     assert job_req["config"]["input_data_objects"]
 
+    # input data objects are the projected data_object_set records: plain dicts holding
+    # only DATA_OBJECT_RECORD_FIELDS, with the same values the full DataObject would give
+    for dobj in job_req["config"]["input_data_objects"]:
+        assert type(dobj) is dict
+        assert {"id", "type", "data_object_type", "url"} <= set(dobj) <= set(DATA_OBJECT_RECORD_FIELDS)
+        assert DataObject(**dobj).as_dict() == dobj
+
 
 #def test_scheduler_create_job_rec_raises_missing_data_object_exception(test_db, mock_api, workflows_config_dir, site_config_file):
 def test_scheduler_create_job_rec_raises_missing_data_object_exception(test_db, test_client, workflows_config_dir, site_config_file):
@@ -891,6 +929,30 @@ def test_scheduler_mock_minter(test_db, test_client, workflows_config_dir, site_
         assert jm.api.minter.called
 
 
+def test_scheduler_id_pool(test_db, test_client, workflows_config_dir, site_config_file):
+    """
+    Test that job records get their IDs from the pre-minted pool in one batch per type
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+
+    id_pool = MagicMock()
+    id_pool.reserve.side_effect = lambda id_type, how_many: [f"nmdc:dobj-11-pool{i}" for i in range(how_many)]
+    id_pool.mint.return_value = "nmdc:wfrqc-11-pool"
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client, id_pool=id_pool)
+    with patch.object(jm.api, 'minter') as minter:
+        resp = jm.cycle()
+        minter.assert_not_called()
+
+    assert len(resp) == 1
+    assert resp[0]["config"]["activity_id"] == "nmdc:wfrqc-11-pool.1"
+    output_ids = [output["id"] for output in resp[0]["config"]["outputs"]]
+    assert output_ids == [f"nmdc:dobj-11-pool{i}" for i in range(len(output_ids))]
+    id_pool.reserve.assert_called_once_with("nmdc:DataObject", len(output_ids))
+
+
 def test_no_schedule_minor_upgrade_of_running_job(test_db, test_client, workflows_config_dir, site_config_file):
     """
     Test that if a v2.0.0 MAG job is scheduled and ready for the watcher to pick up,
@@ -1062,6 +1124,36 @@ def test_get_existing_jobs_404_error(test_data_dir, test_db, test_client, workfl
         assert len(resp) == exp_num_jobs_initial
     
 
+def test_get_existing_jobs_fetches_ops_in_bulk(test_db, test_client, workflows_config_dir, site_config_file):
+    """
+    Test that the operations for job claims are fetched with one $in query per cycle
+    instead of one get_op call per claim
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_5.json", col="data_object_set")
+    load_fixture(test_db, "data_generation_5.json", col="data_generation_set")
+    load_fixture(test_db, "jobs_5.json", col="jobs")
+    load_fixture(test_db, "operations_5.json", col="operations")
+
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client)
+    for wf in jm.workflows:
+        if "Reads QC Interleave" in wf.name:
+            wf.version = "v1.0.24"
+            break
+
+    test_client.get_op.reset_mock()
+    test_client.list_ops.reset_mock()
+    resp = jm.cycle(allowlist={"nmdc:dgns-15-bvywdf28"})
+    assert len(resp) == 0
+
+    test_client.get_op.assert_not_called()
+    assert test_client.list_ops.call_count == 1
+    filt = test_client.list_ops.call_args.args[0]
+    claimed_op_ids = {claim["op_id"] for job in test_db.jobs.find() for claim in job.get("claims", [])}
+    assert set(filt["id"]["$in"]) == claimed_op_ids
+
+
 def test_scheduler_mags_priority_selection(test_db, test_client, workflows_config_dir, site_config_file):
     """
     Test that the scheduler prioritizes Assembly Contigs from the upstream Assembly 
@@ -1166,6 +1258,39 @@ def test_resolve_data_object_urls(test_db, test_client, workflows_config_dir, si
 
 
 
+def test_url_resolver_caches_redirects(requests_mock):
+    """
+    Test that prefetched URLs are resolved once and served from the cache until the TTL expires
+    """
+    urls = [f"https://storage.neonscience.org/reads_{i}.fastq.gz" for i in range(5)]
+    for i, url in enumerate(urls):
+        requests_mock.head(url, status_code=302, headers={"Location": f"https://storage.googleapis.com/reads_{i}.fastq.gz"})
+        requests_mock.head(f"https://storage.googleapis.com/reads_{i}.fastq.gz", status_code=200)
+    requests_mock.head("https://storage.neonscience.org/missing.fastq.gz", status_code=404)
+
+    resolver = UrlResolver(ttl=3600, max_workers=4, timeout=(5, 30))
+    resolver.prefetch(urls + urls + ["https://storage.neonscience.org/missing.fastq.gz"])
+    call_count = requests_mock.call_count
+    assert call_count == 11
+    # a hung host can't stall the cycle
+    assert all(request.timeout == (5, 30) for request in requests_mock.request_history)
+
+    for i, url in enumerate(urls):
+        assert resolver.resolve(url) == f"https://storage.googleapis.com/reads_{i}.fastq.gz"
+    assert requests_mock.call_count == call_count
+
+    # failures are not cached
+    with pytest.raises(HTTPError):
+        resolver.resolve("https://storage.neonscience.org/missing.fastq.gz")
+
+    # expired entries are resolved again
+    call_count = requests_mock.call_count
+    resolver = UrlResolver(ttl=0)
+    resolver.resolve(urls[0])
+    resolver.resolve(urls[0])
+    assert requests_mock.call_count == call_count + 4
+
+
 @mark.parametrize("allowlist_permutation", [
     ("nmdc:dgns-11-syr2vn62",),  # has historical individual jobs in the DB
     ("nmdc:dgns-11-kwb7eq83",),  # new, zero job history
@@ -1225,4 +1350,233 @@ def test_manifest_repooling_permutations_multicycle(allowlist_permutation, test_
 
         # All jobs should now be in a submitted state
         resp = jm.cycle(allowlist=current_allowlist)
-        assert len(resp) == exp_num_jobs_cycle_3
\ No newline at end of file
+        assert len(resp) == exp_num_jobs_cycle_3
+
+def test_scheduler_fetches_jobs_once_per_cycle(test_db, test_client, workflows_config_dir, site_config_file):
+    """ The jobs of all workflows are fetched with one list_jobs call per cycle and indexed """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_in_manifest_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_in_manifest_2.json", "data_generation_set")
+    load_fixture(test_db, "manifest_set_2.json", "manifest_set")
+
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client)
+    with patch.object(jm.api, 'minter', return_value="mocked-id-123"):
+        test_client.list_jobs.reset_mock()
+        resp = jm.cycle()
+        assert len(resp) == 2
+        assert test_client.list_jobs.call_count == 1
+
+        # The second cycle sees the jobs created by the first from a fresh index
+        test_client.list_jobs.reset_mock()
+        resp = jm.cycle()
+        assert len(resp) == 0
+        assert test_client.list_jobs.call_count == 1
+
+    job = test_db.jobs.find_one()
+    git_repo = job["config"]["git_repo"]
+    trigger = job["config"]["trigger_activity"]
+    manifest = job["config"].get("manifest")
+    assert jm.job_index.releases(git_repo, trigger, manifest) == {job["config"]["release"]}
+    assert jm.job_index.get(git_repo, trigger, "nmdc:manif-11-missing") == []
+    assert len(jm.job_index.jobs_for(git_repo)) == 2
+
+
+def test_scheduler_cycle_jobs_of_one_workflow_get_distinct_output_ids(test_db, test_client, workflows_config_dir, site_config_file):
+    """ Records built in one cycle don't share output specs, so each keeps its own minted IDs """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_in_manifest_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_in_manifest_2.json", "data_generation_set")
+    load_fixture(test_db, "manifest_set_2.json", "manifest_set")
+
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client)
+    minted = (f"nmdc:dobj-11-{i:08d}" for i in itertools.count())
+    with patch.object(jm.api, 'minter', side_effect=lambda *args, **kwargs: next(minted)):
+        resp = jm.cycle()
+    assert len(resp) == 2
+    assert resp[0]["workflow"] == resp[1]["workflow"]
+    output_ids = [{output["id"] for output in jr["config"]["outputs"]} for jr in resp]
+    assert all(len(ids) == len(jr["config"]["outputs"]) for ids, jr in zip(output_ids, resp))
+    assert output_ids[0].isdisjoint(output_ids[1])
+    # the workflow's own output specs are left untouched
+    workflow = next(wf for wf in jm.workflows if f"{wf.name}: {wf.version}" == resp[0]["workflow"]["id"])
+    assert all("id" not in output for output in workflow.outputs)
+
+
+def test_scheduler_create_jobs_batched(test_db, test_client, workflows_config_dir, site_config_file):
+    """
+    Job records are created in batches, duplicates of existing jobs are skipped and
+    failures are reported per record without stopping the batch
+    """
+    reset_db(test_db)
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client, job_batch_size=2)
+
+    def job_rec(trigger):
+        return {
+            "workflow": {"id": "Reads QC: v1.0.24"},
+            "config": {"git_repo": "https://github.com/microbiomedata/ReadsQC", "release": "v1.0.24",
+                       "trigger_activity": trigger},
+            "claims": [],
+        }
+
+    job_recs = [job_rec(f"nmdc:dgns-11-{i}") for i in range(5)]
+    test_client.create_job.reset_mock()
+    created = jm.create_jobs(job_recs + [job_rec("nmdc:dgns-11-0")])
+    assert len(created) == 5
+    assert test_client.create_job.call_count == 5
+    assert not jm.job_failures
+
+    # resubmitting is a no-op
+    test_client.create_job.reset_mock()
+    assert jm.create_jobs(job_recs) == []
+    test_client.create_job.assert_not_called()
+
+    # one record fails, one fails after the job was created, the others go through
+    create_job = test_client.create_job.side_effect
+
+    def flaky_create_job(jr):
+        trigger = jr["config"]["trigger_activity"]
+        if trigger == "nmdc:dgns-11-created":
+            create_job(jr)
+            raise HTTPError("read timed out")
+        if trigger == "nmdc:dgns-11-bad":
+            raise HTTPError("500 Server Error")
+        return create_job(jr)
+
+    test_client.create_job.side_effect = flaky_create_job
+    try:
+        created = jm.create_jobs([job_rec("nmdc:dgns-11-bad"), job_rec("nmdc:dgns-11-created"), job_rec("nmdc:dgns-11-ok")])
+    finally:
+        test_client.create_job.side_effect = create_job
+    assert {jr["config"]["trigger_activity"] for jr in created} == {"nmdc:dgns-11-created", "nmdc:dgns-11-ok"}
+    assert jm.job_failures == [
+        {"workflow": "Reads QC: v1.0.24", "trigger_activity": "nmdc:dgns-11-bad", "error": "500 Server Error"}
+    ]
+
+
+def test_get_activity_id_prefetched(test_db, test_client, workflows_config_dir, site_config_file):
+    """ Activity IDs are prefetched in one query and handed out without further lookups """
+    reset_db(test_db)
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client)
+    wf = next(w for w in jm.workflows if w.name == "Reads QC")
+    test_db[wf.collection].insert_many([
+        {"id": "nmdc:wfrqc-11-existing.1", "was_informed_by": ["nmdc:dgns-11-abc123"], "type": wf.type,
+         "started_at_time": "2024-01-01T00:00:00"},
+        {"id": "nmdc:wfrqc-11-existing.2", "was_informed_by": ["nmdc:dgns-11-abc123"], "type": wf.type,
+         "started_at_time": "2024-02-01T00:00:00"},
+        {"id": "nmdc:wfrqc-11-other.1", "was_informed_by": ["nmdc:dgns-11-other"], "type": wf.type,
+         "started_at_time": "2024-01-01T00:00:00"},
+    ])
+    jobs = [
+        MagicMock(informed_by=["nmdc:dgns-11-abc123"], workflow=wf),
+        MagicMock(informed_by=["nmdc:dgns-11-new"], workflow=wf),
+    ]
+
+    test_client.list_from_collection.reset_mock()
+    jm.prefetch_activity_ids(jobs)
+    assert test_client.list_from_collection.call_count == 1
+
+    assert jm.get_activity_id(wf, ["nmdc:dgns-11-abc123"]) == ("nmdc:wfrqc-11-existing", 3)
+    # IDs handed out in the cycle are remembered
+    assert jm.get_activity_id(wf, ["nmdc:dgns-11-abc123"]) == ("nmdc:wfrqc-11-existing", 4)
+    with patch.object(jm.api, 'minter', return_value="nmdc:wfrqc-11-minted"):
+        assert jm.get_activity_id(wf, ["nmdc:dgns-11-new"]) == ("nmdc:wfrqc-11-minted", 1)
+        assert jm.get_activity_id(wf, ["nmdc:dgns-11-new"]) == ("nmdc:wfrqc-11-minted", 2)
+    assert test_client.list_from_collection.call_count == 1
+
+
+def test_scheduler_cycle_metrics(test_db, test_client, workflows_config_dir, site_config_file, tmp_path):
+    """ Each cycle's phase timings are appended to the metrics file and exposed for Prometheus """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+    metrics_file = tmp_path / "metrics.jsonl"
+    prometheus_file = tmp_path / "scheduler.prom"
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                   site_conf=site_config_file, api=test_client,
+                   metrics_file=metrics_file, prometheus_file=prometheus_file)
+    jm.cycle()
+    jm.cycle()
+
+    records = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert [r["cycle"] for r in records] == [1, 2]
+    assert records[0]["jobs_created"] == 1
+    assert records[1]["jobs_created"] == 0
+    phases = records[0]["phases"]
+    for phase in ["load_workflow_process_nodes", "load_workflow_process_nodes.get_required_data_objects_map",
+                  "load_workflow_process_nodes.get_current_workflow_process_nodes",
+                  "load_workflow_process_nodes.resolve_relationships",
+                  "find_new_jobs", "create_job_rec", "create_job"]:
+        assert phase in phases
+        assert phases[phase]["seconds"] >= 0
+    assert phases["create_job_rec"]["calls"] == 1
+    assert "create_job_rec" not in records[1]["phases"]
+
+    prom = prometheus_file.read_text()
+    assert "nmdc_scheduler_cycles_total 2" in prom
+    assert 'nmdc_scheduler_phase_seconds{phase="find_new_jobs"}' in prom
+
+
+def test_cycle_metrics_rotation(tmp_path):
+    """ The metrics file is rotated when it grows past max_bytes """
+    metrics_file = tmp_path / "metrics.jsonl"
+    metrics = CycleMetrics(metrics_file, max_bytes=1, backup_count=2)
+    for _ in range(4):
+        metrics.start_cycle()
+        with metrics.phase("find_new_jobs"):
+            pass
+        metrics.end_cycle()
+    assert json.loads(metrics_file.read_text())["cycle"] == 4
+    assert json.loads((tmp_path / "metrics.jsonl.1").read_text())["cycle"] == 3
+    assert json.loads((tmp_path / "metrics.jsonl.2").read_text())["cycle"] == 2
+    assert not (tmp_path / "metrics.jsonl.3").exists()
+
+
+def test_shard_filter():
+    """ Every data generation is in exactly one shard, and by study a study stays in one """
+    recs = [{"id": f"nmdc:dgns-11-{i:08d}", "associated_studies": [f"nmdc:sty-11-{i // 10}"]} for i in range(100)]
+    for by in ShardFilter.BY:
+        shards = [ShardFilter(i, 4, by) for i in range(4)]
+        for rec in recs:
+            assert sum(shard(rec) for shard in shards) == 1
+        assert all(any(shard(rec) for rec in recs) for shard in shards)
+    by_study = ShardFilter(0, 4, "study")
+    for i in range(0, 100, 10):
+        assert len({by_study.shard_of(rec) for rec in recs[i:i + 10]}) == 1
+    with pytest.raises(ValueError):
+        ShardFilter(0, 4, "sample")
+
+
+@mark.parametrize("shard_by", ["id", "study"])
+def test_sharded_scheduler_cycle_manifest(test_db, test_client, workflows_config_dir, site_config_file, shard_by):
+    """
+    The sharded scheduler creates the same jobs as test_scheduler_cycle_manifest, including
+    a single job for a manifest whose data generations are in different shards.
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_in_manifest.json", "data_object_set")
+    load_fixture(test_db, "data_generation_in_manifest.json", "data_generation_set")
+    load_fixture(test_db, "manifest_set.json", "manifest_set")
+    load_fixture(test_db, "data_objects_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_2.json", "data_generation_set")
+    load_fixture(test_db, "workflow_execution_2.json", "workflow_execution_set")
+
+    # the smallest shard count that splits the manifest's data generations up by ID
+    manifest_dgs = read_json("nmdc_db/data_generation_in_manifest.json")
+    shards = next(n for n in range(2, 10) if len({ShardFilter(0, n).shard_of(rec) for rec in manifest_dgs}) > 1)
+
+    jm = ShardedScheduler(workflow_yaml=workflows_config_dir / "workflows.yaml",
+                          site_conf=site_config_file, api=test_client, shards=shards,
+                          shard_by=shard_by, processes=False)
+    with patch.object(jm.api, 'minter', return_value="mocked-id-123"):
+        resp = jm.cycle()
+        assert len(resp) == 2
+        assert {jr["config"]["git_repo"] for jr in resp} == {
+            "https://github.com/microbiomedata/ReadsQC", "https://github.com/microbiomedata/metaMAGs"
+        }
+        assert "shard.find_new_jobs" in jm.metrics.last_cycle["phases"]
+
+        assert jm.cycle() == []
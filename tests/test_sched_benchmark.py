@@ -0,0 +1,106 @@
+import logging
+
+from pytest import mark
+
+from nmdc_automation.workflow_automation.sched import Scheduler, ShardedScheduler
+from nmdc_automation.workflow_automation.workflows import load_workflow_configs
+from tests.fixtures.db_utils import read_json
+from tests.fixtures.fake_runtime_api import InMemoryRuntimeStore, fake_runtime_api
+from tests.fixtures.scheduler_benchmark import compare_to_baseline, run_benchmark
+from tests.fixtures.synthetic_studies import generate_studies
+
+logger = logging.getLogger(__name__)
+
+
+def test_fake_runtime_api_cycle(site_config_file, workflows_config_dir):
+    """ The fake runtime API schedules the same job as the mongomock test client """
+    store = InMemoryRuntimeStore({
+        "data_object_set": read_json("nmdc_db/data_object_set.json"),
+        "data_generation_set": read_json("nmdc_db/data_generation_set.json"),
+    })
+    api = fake_runtime_api(site_config_file, store)
+    jm = Scheduler(workflow_yaml=workflows_config_dir / "workflows.yaml", api=api)
+    for prefix in list(jm.url_resolver.session.adapters):
+        jm.url_resolver.session.adapters[prefix] = api.fake_adapter
+
+    resp = jm.cycle()
+    assert len(resp) == 1
+    assert resp[0]["config"]["git_repo"] == "https://github.com/microbiomedata/ReadsQC"
+    assert len(store["jobs"]) == 1
+    # input URLs are resolved over the scheduler's own session, outside the API stats
+    api_calls = {k: v for k, v in api.fake_adapter.requests.items() if not k.startswith("HEAD")}
+    assert api.stats.total_calls() == sum(api_calls.values())
+    assert jm.cycle() == []
+
+
+def test_synthetic_studies(workflows_config_dir):
+    workflows = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    collections = generate_studies(workflows, 300, seed=1)
+    assert len(collections["data_generation_set"]) == 300
+    assert collections["manifest_set"]
+    assert len(collections["jobs"]) == len(collections["workflow_execution_set"])
+    # the same seed gives the same studies
+    assert generate_studies(workflows, 300, seed=1) == collections
+
+    data_object_ids = {do["id"] for do in collections["data_object_set"]}
+    for wfe in collections["workflow_execution_set"]:
+        assert set(wfe["has_input"]) <= data_object_ids
+        assert wfe["was_informed_by"]
+    pooled = [do for do in collections["data_object_set"] if do.get("in_manifest")]
+    assert {do["data_object_type"] for do in pooled} == {"Metagenome Raw Read 1", "Metagenome Raw Read 2"}
+
+
+def test_scheduler_benchmark_smoke():
+    """
+    The runtime API calls of a cycle stay bounded by paging and the jobs it creates:
+    a per-node query would make the calls grow with the number of workflow process nodes.
+    """
+    small, large = run_benchmark(100, trace_memory=False), run_benchmark(400, trace_memory=False)
+    for result in (small, large):
+        assert result["cold"]["jobs"] > 0
+        assert result["steady"]["jobs"] == 0
+        assert result["cold"]["http_calls"]["POST queries:run"] == 2
+        assert result["cold"]["http_calls"]["POST jobs"] == result["cold"]["jobs"]
+        assert "POST jobs" not in result["steady"]["http_calls"]
+        assert "load_workflow_process_nodes" in result["cold"]["phases"]
+    for endpoint in ("GET nmdcschema", "GET jobs"):
+        assert large["steady"]["http_calls"][endpoint] < 0.1 * large["records"]["workflow_execution_set"]
+    assert compare_to_baseline([small], [small]) == []
+
+
+@mark.parametrize("shard_by", ["id", "study"])
+def test_sharded_scheduler_processes(site_config_file, workflows_config_dir, shard_by):
+    """ Worker processes find the same jobs as a single scheduler, and create each one once """
+    workflow_yaml = workflows_config_dir / "workflows.yaml"
+    collections = generate_studies(load_workflow_configs(workflow_yaml), 200, seed=3, study_size=20,
+                                   pooled_fraction=0.5, depth_weights={0: 0.3, 1: 0.2, 2: 0.2, 3: 0.2, 4: 0.1})
+
+    def _cycle(scheduler_class, **kwargs):
+        api = fake_runtime_api(site_config_file, InMemoryRuntimeStore(collections))
+        jm = scheduler_class(workflow_yaml, api=api, **kwargs)
+        for prefix in list(jm.url_resolver.session.adapters):
+            jm.url_resolver.session.adapters[prefix] = api.fake_adapter
+        return jm, jm.cycle()
+
+    _, expected = _cycle(Scheduler)
+    jm, resp = _cycle(ShardedScheduler, shards=3, shard_by=shard_by)
+    assert expected
+
+    def _key(job_rec):
+        # any replicate of a pool may trigger its job
+        return Scheduler._pool_key(job_rec) or Scheduler._job_key(job_rec)
+
+    assert sorted(map(_key, resp)) == sorted(map(_key, expected))
+    # jobs are created by the coordinator, so the next cycle sees all of them
+    assert jm.cycle() == []
+
+
+@mark.benchmark
+@mark.parametrize("n_data_generations", [1000, 10000, 100000])
+def test_scheduler_benchmark(n_data_generations):
+    result = run_benchmark(n_data_generations)
+    logger.info(f"Scheduler benchmark: {result}")
+    assert result["cold"]["jobs"] > 0
+    assert result["steady"]["jobs"] == 0
+    assert result["cold"]["http_calls"]["POST jobs"] == result["cold"]["jobs"]
+    assert "POST jobs" not in result["steady"]["http_calls"]
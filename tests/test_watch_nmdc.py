@@ -5,7 +5,9 @@ import pytest
 from pytest import fixture
 from unittest import mock
 from linkml_runtime.dumpers import yaml_dumper
+from nmdc_automation.models.nmdc import schema_object_to_dict
 import yaml
+import requests
 import requests_mock
 import shutil
 from unittest.mock import patch, PropertyMock, Mock, MagicMock
@@ -16,12 +18,22 @@ from nmdc_automation.workflow_automation.watch_nmdc import (
     FileHandler,
     JobManager,
     RuntimeApiHandler,
+    StateJournal,
+    JobArchive,
 )
 from nmdc_automation.api.nmdcapi import NmdcRuntimeApi
-from nmdc_automation.workflow_automation.wfutils import WorkflowJob
+from nmdc_automation.workflow_automation.wfutils import CromwellRunner, WorkflowJob
 from tests.fixtures.db_utils import load_fixture, reset_db
 
 
+@fixture(autouse=True)
+def default_state_in_tmp_path(monkeypatch, tmp_path):
+    """ Keep the default state file, and its journal and archive, out of the package directory """
+    state_dir = tmp_path / "_state"
+    monkeypatch.setattr("nmdc_automation.workflow_automation.watch_nmdc.DEFAULT_STATE_DIR", state_dir)
+    monkeypatch.setattr("nmdc_automation.workflow_automation.watch_nmdc.DEFAULT_STATE_FILE", state_dir / "state.json")
+
+
 # FileHandler init tests
 def test_file_handler_init_from_state_file(site_config, initial_state_file_1_failure, tmp_path):
     copy_state_file = tmp_path / "copy_state.json"
@@ -108,6 +120,61 @@ def test_file_handler_write_state(site_config, initial_state_file_1_failure, fix
     fh.write_state(state)
 
 
+def test_state_journal(tmp_path):
+    """ Writes journal only the changed jobs, reads replay them and compaction folds them in """
+    state_file = tmp_path / "agent.state"
+    jobs = [{"opid": f"nmdc:sys0{i}", "last_status": "Submitted"} for i in range(3)]
+    state_file.write_text(json.dumps({"jobs": jobs}))
+    journal = StateJournal(state_file, compact_entries=4)
+    state = journal.read()
+    assert state["jobs"] == jobs
+
+    state["jobs"][1]["last_status"] = "Succeeded"
+    journal.write(state)
+    journal.write(state)
+    assert json.loads(state_file.read_text())["jobs"] == jobs
+    assert journal.journal_file.read_text().splitlines() == [
+        json.dumps({"put": {"opid": "nmdc:sys01", "last_status": "Succeeded"}})
+    ]
+
+    del state["jobs"][0]
+    state["jobs"].append({"opid": "nmdc:sys03", "last_status": "Submitted"})
+    journal.write(state)
+    assert len(journal.journal_file.read_text().splitlines()) == 3
+    assert StateJournal(state_file).read() == state
+
+    # a torn entry from a crash mid-append is ignored
+    with open(journal.journal_file, "a") as f:
+        f.write('{"put": {"opid": "nmdc:sys04", "last_')
+    assert StateJournal(state_file).read() == state
+
+    # the journal is folded into the state file once it holds compact_entries lines
+    journal = StateJournal(state_file, compact_entries=4)
+    state = journal.read()
+    state["jobs"][0]["last_status"] = "Failed"
+    state["jobs"][1]["last_status"] = "Failed"
+    journal.write(state)
+    assert not journal.journal_file.exists()
+    assert json.loads(state_file.read_text()) == state
+    assert not (tmp_path / "agent.state.tmp").exists()
+
+
+def test_file_handler_write_state_journal(site_config, initial_state_file_1_failure, fixtures_dir):
+    """ A checkpoint with one new job appends one journal line and leaves the state file alone """
+    fh = FileHandler(site_config, initial_state_file_1_failure)
+    snapshot = initial_state_file_1_failure.read_text()
+    state = fh.read_state()
+    state["jobs"].append(json.load(open(fixtures_dir / "new_state_job.json")))
+    fh.write_state(state)
+    assert initial_state_file_1_failure.read_text() == snapshot
+    assert len(fh.journal.journal_file.read_text().splitlines()) == 1
+    assert len(FileHandler(site_config, initial_state_file_1_failure).read_state()["jobs"]) == 2
+
+    fh.compact_state()
+    assert not fh.journal.journal_file.exists()
+    assert len(json.loads(initial_state_file_1_failure.read_text())["jobs"]) == 2
+
+
 def test_file_handler_get_output_path(site_config, initial_state_file_1_failure, fixtures_dir):
     # Arrange
     was_informed_by = ["nmdc:1234"]
@@ -185,6 +252,25 @@ def test_job_manager_restore_from_state(site_config, initial_state_file_1_failur
     assert not new_jobs
 
 
+def test_job_manager_restore_from_state_unchanged(site_config, initial_state_file_1_failure, fixtures_dir):
+    """ The state is only re-read when something other than the job manager wrote it """
+    fh = FileHandler(site_config, initial_state_file_1_failure)
+    jm = JobManager(site_config, fh)
+    with patch.object(fh, "read_state", wraps=fh.read_state) as read_state:
+        jm.restore_from_state()
+        jm.save_checkpoint()
+        jm.restore_from_state()
+        assert read_state.call_count == 0
+
+        other = FileHandler(site_config, initial_state_file_1_failure)
+        state = other.read_state()
+        state["jobs"].append(json.load(open(fixtures_dir / "new_state_job.json")))
+        other.write_state(state)
+        jm.restore_from_state()
+        assert read_state.call_count == 1
+    assert len(jm.job_cache) == 2
+
+
 def test_job_manager_job_checkpoint(site_config, initial_state_file_1_failure):
     # Arrange
     fh = FileHandler(site_config, initial_state_file_1_failure)
@@ -225,6 +311,76 @@ def test_job_manager_find_job_by_opid(site_config, initial_state_file_1_failure)
     assert not job.done
 
 
+def test_job_manager_find_job_by_opid_after_cache_changes(site_config, initial_state_file_1_failure, fixtures_dir):
+    fh = FileHandler(site_config, initial_state_file_1_failure)
+    jm = JobManager(site_config, fh)
+    existing_job = jm.find_job_by_opid("nmdc:test-opid")
+    assert existing_job
+
+    new_job = WorkflowJob(site_config, json.load(open(fixtures_dir / "new_state_job.json")))
+    new_job.set_opid("nmdc:test-opid-2")
+    jm.job_cache.append(new_job)
+    assert jm.find_job_by_opid("nmdc:test-opid-2") is new_job
+
+    jm.job_cache.remove(existing_job)
+    assert jm.find_job_by_opid("nmdc:test-opid") is None
+
+    # assigning a plain list keeps the index
+    jm.job_cache = [existing_job]
+    assert jm.find_job_by_opid("nmdc:test-opid") is existing_job
+    assert jm.find_job_by_opid("nmdc:test-opid-2") is None
+    jm.job_cache = []
+
+
+def test_job_manager_archive_done_jobs(site_config, initial_state_file_1_failure, fixtures_dir):
+    """ Done jobs move from the job cache and state to the archive, which report and resubmit still see """
+    fh = FileHandler(site_config, initial_state_file_1_failure)
+    jm = JobManager(site_config, fh)
+    done_job = WorkflowJob(site_config, json.load(open(fixtures_dir / "new_state_job.json")))
+    done_job.set_opid("nmdc:test-opid-done")
+    done_job.workflow.last_status = "Failed"
+    done_job.done = True
+    jm.job_cache.append(done_job)
+
+    jm.save_checkpoint()
+    assert [job.opid for job in jm.job_cache] == ["nmdc:test-opid"]
+    assert [job["opid"] for job in fh.read_state()["jobs"]] == ["nmdc:test-opid"]
+    assert [job["opid"] for job in fh.read_archive()] == ["nmdc:test-opid-done"]
+
+    assert jm.find_job_by_opid("nmdc:test-opid-done") is None
+    archived_job = jm.find_job_by_opid("nmdc:test-opid-done", archived=True)
+    assert archived_job.done
+    assert len(jm.report()) == 1
+    assert len(jm.report(archived=True)) == 2
+    assert [job.opid for job in jm.get_failed_jobs(archived=True)] == ["nmdc:test-opid", "nmdc:test-opid-done"]
+
+    # a resubmitted job is active again
+    jm.reactivate(archived_job)
+    archived_job.done = False
+    jm.save_checkpoint()
+    assert len(fh.read_state()["jobs"]) == 2
+    assert jm.get_archived_jobs() == []
+
+
+def test_job_manager_restore_archives_done_jobs(site_config, initial_state_file_1_failure, fixtures_dir):
+    """ Done jobs in an existing state file are archived on restore; a torn archive tail is ignored """
+    state = json.loads(initial_state_file_1_failure.read_text())
+    done_job = json.load(open(fixtures_dir / "new_state_job.json"))
+    done_job.update({"opid": "nmdc:test-opid-done", "done": True})
+    state["jobs"].append(done_job)
+    initial_state_file_1_failure.write_text(json.dumps(state))
+
+    fh = FileHandler(site_config, initial_state_file_1_failure)
+    jm = JobManager(site_config, fh)
+    assert [job.opid for job in jm.job_cache] == ["nmdc:test-opid"]
+    assert len(FileHandler(site_config, initial_state_file_1_failure).read_state()["jobs"]) == 1
+
+    archive = JobArchive(initial_state_file_1_failure)
+    with open(archive.archive_file, "ab") as f:
+        f.write(b"\x1f\x8b\x08\x00")
+    assert list(archive.jobs()) == ["nmdc:test-opid-done"]
+
+
 def test_job_manager_prepare_and_cache_new_job(site_config, initial_state_file_1_failure, fixtures_dir):
     # Arrange
     fh = FileHandler(site_config, initial_state_file_1_failure)
@@ -355,6 +511,79 @@ def test_job_manager_get_finished_jobs(site_config, initial_state_file_1_failure
     jm.job_cache = []
 
 
+def test_job_manager_get_finished_jobs_bulk_status(site_config, fixtures_dir, tmp_path):
+    """ Cromwell statuses come from one /query request; jobs it does not return are checked one by one """
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps({"jobs": []}))
+    jm = JobManager(site_config, FileHandler(site_config, state_file))
+    job_state = json.load(open(fixtures_dir / "rqc_workflow_state.json"))
+    statuses = {"job-1": "Succeeded", "job-2": "Failed", "job-3": "Running"}
+    for i, job_id in enumerate([*statuses, "job-4"]):
+        state = dict(job_state, cromwell_jobid=job_id, last_status="Submitted", opid=f"nmdc:sys0{i}")
+        jm.job_cache.append(WorkflowJob(site_config, state))
+
+    url = "http://localhost:8088/api/workflows/v1"
+    with requests_mock.Mocker() as m:
+        query = m.post(f"{url}/query", json={
+            "results": [{"id": job_id, "status": status} for job_id, status in statuses.items()],
+            "totalResultsCount": len(statuses),
+        })
+        status_4 = m.get(f"{url}/job-4/status", json={"status": "Succeeded"})
+        successful_jobs, failed_jobs = jm.get_finished_jobs()
+
+    assert query.call_count == 1
+    assert sorted(q["id"] for q in query.last_request.json()) == ["job-1", "job-2", "job-3", "job-4"]
+    assert status_4.call_count == 1
+    assert [job.workflow.job_runner_id for job in successful_jobs] == ["job-1", "job-4"]
+    assert [job.workflow.job_runner_id for job in failed_jobs] == ["job-2"]
+    assert jm.job_cache[2].workflow.last_status == "running"
+
+
+def test_job_manager_get_finished_jobs_bulk_status_timeout(site_config, fixtures_dir, tmp_path):
+    """ A timed out Cromwell /query request falls back to checking each job by itself """
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps({"jobs": []}))
+    jm = JobManager(site_config, FileHandler(site_config, state_file))
+    job_state = json.load(open(fixtures_dir / "rqc_workflow_state.json"))
+    for i, job_id in enumerate(["job-1", "job-2"]):
+        state = dict(job_state, cromwell_jobid=job_id, last_status="Submitted", opid=f"nmdc:sys0{i}")
+        jm.job_cache.append(WorkflowJob(site_config, state))
+
+    url = "http://localhost:8088/api/workflows/v1"
+    with requests_mock.Mocker() as m:
+        query = m.post(f"{url}/query", exc=requests.exceptions.ReadTimeout)
+        m.get(f"{url}/job-1/status", json={"status": "Succeeded"})
+        m.get(f"{url}/job-2/status", json={"status": "Running"})
+        successful_jobs, failed_jobs = jm.get_finished_jobs()
+
+    assert query.last_request.timeout == CromwellRunner.STATUS_TIMEOUT
+    assert [job.workflow.job_runner_id for job in successful_jobs] == ["job-1"]
+    assert not failed_jobs
+    assert all(request.timeout for request in m.request_history)
+
+
+def test_job_manager_get_finished_jobs_status_error(site_config, fixtures_dir, tmp_path):
+    """ A job whose status can't be read is left as it was, the others are still checked """
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps({"jobs": []}))
+    jm = JobManager(site_config, FileHandler(site_config, state_file))
+    job_state = json.load(open(fixtures_dir / "rqc_workflow_state.json"))
+    for i, job_id in enumerate(["job-1", "job-2"]):
+        state = dict(job_state, cromwell_jobid=job_id, last_status="Submitted", opid=f"nmdc:sys0{i}")
+        jm.job_cache.append(WorkflowJob(site_config, state))
+
+    url = "http://localhost:8088/api/workflows/v1"
+    with requests_mock.Mocker() as m:
+        m.post(f"{url}/query", status_code=500)
+        m.get(f"{url}/job-1/status", status_code=500)
+        m.get(f"{url}/job-2/status", json={"status": "Succeeded"})
+        successful_jobs, failed_jobs = jm.get_finished_jobs()
+
+    assert [job.workflow.job_runner_id for job in successful_jobs] == ["job-2"]
+    assert not failed_jobs
+    assert jm.job_cache[0].workflow.last_status == "Submitted"
+
+
 def test_job_manager_process_successful_job(site_config, initial_state_file_1_failure, fixtures_dir, job_metadata_factory):
     modified_job_metadata = job_metadata_factory(fixtures_dir / "mags_job_metadata.json")
     assert modified_job_metadata is not None
@@ -752,6 +981,7 @@ def test_watcher_validate_exec_resource_mapping(site_config, initial_state_file_
         job_dict = yaml.safe_load(yaml_dumper.dumps(db))
         workflow_dict = job_dict['workflow_execution_set'][0]
         assert workflow_dict['execution_resource'] == expected_resource
+        assert schema_object_to_dict(db) == job_dict
 
         # cleanup
         jm.job_cache = []
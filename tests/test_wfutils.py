@@ -1,13 +1,19 @@
 
 from nmdc_automation.workflow_automation.wfutils import (
+    CopyVerificationError,
     CromwellRunner,
+    RateLimiter,
     WorkflowJob,
     WorkflowStateManager,
     JawsRunner,
+    _copy_md5,
 )
 from nmdc_automation.models.nmdc import DataObject
 from nmdc_schema.nmdc import MagsAnalysis, EukEval
+import hashlib
 import io
+from pathlib import Path
+import time
 import json
 import os
 import pytest
@@ -461,6 +467,78 @@ def test_make_data_objects_includes_workflow_execution_id_and_file_size(site_con
         assert data_object.file_size_bytes
 
 
+def test_make_data_objects_copies_and_hashes_outputs(site_config, fixtures_dir, job_metadata_factory, tmp_path):
+    """ Outputs are copied and hashed in one pass, concurrently, and keep the order of the output specs """
+    modified_job_metadata = job_metadata_factory(fixtures_dir / "mags_job_metadata.json")
+    workflow_state = json.load(open(fixtures_dir / "mags_workflow_state.json"))
+    job = WorkflowJob(site_config, workflow_state, modified_job_metadata)
+    data_objects = job.make_data_objects(output_dir=tmp_path)
+    assert len(data_objects) > 1
+    output_files = [job.job.outputs.get(f"{job.workflow.input_prefix}.{spec['output']}")
+                    for spec in job.workflow.data_outputs]
+    output_files = [Path(path) for path in output_files if path]
+    assert [data_object.name for data_object in data_objects] == [path.name for path in output_files]
+    for data_object, output_file in zip(data_objects, output_files):
+        copied_file = tmp_path / output_file.name
+        assert copied_file.read_bytes() == output_file.read_bytes()
+        assert data_object.md5_checksum == hashlib.md5(output_file.read_bytes()).hexdigest()
+        assert data_object.file_size_bytes == output_file.stat().st_size
+
+
+def test_copy_md5(tmp_path):
+    src = tmp_path / "src.txt"
+    src.write_bytes(os.urandom(1000))
+    dest = tmp_path / "dest.txt"
+    assert _copy_md5(src, dest, chunk_size=64) == hashlib.md5(src.read_bytes()).hexdigest()
+    assert dest.read_bytes() == src.read_bytes()
+    with pytest.raises(FileNotFoundError):
+        _copy_md5(tmp_path / "missing.txt", dest)
+
+
+def test_copy_md5_verifies_the_copy(tmp_path):
+    src = tmp_path / "src.txt"
+    src.write_bytes(os.urandom(1000))
+    dest = tmp_path / "dest.txt"
+    real_open = open
+
+    def corrupting_open(file, mode="r", *args, **kwargs):
+        f = real_open(file, mode, *args, **kwargs)
+        if Path(file) == dest and "w" in mode:
+            # a write that keeps the length but not the content
+            write = f.write
+            f.write = lambda data: write(bytes(len(data)))
+        return f
+
+    with mock.patch("builtins.open", corrupting_open):
+        with pytest.raises(CopyVerificationError, match="md5"):
+            _copy_md5(src, dest)
+        # without verification only the size is checked
+        assert _copy_md5(src, dest, verify=False) == hashlib.md5(src.read_bytes()).hexdigest()
+    assert dest.read_bytes() == bytes(1000)
+
+
+def test_make_data_object_retries_only_size_mismatch(site_config, fixtures_dir, tmp_path):
+    job_state = json.load(open(fixtures_dir / "rqc_workflow_state.json"))
+    job = WorkflowJob(site_config, job_state)
+    output_file = tmp_path / "output.txt"
+    output_file.write_text("output")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    output_spec = {"id": "nmdc:dobj-01-abcd1234", "description": "output", "data_object_type": "QC Statistics"}
+
+    copy = mock.Mock(side_effect=[CopyVerificationError("short copy"), "abc123"])
+    with mock.patch("nmdc_automation.workflow_automation.wfutils._copy_md5", copy):
+        data_object = job._make_data_object(output_spec, output_file, "https://example.org/output.txt", output_dir)
+    assert copy.call_count == 2
+    assert data_object.md5_checksum == "abc123"
+
+    copy = mock.Mock(side_effect=PermissionError("denied"))
+    with mock.patch("nmdc_automation.workflow_automation.wfutils._copy_md5", copy):
+        with pytest.raises(PermissionError):
+            job._make_data_object(output_spec, output_file, "https://example.org/output.txt", output_dir)
+    assert copy.call_count == 1
+
+
 def test_workflow_job_from_database_job_record(site_config, fixtures_dir):
     job_rec = json.load(open(fixtures_dir / "nmdc_api/unsubmitted_job.json"))
     assert job_rec
@@ -561,4 +639,23 @@ def test_jaws_job_runner_submit_tahoma_job(mock_generate_submission_files, site_
     assert job_runner.job_site == "nmdc_tahoma"
     jobid = job_runner.submit_job()
     assert site_config.env == "dev"
-    assert jobid
\ No newline at end of file
+    assert jobid
+
+def test_jaws_runner_get_job_statuses():
+    """ Runs in the JAWS queue are running; the others have to be checked by themselves """
+    jaws_api = mock.MagicMock()
+    jaws_api.queue.return_value = [{"id": 101, "status": "queued"}, {"id": 102, "status": "running"}]
+    runners = [mock.MagicMock(jaws_api=jaws_api, job_id=job_id) for job_id in (101, 102, 103)]
+    assert JawsRunner.get_job_statuses(runners) == ["running", "running", None]
+    assert jaws_api.queue.call_count == 1
+    assert JawsRunner.get_job_statuses([]) == []
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(100)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.05
+    unlimited = RateLimiter(None)
+    assert unlimited.interval == 0
@@ -1,6 +1,10 @@
 from pytest import mark
+from unittest.mock import MagicMock
 
 from nmdc_automation.workflow_automation.workflow_process import (
+    IncrementalWorkflowProcessLoader,
+    ScheduledJobs,
+    WorkflowProcessGraph,
     get_required_data_objects_map,
     get_current_workflow_process_nodes,
     load_workflow_process_nodes,
@@ -271,3 +275,246 @@ def test_within_range():
     assert _within_range('v1.0.8', 'v1.0.0')
     # Major version - out of range
     assert not _within_range('v1.0.8', 'v2.0.0')
+
+
+def _is_cursor_query(query: dict) -> bool:
+    return list(query["pipeline"][0]) == ["$group"]
+
+
+def test_incremental_loader_reuses_graph_without_changes(test_db, test_client, workflows_config_dir):
+    """
+    Test that a second load with no new records only runs id-only probe queries and
+    returns the graph built on the first load, and that later loads only check the
+    change cursor of each collection.
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+    load_fixture(test_db, "read_qc_analysis.json", "workflow_execution_set")
+
+    workflow_config = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    api = MagicMock(wraps=test_client)
+    loader = IncrementalWorkflowProcessLoader(api, workflow_config)
+
+    nodes, manifest_map = loader.load()
+    exp_nodes, _ = load_workflow_process_nodes(test_client, workflow_config)
+    assert sorted(n.id for n in nodes) == sorted(n.id for n in exp_nodes)
+
+    api.reset_mock()
+    nodes_2, manifest_map_2 = loader.load()
+    assert nodes_2 is nodes
+    assert api.list_from_collection.call_count > 0
+    for call in api.list_from_collection.call_args_list:
+        assert call.args[2] == "id"
+    assert all(_is_cursor_query(call.args[0]) for call in api.run_query.call_args_list)
+
+    # an idle cycle doesn't page any collection: one cursor query per collection read
+    api.reset_mock()
+    assert loader.load()[0] is nodes
+    assert api.list_from_collection.call_count == 0
+    cursor_collections = [call.args[0]["aggregate"] for call in api.run_query.call_args_list]
+    assert all(_is_cursor_query(call.args[0]) for call in api.run_query.call_args_list)
+    assert sorted(cursor_collections) == sorted({"data_object_set", "data_generation_set", "workflow_execution_set"})
+
+
+def test_incremental_loader_picks_up_new_records(test_db, test_client, workflows_config_dir):
+    """
+    Test that records added between loads are fetched and linked into the graph
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+
+    workflow_config = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    loader = IncrementalWorkflowProcessLoader(test_client, workflow_config)
+
+    nodes, _ = loader.load()
+    assert len(nodes) == 1
+    assert not nodes[0].children
+
+    load_fixture(test_db, "read_qc_analysis.json", "workflow_execution_set")
+    nodes, _ = loader.load()
+    assert len(nodes) == 2
+    data_generation_node = [n for n in nodes if n.type == "nmdc:NucleotideSequencing"][0]
+    assert len(data_generation_node.children) == 1
+    assert data_generation_node.children[0].type == "nmdc:ReadQcAnalysis"
+
+    # removed records drop out of the graph
+    test_db["workflow_execution_set"].delete_many({})
+    nodes, _ = loader.load()
+    assert len(nodes) == 1
+
+
+def test_incremental_loader_restores_snapshot(test_db, test_client, workflows_config_dir, tmp_path):
+    """
+    Test that a new loader restores the graph from a snapshot taken with the same key
+    and only reconciles changes, and that a snapshot with a different key is ignored.
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+    load_fixture(test_db, "read_qc_analysis.json", "workflow_execution_set")
+
+    workflow_config = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    snapshot_path = tmp_path / "graph.json.gz"
+    loader = IncrementalWorkflowProcessLoader(
+        test_client, workflow_config, snapshot_path=str(snapshot_path), snapshot_key="abc"
+    )
+    nodes, _ = loader.load()
+    assert snapshot_path.exists()
+
+    api = MagicMock(wraps=test_client)
+    restarted = IncrementalWorkflowProcessLoader(
+        api, workflow_config, snapshot_path=str(snapshot_path), snapshot_key="abc"
+    )
+    restored_nodes, _ = restarted.load()
+    assert sorted(n.id for n in restored_nodes) == sorted(n.id for n in nodes)
+    for call in api.list_from_collection.call_args_list:
+        assert call.args[2] == "id"
+    assert all(_is_cursor_query(call.args[0]) for call in api.run_query.call_args_list)
+
+    # the snapshot keeps the change cursors, so the next restart only checks them
+    api.reset_mock()
+    restarted_again = IncrementalWorkflowProcessLoader(
+        api, workflow_config, snapshot_path=str(snapshot_path), snapshot_key="abc"
+    )
+    restored_nodes, _ = restarted_again.load()
+    assert sorted(n.id for n in restored_nodes) == sorted(n.id for n in nodes)
+    assert api.list_from_collection.call_count == 0
+    assert all(_is_cursor_query(call.args[0]) for call in api.run_query.call_args_list)
+
+    api.reset_mock()
+    changed_workflows = IncrementalWorkflowProcessLoader(
+        api, workflow_config, snapshot_path=str(snapshot_path), snapshot_key="def"
+    )
+    changed_workflows.load()
+    assert any(call.args[2] != "id" for call in api.list_from_collection.call_args_list)
+
+
+def test_workflow_execution_records_fetched_with_one_query(test_db, test_client, workflows_config_dir):
+    """
+    Test that all workflow execution workflows share a single merged query and
+    still get only their own records
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_object_set.json")
+    load_fixture(test_db, "data_generation_set.json")
+    load_fixture(test_db, "read_qc_analysis.json", "workflow_execution_set")
+
+    workflow_config = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    api = MagicMock(wraps=test_client)
+    nodes, _ = load_workflow_process_nodes(api, workflow_config)
+
+    we_calls = [c for c in api.list_from_collection.call_args_list if c.args[0] == "workflow_execution_set"]
+    assert len(we_calls) == 1
+    git_repos = {wf.git_repo for wf in workflow_config if wf.collection == "workflow_execution_set"}
+    assert set(we_calls[0].args[1]["git_url"]["$in"]) == git_repos
+    assert [n.type for n in nodes if n.type == "nmdc:ReadQcAnalysis"] == ["nmdc:ReadQcAnalysis"]
+
+
+def test_workflow_process_records_are_projected(test_db, test_client, workflows_config_dir):
+    """
+    Test that process and data object records are fetched with projections that leave
+    out large fields such as mags_list
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_2.json", "data_generation_set")
+    load_fixture(test_db, "workflow_execution_2.json", "workflow_execution_set")
+
+    workflow_config = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    api = MagicMock(wraps=test_client)
+    nodes, _ = load_workflow_process_nodes(api, workflow_config)
+    assert nodes
+
+    for call in api.list_from_collection.call_args_list:
+        projection = call.args[2]
+        assert projection
+        assert "mags_list" not in projection.split(",")
+
+
+def test_manifest_map_resolved_in_two_queries(test_db, test_client, workflows_config_dir):
+    """ All the manifests found are resolved with two batched aggregations and indexed """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_in_manifest_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_in_manifest_2.json", "data_generation_set")
+    load_fixture(test_db, "manifest_set_2.json", "manifest_set")
+    workflow_configs = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+
+    test_client.run_query.reset_mock()
+    nodes, manifest_map = load_workflow_process_nodes(test_client, workflow_configs)
+    assert test_client.run_query.call_count == 2
+
+    assert set(manifest_map) == {"nmdc:manif-11-58zpr543", "nmdc:manif-11-pwx0je07"}
+    assert manifest_map.data_generation_ids("nmdc:manif-11-58zpr543") == ["nmdc:dgns-11-2gqg1f77"]
+    assert manifest_map.has_data_generation("nmdc:manif-11-pwx0je07", "nmdc:dgns-11-syrtkh58")
+    assert not manifest_map.has_data_generation("nmdc:manif-11-pwx0je07", "nmdc:dgns-11-2gqg1f77")
+    assert len(manifest_map.data_objects("nmdc:manif-11-pwx0je07")) == 4
+    assert manifest_map.manifest_for_data_object("nmdc:dobj-11-3ers8b92") == "nmdc:manif-11-pwx0je07"
+    assert manifest_map.manifest_for_data_generation("nmdc:dgns-11-2gqg1f77") == "nmdc:manif-11-58zpr543"
+    assert manifest_map.manifest_for_data_generation_set(["nmdc:dgns-11-syrtkh58"]) == "nmdc:manif-11-pwx0je07"
+    for node in nodes:
+        if node.id == "nmdc:dgns-11-syrtkh58":
+            assert node.manifest == ["nmdc:manif-11-pwx0je07"]
+
+
+def test_incremental_loader_sees_manifest_changes(test_db, test_client, workflows_config_dir):
+    """
+    A manifest_set change under unchanged data generation and execution IDs rebuilds the
+    graph. Replacing a record moves the collection's change cursor; in-place updates are
+    only seen on the next full refresh.
+    """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_in_manifest_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_in_manifest_2.json", "data_generation_set")
+    load_fixture(test_db, "manifest_set_2.json", "manifest_set")
+    workflow_configs = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+    loader = IncrementalWorkflowProcessLoader(test_client, workflow_configs)
+
+    nodes, manifest_map = loader.load()
+    assert len(manifest_map.data_objects("nmdc:manif-11-pwx0je07")) == 4
+    assert loader.load()[0] is nodes
+    assert loader.load()[0] is nodes
+
+    manifest = test_db["manifest_set"].find_one_and_delete({"id": "nmdc:manif-11-pwx0je07"})
+    manifest.pop("_id")
+    test_db["manifest_set"].insert_one(dict(manifest, manifest_category="instrument_run"))
+    nodes_2, manifest_map_2 = loader.load()
+    assert nodes_2 is not nodes
+    # the manifest is no longer poolable, so none of its data objects are pooled
+    assert manifest_map_2.data_objects("nmdc:manif-11-pwx0je07") == []
+
+
+def test_workflow_process_graph_indexes(test_db, test_client, workflows_config_dir):
+    """ The loaded graph answers node, producer and informed-by lookups from its indexes """
+    reset_db(test_db)
+    load_fixture(test_db, "data_objects_2.json", "data_object_set")
+    load_fixture(test_db, "data_generation_2.json", "data_generation_set")
+    load_fixture(test_db, "workflow_execution_2.json", "workflow_execution_set")
+    workflow_config = load_workflow_configs(workflows_config_dir / "workflows.yaml")
+
+    graph, manifest_map = load_workflow_process_nodes(test_client, workflow_config)
+    assert isinstance(graph, WorkflowProcessGraph)
+    assert graph
+    for node in graph:
+        assert graph.get_node(node.id) is node
+        assert graph.informed_by_key(node) == tuple(sorted(node.was_informed_by))
+        for do_id in node.has_output:
+            assert graph.producer(do_id) in (node, None)
+        if node.parent:
+            assert node.parent in graph
+    assert graph.get_node("nmdc:missing") is None
+
+
+def test_scheduled_jobs_manifest_index():
+    wf = MagicMock()
+    wf.name = "Reads QC"
+    pooled = MagicMock(manifest="nmdc:manif-1", workflow=wf)
+    single = MagicMock(manifest=None, workflow=wf)
+    jobs = ScheduledJobs([single])
+    jobs.append(pooled)
+    assert len(jobs) == 2
+    assert jobs.find_manifest_job("nmdc:manif-1", "Reads QC") is pooled
+    assert jobs.find_manifest_job("nmdc:manif-1", "Metagenome Assembly") is None
+    jobs.clear()
+    assert jobs.find_manifest_job("nmdc:manif-1", "Reads QC") is None